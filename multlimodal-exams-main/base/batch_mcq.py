@@ -0,0 +1,206 @@
+"""
+Offline batch mode for the MCQ extraction in `text2mcq.py`.
+
+Instead of one synchronous request per page, every page prompt is written into sharded
+batch-request JSONL files (OpenAI Batch API format) with a stable `custom_id` built from the
+parsed file name and the page number. Once the batch jobs are done, their result files are
+ingested and run through `parse_gpt_output` into the usual `mcq/` output.
+
+With `--question_spans`, as in `text2mcq.py`, only the detected question spans are sent (see
+`question_spans.py`): pages without questions get no request, and a page split into several
+chunks gets one request per chunk (`<file>::page-<n>::chunk-<k>` for every chunk after the first). `prepare` records the
+chunks of every page in `<batch_dir>/manifest.json`, which `ingest` checks the results against,
+so it doesn't depend on the span options `prepare` was run with. A page is only ingested when
+all its chunks have a result, every request without one is reported, and the `mcq/` output of a
+file none of whose results came back is left alone.
+
+### How to Use:
+    python batch_mcq.py -d pdfs prepare --batch_dir pdfs/batches
+    (upload the shards, download the result files into pdfs/batch_results)
+    python batch_mcq.py -d pdfs ingest --batch_dir pdfs/batches --results_dir pdfs/batch_results
+
+The ingest step only reads local files, so it can be run against canned results without network.
+"""
+
+import argparse
+import json
+import os
+
+import pandas as pd
+
+from text2mcq import (
+    MODEL,
+    add_span_args,
+    build_rows,
+    list_parsed_files,
+    new_page_stats,
+    page_requests,
+    print_page_stats,
+    record_page_stats,
+    save_results,
+    span_filter_from_args,
+)
+
+
+CUSTOM_ID_SEPARATOR = "::page-"
+CHUNK_SEPARATOR = "::chunk-"
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = "1"
+
+
+def make_custom_id(f, page_num, chunk=0):
+    custom_id = f"{f}{CUSTOM_ID_SEPARATOR}{page_num}"
+    # The first chunk keeps the page id, so full-page batches keep their ids
+    return custom_id if chunk == 0 else f"{custom_id}{CHUNK_SEPARATOR}{chunk}"
+
+
+def save_manifest(batch_dir, chunk_counts):
+    path = os.path.join(batch_dir, MANIFEST_NAME)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+        json.dump({"version": MANIFEST_VERSION, "files": chunk_counts}, file)
+    os.replace(f"{path}.tmp", path)
+
+
+def load_manifest(batch_dir):
+    path = os.path.join(batch_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No {MANIFEST_NAME} in {batch_dir}, run prepare first")
+    with open(path, "r", encoding="utf-8") as file:
+        manifest = json.load(file)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"{path} was written by another version of batch_mcq.py, run prepare again")
+    # {file: {page_num: chunks}}, pages without questions are left out
+    return manifest["files"]
+
+
+def prepare(dir_path, batch_dir, max_requests=50000, max_mb=100, span_filter=None):
+    os.makedirs(batch_dir, exist_ok=True)
+    max_bytes = max_mb * 1024 * 1024
+
+    shard_paths = []
+    shard = None
+    shard_requests = shard_bytes = 0
+
+    def open_shard():
+        path = os.path.join(batch_dir, f"batch_{len(shard_paths):04d}.jsonl")
+        shard_paths.append(path)
+        return open(path, "w", encoding="utf-8")
+
+    chunk_counts = {}
+    stats = new_page_stats()
+    for f in list_parsed_files(dir_path):
+        pages = pd.read_csv(os.path.join(dir_path, "parsed", f))
+        chunk_counts[f] = {}
+        for _, row in pages.iterrows():
+            requests = page_requests(row["parsed_text"], span_filter)
+            record_page_stats(stats, row["parsed_text"], requests, "page {} of {}".format(row["page_num"], f))
+            if requests:
+                chunk_counts[f][str(row["page_num"])] = len(requests)
+            for chunk, (messages, model_args) in enumerate(requests):
+                request = {
+                    "custom_id": make_custom_id(f, row["page_num"], chunk),
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {"model": MODEL, "messages": messages, **model_args},
+                }
+                line = (json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8")
+
+                if shard is None or shard_requests >= max_requests or shard_bytes + len(line) > max_bytes:
+                    if shard is not None:
+                        shard.close()
+                    shard = open_shard()
+                    shard_requests = shard_bytes = 0
+
+                shard.write(line.decode("utf-8"))
+                shard_requests += 1
+                shard_bytes += len(line)
+
+    if shard is not None:
+        shard.close()
+    save_manifest(batch_dir, chunk_counts)
+    if span_filter is not None:
+        print_page_stats(stats)
+
+    print("Batch shards written: {}".format(shard_paths))
+    return shard_paths
+
+
+def read_results(results_dir):
+    responses = {}
+    failures = {}
+    for name in sorted(os.listdir(results_dir)):
+        if not name.endswith(".jsonl"):
+            continue
+        with open(os.path.join(results_dir, name), "r", encoding="utf-8") as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                custom_id = result["custom_id"]
+                response = result.get("response") or {}
+                if result.get("error") or response.get("status_code") != 200:
+                    failures[custom_id] = result.get("error") or response.get("body")
+                    continue
+                text = response["body"]["choices"][0]["message"]["content"].strip()
+                responses[custom_id] = text
+    return responses, failures
+
+
+def ingest(dir_path, results_dir, batch_dir):
+    chunk_counts = load_manifest(batch_dir)
+    responses, failures = read_results(results_dir)
+
+    missing = []
+    for f, page_chunks in chunk_counts.items():
+        pages = pd.read_csv(os.path.join(dir_path, "parsed", f))
+
+        results = list()
+        returned = False
+        for _, row in pages.iterrows():
+            # Pages without questions had no request and have nothing to ingest
+            custom_ids = [
+                make_custom_id(f, row["page_num"], chunk) for chunk in range(page_chunks.get(str(row["page_num"]), 0))
+            ]
+            returned = returned or any(custom_id in responses or custom_id in failures for custom_id in custom_ids)
+            absent = [custom_id for custom_id in custom_ids if custom_id not in responses]
+            if absent:
+                missing.extend(custom_id for custom_id in absent if custom_id not in failures)
+                continue
+            results.extend(build_rows(row, "\n\n".join(responses[custom_id] for custom_id in custom_ids)))
+
+        # A shard that wasn't downloaded yet doesn't overwrite the output with an empty one
+        if page_chunks and not returned:
+            print("No results for {}, its output is left as is".format(f))
+            continue
+        save_results(dir_path, f, results)
+
+    for custom_id, error in failures.items():
+        print("Failed request {}: {}".format(custom_id, error))
+    if missing:
+        print("No result for {} requests: {}".format(len(missing), missing))
+    return failures, missing
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch mode for MCQ extraction")
+
+    parser.add_argument("-d", "--dir", help="", default="pfds")
+
+    parser.add_argument("command", choices=["prepare", "ingest"])
+
+    parser.add_argument("--batch_dir", help="Where the batch request shards and their manifest are written", default=None)
+
+    parser.add_argument("--results_dir", help="Directory with the downloaded batch result files", default=None)
+
+    parser.add_argument("--max_requests", type=int, default=50000, help="Maximum requests per shard")
+
+    parser.add_argument("--max_mb", type=float, default=100, help="Maximum size of a shard in MB")
+
+    add_span_args(parser)
+
+    args = parser.parse_args()
+    batch_dir = args.batch_dir or os.path.join(args.dir, "batches")
+    if args.command == "prepare":
+        prepare(args.dir, batch_dir, args.max_requests, args.max_mb, span_filter_from_args(args))
+    else:
+        ingest(args.dir, args.results_dir or os.path.join(args.dir, "batch_results"), batch_dir)
@@ -0,0 +1,73 @@
+"""
+Manifest of the PDFs processed in corpus mode (`pdf2text_v0.py --input_dir`).
+
+For every PDF it records the size, mtime and content hash, the extractor version and the
+arguments the outputs were produced with. A document is skipped on the next run when all of
+these still match and its layout file exists. The content hash is only recomputed when the
+size or mtime changed, so unchanged corpora are checked without reading the PDFs.
+"""
+
+import hashlib
+import json
+import os
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CorpusManifest:
+    def __init__(self, path, extractor_version, extractor_args):
+        self.path = path
+        self.extractor_version = extractor_version
+        self.extractor_args = extractor_args
+        self.entries = {}
+        # Set when an entry changed since the manifest was loaded or last saved
+        self.changed = False
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                self.entries = json.load(file)
+
+    def is_up_to_date(self, key, pdf_file, layout_file):
+        entry = self.entries.get(key)
+        if entry is None or entry.get("status") != "ok" or not os.path.exists(layout_file):
+            return False
+        if entry["extractor_version"] != self.extractor_version or entry["args"] != self.extractor_args:
+            return False
+
+        stat = os.stat(pdf_file)
+        if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return True
+        if entry["size"] != stat.st_size or entry["sha256"] != file_sha256(pdf_file):
+            return False
+
+        # Touched but identical, remember the new mtime so the hash isn't recomputed next time
+        entry["mtime"] = stat.st_mtime
+        self.changed = True
+        return True
+
+    def record(self, key, pdf_file, status, pages=0, seconds=0.0, error=None):
+        stat = os.stat(pdf_file)
+        self.entries[key] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": file_sha256(pdf_file),
+            "extractor_version": self.extractor_version,
+            "args": self.extractor_args,
+            "status": status,
+            "pages": pages,
+            "seconds": round(seconds, 3),
+            "error": error,
+        }
+        self.changed = True
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self.entries, file, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+        self.changed = False
@@ -0,0 +1,182 @@
+"""
+Image output stage shared by `pdf2text.py` and `pdf2text_v0.py`.
+
+Rendering a region (or decoding an embedded image that PIL can't read) has to happen on the
+parsing thread, since pymupdf objects aren't thread safe. Everything after that, i.e. decoding,
+downscaling, encoding and writing the file, runs on a small thread pool. Jobs go through a
+bounded queue, so the extractor moves on to the next page while the previous page's images
+are still being written, but it can't get arbitrarily far ahead of the disk.
+
+File names are returned as soon as a job is queued. A file is only guaranteed to exist once
+the writer is closed. Files with a fixed name (table and figure crops) are always rewritten,
+since the page they were rendered from or the image options may have changed. Content-addressed
+files are named by a hash of the source bytes and of the encode options, so an existing file
+already holds the right image and is skipped.
+"""
+
+import hashlib
+import io
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pymupdf
+from PIL import Image
+
+from profiling import NullProfiler
+
+
+IMAGE_FORMATS = {"png": ("PNG", "png"), "jpeg": ("JPEG", "jpg"), "webp": ("WEBP", "webp")}
+# Embedded images PIL can decode are handed to the pool as raw bytes
+PIL_DECODABLE = {"png", "jpeg", "jpg", "bmp", "gif", "tiff", "tif"}
+
+
+def add_image_args(parser):
+    parser.add_argument(
+        "--image_dpi",
+        type=int,
+        default=150,
+        help="Resolution used to render table and figure regions",
+    )
+    parser.add_argument(
+        "--image_format",
+        type=str,
+        choices=list(IMAGE_FORMATS),
+        default="png",
+        help="Format of every written image",
+    )
+    parser.add_argument(
+        "--image_compression",
+        type=int,
+        default=None,
+        help="zlib level (0-9) for png, quality (1-100) for jpeg and webp",
+    )
+    parser.add_argument(
+        "--image_max_pixels",
+        type=int,
+        default=None,
+        help="Downscale images larger than this many pixels",
+    )
+    parser.add_argument(
+        "--image_workers",
+        type=int,
+        default=4,
+        help="Threads encoding and writing images",
+    )
+
+
+def image_options(args):
+    return {
+        "dpi": args.image_dpi,
+        "image_format": args.image_format,
+        "compression": args.image_compression,
+        "max_pixels": args.image_max_pixels,
+        "workers": args.image_workers,
+    }
+
+
+class ImageWriter:
+    def __init__(self, images_folder, dpi=150, image_format="png", compression=None, max_pixels=None,
+                 workers=4, queue_size=32, profiler=None):
+        self.images_folder = images_folder
+        self.dpi = dpi
+        self.pil_format, self.extension = IMAGE_FORMATS[image_format]
+        self.compression = compression
+        self.max_pixels = max_pixels
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.submitted = set()
+        self.errors = []
+        self.profiler = profiler or NullProfiler()
+
+    def render_region(self, page, clip, name):
+        clip = pymupdf.Rect(clip)
+        scale = self.dpi / 72
+        pixels = clip.width * clip.height * scale * scale
+        if self.max_pixels is not None and pixels > self.max_pixels:
+            scale *= math.sqrt(self.max_pixels / pixels)
+
+        pix = page.get_pixmap(matrix=pymupdf.Matrix(scale, scale), clip=clip, alpha=False)
+        image_path = self.images_folder / f"{name}.{self.extension}"
+        self._submit(image_path, False, self._pixmap_image, pix.width, pix.height, pix.n, pix.samples)
+        return image_path
+
+    def content_name(self, img_bytes):
+        # The encode options are part of the hash, so changing them doesn't reuse stale files
+        options = f"{self.pil_format}:{self.compression}:{self.max_pixels}:".encode("utf-8")
+        return hashlib.sha256(options + img_bytes).hexdigest()
+
+    def save_pixmap(self, pix, name, content_addressed=False):
+        if pix.alpha:
+            pix = pymupdf.Pixmap(pix, 0)
+        if pix.n not in (1, 3):
+            pix = pymupdf.Pixmap(pymupdf.csRGB, pix)
+        image_path = self.images_folder / f"{name}.{self.extension}"
+        self._submit(image_path, content_addressed, self._pixmap_image, pix.width, pix.height, pix.n, pix.samples)
+        return image_path
+
+    def save_bytes(self, img_bytes):
+        # Named by the content hash, identical images are written once
+        image_path = self.images_folder / f"{self.content_name(img_bytes)}.{self.extension}"
+        self._submit(image_path, True, Image.open, io.BytesIO(img_bytes))
+        return image_path
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        if self.errors:
+            raise self.errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def _pixmap_image(width, height, n, samples):
+        return Image.frombytes("L" if n == 1 else "RGB", (width, height), samples)
+
+    def _submit(self, image_path, content_addressed, load, *load_args):
+        # Within a run every name is written once, fixed names are rewritten across runs
+        if image_path in self.submitted:
+            return
+        self.submitted.add(image_path)
+        if content_addressed and image_path.exists():
+            return
+
+        # Blocks while the queue is full, so parsing can't outrun the writers
+        self.slots.acquire()
+        future = self.executor.submit(self._write, image_path, load, *load_args)
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        self.slots.release()
+        if future.exception() is not None:
+            self.errors.append(future.exception())
+
+    def _write(self, image_path, load, *load_args):
+        # Recorded on the writer thread, without a page
+        with self.profiler.span("encode_image"):
+            self._encode(image_path, load, *load_args)
+
+    def _encode(self, image_path, load, *load_args):
+        image = load(*load_args)
+        if self.max_pixels is not None and image.width * image.height > self.max_pixels:
+            scale = math.sqrt(self.max_pixels / (image.width * image.height))
+            image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))), Image.LANCZOS)
+
+        if self.pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA", "L", "LA"):
+            image = image.convert("RGBA" if "A" in image.mode or "transparency" in image.info else "RGB")
+
+        if self.pil_format == "PNG":
+            options = {"compress_level": 6 if self.compression is None else self.compression}
+        else:
+            options = {"quality": 90 if self.compression is None else self.compression}
+
+        # Write then rename, other workers may be storing the same image
+        tmp_path = image_path.with_name(f"{image_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        image.save(tmp_path, format=self.pil_format, **options)
+        os.replace(tmp_path, image_path)
@@ -0,0 +1,94 @@
+"""
+Content-addressed storage for the images extracted by `pdf2text_v0.py`.
+
+Every image is written once as `<sha256>.<ext>` (hash of the embedded bytes and the encode
+options, extension of the output format), no matter how many pages (or worker processes) reference it, and each xref is
+extracted at most once per document. Encoding and writing are left to an `ImageWriter`.
+`filter_repeated_images` optionally drops decorations (logos, headers, ...) that show up
+near-identical on many pages, using a difference hash of the stored file.
+"""
+
+import os
+
+import pymupdf
+from PIL import Image
+
+from image_output import PIL_DECODABLE
+
+
+class ImageStore:
+    def __init__(self, doc, image_writer, by_xref=None):
+        self.doc = doc
+        self.image_writer = image_writer
+        # Paths of xrefs already stored, e.g. by the parent process of the page-range workers
+        self.by_xref = dict(by_xref or {})
+
+    def save_document_images(self):
+        for page in self.doc:
+            for img in page.get_images(full=True):
+                self.save_xref(img[0])
+        return self.by_xref
+
+    def save_xref(self, xref):
+        image_path = self.by_xref.get(xref)
+        if image_path is None:
+            base_image = self.doc.extract_image(xref)
+            if base_image["ext"] in PIL_DECODABLE:
+                image_path = self.image_writer.save_bytes(base_image["image"])
+            else:
+                # Formats PIL can't read (jbig2, jpx, ...) are decoded by pymupdf on this thread
+                image_path = self.image_writer.save_pixmap(
+                    pymupdf.Pixmap(self.doc, xref),
+                    self.image_writer.content_name(base_image["image"]),
+                    content_addressed=True,
+                )
+            self.by_xref[xref] = image_path
+        return image_path
+
+
+def dhash(image_path, size=8):
+    with Image.open(image_path) as image:
+        pixels = list(image.convert("L").resize((size + 1, size), Image.LANCZOS).getdata())
+
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+
+def filter_repeated_images(pages_content, max_distance, min_pages=3):
+    # Group stored images whose hashes are within max_distance bits of a group representative
+    representatives = []
+    group_of = {}
+    pages_of_group = []
+    for page in pages_content:
+        for item in page["layout"]:
+            if item["type"] != "image":
+                continue
+            image_path = item["content"]
+            if image_path not in group_of:
+                image_hash = dhash(image_path)
+                for group, representative in enumerate(representatives):
+                    if bin(image_hash ^ representative).count("1") <= max_distance:
+                        break
+                else:
+                    group = len(representatives)
+                    representatives.append(image_hash)
+                    pages_of_group.append(set())
+                group_of[image_path] = group
+            pages_of_group[group_of[image_path]].add(page["page_number"])
+
+    decorations = {group for group, pages in enumerate(pages_of_group) if len(pages) >= min_pages}
+    for page in pages_content:
+        page["layout"] = [
+            item for item in page["layout"]
+            if item["type"] != "image" or group_of[item["content"]] not in decorations
+        ]
+
+    for image_path, group in group_of.items():
+        if group in decorations:
+            os.remove(image_path)
+    return pages_content
@@ -0,0 +1,98 @@
+"""
+Streaming (NDJSON) layout output for `pdf2text.py` and `pdf2text_v0.py`.
+
+With `--output_format ndjson` the extractors write one JSON record per page as soon as it is done
+and flush it, instead of holding the whole document and dumping a single array at the end. A
+final `{"_complete": true, ...}` line marks a finished file, so readers can follow the file while
+the extraction is still running.
+
+### How to Use:
+Rebuild the array format (`pages_content.json` / `document_content.json`) from a stream:
+    python layout_stream.py --ndjson_path "path/to/pages_content.ndjson" --output_path "path/to/pages_content.json"
+"""
+
+import argparse
+import json
+import time
+
+
+COMPLETE_MARKER = "_complete"
+
+
+class LayoutWriter:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "w", encoding="utf-8")
+        self.count = 0
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.count += 1
+
+    def close(self, complete=True):
+        if complete:
+            self.file.write(json.dumps({COMPLETE_MARKER: True, "pages": self.count}) + "\n")
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # An interrupted extraction leaves the stream without the marker
+        self.close(complete=exc_type is None)
+
+
+def iter_layout(path, follow=False, poll_interval=0.5):
+    with open(path, "r", encoding="utf-8") as file:
+        pending = ""
+        while True:
+            line = file.readline()
+            if not line:
+                if not follow:
+                    return
+                time.sleep(poll_interval)
+                continue
+
+            pending += line
+            if not pending.endswith("\n"):
+                # The writer is in the middle of a record
+                continue
+
+            record = json.loads(pending)
+            pending = ""
+            if COMPLETE_MARKER in record:
+                return
+            yield record
+
+
+def load_layout(path):
+    return list(iter_layout(path))
+
+
+def ndjson_to_json(ndjson_path, output_path):
+    with open(output_path, "w", encoding="utf-8") as json_file:
+        json.dump(load_layout(ndjson_path), json_file, ensure_ascii=False, indent=4)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="NDJSON layout to JSON array")
+    parser.add_argument(
+        "--ndjson_path",
+        type=str,
+        required=True,
+        help="Path to the streamed layout file",
+    )
+    parser.add_argument(
+        "--output_path",
+        type=str,
+        required=True,
+        help="Path of the JSON array file to write",
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    ndjson_to_json(args.ndjson_path, args.output_path)
@@ -0,0 +1,64 @@
+"""
+Append-only journal of the MCQ rows produced for each page of a parsed file.
+
+Every page is written as one JSON line (`{"page_num": ..., "rows": [...]}`) and flushed to disk as
+soon as its response arrives, so the journal doubles as the checkpoint of completed pages. A crash
+loses at most the page in flight; `--resume` reads the journal back and skips those pages.
+"""
+
+import json
+import os
+
+
+def _to_json(value):
+    # pandas hands out numpy scalars
+    return value.item() if hasattr(value, "item") else str(value)
+
+
+def _page_key(page_num):
+    return _to_json(page_num) if hasattr(page_num, "item") else page_num
+
+
+class PageJournal:
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.records = {}
+        if resume and os.path.exists(path):
+            self.records = self._read()
+        self.file = open(path, "a" if resume else "w", encoding="utf-8")
+
+    def _read(self):
+        records = {}
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Partially written last line from an interrupted run
+                    continue
+                records[record["page_num"]] = record["rows"]
+        return records
+
+    def is_completed(self, page_num):
+        return _page_key(page_num) in self.records
+
+    def append(self, page_num, rows):
+        page_num = _page_key(page_num)
+        line = json.dumps({"page_num": page_num, "rows": rows}, ensure_ascii=False, default=_to_json)
+        self.file.write(line + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.records[page_num] = json.loads(line)["rows"]
+
+    def rows_in_order(self, page_nums):
+        results = []
+        for page_num in page_nums:
+            results.extend(self.records.get(_page_key(page_num), []))
+        return results
+
+    def close(self):
+        self.file.close()
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
@@ -1,7 +1,8 @@
 import argparse
 import json
+from collections import defaultdict
 from pathlib import Path
-from pdf2image import convert_from_path
+import numpy as np
 from pdfminer.layout import LAParams
 from pdfminer.pdfparser import PDFParser
 from pdfminer.pdfdocument import PDFDocument
@@ -10,7 +11,10 @@ from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
 from pdfminer.converter import PDFPageAggregator
 from pdfminer.layout import LAParams, LTTextBox, LTFigure
 import pymupdf
-from sklearn.cluster import DBSCAN
+from image_output import ImageWriter, add_image_args, image_options
+from layout_stream import LayoutWriter
+from profiling import NullProfiler, make_profiler
+from table_detection import TableDetector, add_table_args, table_options
 
 
 # Function to combine bounding boxes
@@ -23,38 +27,112 @@ def combine_bounding_boxes(bounding_boxes):
 
 
 class Figure:
-    def __init__(self, elements):
-        self.elements = elements
-        self.bbox = self._combine_bounding_boxes([el.bbox for el in elements])
+    __slots__ = ("bbox", "size")
 
-    def _combine_bounding_boxes(self, bounding_boxes):
-        x0 = min(box[0] for box in bounding_boxes)
-        y0 = min(box[1] for box in bounding_boxes)
-        x1 = max(box[2] for box in bounding_boxes)
-        y1 = max(box[3] for box in bounding_boxes)
-        return x0, y0, x1, y1
+    def __init__(self, bbox, size):
+        self.bbox = bbox
+        self.size = size  # Number of merged fragments
 
 
 class Table:
+    __slots__ = ("bbox",)
+
+    def __init__(self, bbox):
+        self.bbox = bbox
+
+
+class TextBlock:
+    # Stand-in for pdfminer's LTTextBox when the layout comes from pymupdf
+    __slots__ = ("bbox", "text")
+
+    def __init__(self, bbox, text):
+        self.bbox = bbox
+        self.text = text
+
+    def get_text(self):
+        return self.text
+
+
+class ImageBlock:
+    # Stand-in for pdfminer's LTFigure when the layout comes from pymupdf
+    __slots__ = ("bbox",)
+
     def __init__(self, bbox):
         self.bbox = bbox
 
 
+# Function to group bounding boxes that overlap or are within eps of each other
+def cluster_bboxes(bboxes, eps):
+    count = len(bboxes)
+    # Boxes grown by eps/2 on every side overlap exactly when the gap between them is <= eps
+    expanded = bboxes + np.array([-eps / 2, -eps / 2, eps / 2, eps / 2])
+
+    # Bucket the expanded boxes on a grid: one (cell, box) entry for every cell a box covers
+    sizes = np.maximum(bboxes[:, 2] - bboxes[:, 0], bboxes[:, 3] - bboxes[:, 1])
+    cell = max(float(eps), float(np.median(sizes)), 1.0)
+    cells = np.floor(expanded / cell).astype(np.int64)
+    span_x = cells[:, 2] - cells[:, 0] + 1
+    span_y = cells[:, 3] - cells[:, 1] + 1
+    covered = span_x * span_y
+    box_idx = np.repeat(np.arange(count), covered)
+    offset = np.arange(covered.sum()) - np.repeat(np.cumsum(covered) - covered, covered)
+    cell_x = cells[box_idx, 0] + offset % span_x[box_idx]
+    cell_y = cells[box_idx, 1] + offset // span_x[box_idx]
+
+    # Candidate pairs are boxes sharing a cell
+    order = np.lexsort((box_idx, cell_y, cell_x))
+    box_idx, cell_x, cell_y = box_idx[order], cell_x[order], cell_y[order]
+    new_cell = np.r_[True, (cell_x[1:] != cell_x[:-1]) | (cell_y[1:] != cell_y[:-1])]
+    cell_end = np.r_[np.flatnonzero(new_cell)[1:], len(box_idx)][np.cumsum(new_cell) - 1]
+    partners = cell_end - np.arange(len(box_idx)) - 1
+    first = np.repeat(np.arange(len(box_idx)), partners)
+    second = first + 1 + np.arange(partners.sum()) - np.repeat(np.cumsum(partners) - partners, partners)
+    i, j = box_idx[first], box_idx[second]
+
+    a, b = expanded[i], expanded[j]
+    overlap = (a[:, 0] <= b[:, 2]) & (b[:, 0] <= a[:, 2]) & (a[:, 1] <= b[:, 3]) & (b[:, 1] <= a[:, 3])
+    i, j = i[overlap], j[overlap]
+
+    # Union-find over the edges: hook roots onto the smaller root and compress until stable
+    parent = np.arange(count)
+    while True:
+        root_i, root_j = parent[i], parent[j]
+        low = np.minimum(root_i, root_j)
+        np.minimum.at(parent, root_i, low)
+        np.minimum.at(parent, root_j, low)
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+        if np.array_equal(parent[i], parent[j]):
+            break
+
+    _, labels = np.unique(parent, return_inverse=True)
+    return labels
+
+
 # Function to apply clustering on bounding boxes
 def cluster_figures(elements, eps=300):
-    centers = [
-        (element.bbox[0], element.bbox[1]) for element in elements
-    ]  # Bottom-left corner as coordinates
-    clustering = DBSCAN(eps=eps, min_samples=2).fit(centers)
-    clusters = {}
-    for idx, label in enumerate(clustering.labels_):
-        if label not in clusters:
-            clusters[label] = []
-        clusters[label].append(elements[idx])
-    figures = []
-    for label, cluster in clusters.items():
-        figures.append(Figure(cluster))
-    return figures
+    bboxes = np.array([element.bbox for element in elements], dtype=float).reshape(-1, 4)
+    labels = cluster_bboxes(bboxes, eps)
+
+    # Combine the boxes of every cluster at once, in order of first appearance
+    order = np.argsort(labels, kind="stable")
+    sorted_labels = labels[order]
+    starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+    sorted_boxes = bboxes[order]
+    x0 = np.minimum.reduceat(sorted_boxes[:, 0], starts)
+    y0 = np.minimum.reduceat(sorted_boxes[:, 1], starts)
+    x1 = np.maximum.reduceat(sorted_boxes[:, 2], starts)
+    y1 = np.maximum.reduceat(sorted_boxes[:, 3], starts)
+    sizes = np.diff(np.r_[starts, len(order)])
+    first_seen = np.argsort(order[starts], kind="stable")
+
+    return [
+        Figure((float(x0[i]), float(y0[i]), float(x1[i]), float(y1[i])), int(sizes[i]))
+        for i in first_seen
+    ]
 
 
 def sort_bounding_boxes(objects, y_tolerance=5):
@@ -64,12 +142,13 @@ def sort_bounding_boxes(objects, y_tolerance=5):
     )
 
 
-def extract_pdf_content(pdf_file, output_dir, args):
+def to_bottom_left(bbox, page_height):
+    # pymupdf uses a top-left origin, pdfminer (and the sorting/cropping below) a bottom-left one
+    x0, y0, x1, y1 = bbox
+    return x0, page_height - y1, x1, page_height - y0
 
-    # Prepare output paths
-    images_folder = output_dir / "images"
-    images_folder.mkdir(exist_ok=True)
 
+def pdfminer_layout(pdf_file, profiler):
     # Inidialize PDF handlers
     pdf = open(pdf_file, "rb")
     parser = PDFParser(pdf)
@@ -79,59 +158,116 @@ def extract_pdf_content(pdf_file, output_dir, args):
     laparams = LAParams()
     device = PDFPageAggregator(rsrcmgr, laparams=laparams)
     interpreter = PDFPageInterpreter(rsrcmgr, device)
-    pymupdf_doc = pymupdf.open(pdf_file)
 
-    result = []
-    for page_num, page in enumerate(PDFPage.create_pages(doc)):
-        # Get layout
-        page_image = convert_from_path(
-            pdf_file,
-            first_page=page_num,
-            last_page=page_num + 1,
-            size=(page.mediabox[2], page.mediabox[3]),
-        )[0]
-        interpreter.process_page(page)
-        layout = device.get_result()
-
-        # Extract layout elements
+    for page_num, page in enumerate(PDFPage.create_pages(doc), start=1):
+        with profiler.span("process_page", page_num):
+            interpreter.process_page(page)
+            layout = device.get_result()
         lt_objs = [element for element in layout]
         figures = [element for element in lt_objs if isinstance(element, (LTFigure))]
-        tables = [Table(table.bbox) for table in pymupdf_doc[page_num].find_tables()]
+        yield lt_objs, figures
+    pdf.close()
+
+
+def pymupdf_layout(pymupdf_doc, profiler):
+    # Text blocks and image placements from the same document used for tables and crops,
+    # so the file is only parsed once
+    for page_num, page in enumerate(pymupdf_doc, start=1):
+        page_height = page.rect.height
+        lt_objs = []
+        with profiler.span("get_text", page_num):
+            blocks = page.get_text("blocks")
+        for block in blocks:
+            x0, y0, x1, y1, text, _, block_type = block
+            if block_type == 0:
+                lt_objs.append(TextBlock(to_bottom_left((x0, y0, x1, y1), page_height), text))
+        with profiler.span("get_image_info", page_num):
+            figures = [
+                ImageBlock(to_bottom_left(info["bbox"], page_height))
+                for info in page.get_image_info()
+            ]
+        yield lt_objs + figures, figures
+
 
-        if figures:
+def render_region(page, bbox, image_writer, name):
+    # Rasterize only the clipped region instead of the whole page
+    x0, y0, x1, y1 = to_bottom_left(bbox, page.rect.height)
+    return image_writer.render_region(page, pymupdf.Rect(x0, y0, x1, y1), name)
+
+
+def iter_pdf_content(pdf_file, output_dir, args, profiler=None):
+    profiler = profiler or NullProfiler()
+
+    # Prepare output paths
+    images_folder = output_dir / "images"
+    images_folder.mkdir(exist_ok=True)
+
+    pymupdf_doc = pymupdf.open(pdf_file)
+    if args.layout_backend == "pymupdf":
+        layouts = pymupdf_layout(pymupdf_doc, profiler)
+    else:
+        layouts = pdfminer_layout(pdf_file, profiler)
+
+    image_writer = ImageWriter(images_folder, profiler=profiler, **image_options(args))
+    with image_writer, TableDetector(**table_options(args, pdf_file, output_dir)) as table_detector:
+        yield from iter_pages(pymupdf_doc, layouts, image_writer, table_detector, args, profiler)
+
+
+def iter_pages(pymupdf_doc, layouts, image_writer, table_detector, args, profiler):
+    layouts = iter(layouts)
+    for page_num in range(pymupdf_doc.page_count):
+        # The layout is pulled inside the span, so the page time includes the parsing
+        with profiler.span("page", page_num + 1):
+            layout = next(layouts, None)
+            if layout is None:
+                break
+            page_content = extract_page(
+                pymupdf_doc[page_num], page_num, *layout, image_writer, table_detector, args, profiler
+            )
+        yield {"page": page_num + 1, "content": page_content}
+
+
+def extract_page(pymupdf_page, page_num, lt_objs, figures, image_writer, table_detector, args, profiler):
+    with profiler.span("find_tables", page_num + 1):
+        tables = [Table(bbox) for bbox in table_detector.find(pymupdf_page)]
+    profiler.count(page_num + 1, "tables", len(tables))
+    profiler.count(page_num + 1, "images", len(figures))
+
+    if figures:
+        with profiler.span("cluster_figures", page_num + 1):
             clustered_figures = cluster_figures(figures, eps=args.cluster_margin)
-            lt_objs = [element for element in lt_objs if element not in figures]
-            for figure in clustered_figures:
-                lt_objs.append(figure)
-        if tables:
-            for table in tables:
-                lt_objs.append(table)
+        profiler.count(page_num + 1, "figures", len(clustered_figures))
+        figure_ids = {id(element) for element in figures}
+        lt_objs = [element for element in lt_objs if id(element) not in figure_ids]
+        for figure in clustered_figures:
+            lt_objs.append(figure)
+    if tables:
+        for table in tables:
+            lt_objs.append(table)
+    with profiler.span("sort", page_num + 1):
         sorted_lt = sort_bounding_boxes(lt_objs)
 
-        # Create output layout
-        page_content = []
-        for t, element in enumerate(sorted_lt):
-            if isinstance(element, (LTTextBox)):  # Add other types if needed
-                page_content.append(element.get_text().strip())
+    # Create output layout
+    page_content = []
+    for t, element in enumerate(sorted_lt):
+        if isinstance(element, (LTTextBox, TextBlock)):  # Add other types if needed
+            page_content.append(element.get_text().strip())
+
+        if isinstance(element, Figure):
+            with profiler.span("render_figure", page_num + 1):
+                image_path = render_region(pymupdf_page, element.bbox, image_writer, f"image_page-{page_num}_im-{t}")
+            page_content.append(f"<image>{image_path.name}</image>")
 
-            if isinstance(element, Figure):
-                image_name = f"image_page-{page_num}_im-{t}.jpg"
-                page_content.append(f"<image>{image_name}</image>")
-                x0, y0, x1, y1 = element.bbox
-                image_height = page_image.height
-                crop_box = (x0, image_height - y1, x1, image_height - y0)
-                cropped_image = page_image.crop(crop_box)
-                cropped_image.save(images_folder / image_name)
+        if isinstance(element, Table):
+            with profiler.span("render_table", page_num + 1):
+                table_path = image_writer.render_region(pymupdf_page, element.bbox, f"table_page-{page_num}_im-{t}")
+            page_content.append(f"<image>{table_path.name}</image>")
 
-            if isinstance(element, Table):
-                table_name = f"table_page-{page_num}_im-{t}.jpg"
-                page_content.append(f"<image>{table_name}</image>")
-                pix = pymupdf_doc[page_num].get_pixmap(clip=table.bbox)
-                pix.save(images_folder / table_name)
+    return " ".join(page_content)
 
-        page_content = " ".join(page_content)
-        result.append({"page": page_num + 1, "content": page_content})
-    return result
+
+def extract_pdf_content(pdf_file, output_dir, args, profiler=None):
+    return list(iter_pdf_content(pdf_file, output_dir, args, profiler))
 
 
 def main():
@@ -139,16 +275,26 @@ def main():
     pdf_file = Path(args.pdf_path)
 
     # Prepare output paths
-    if output_dir is None:
+    if args.output_dir is None:
         output_dir = pdf_file.parent / pdf_file.stem
     else:
         output_dir = Path(args.output_dir)
     output_dir.mkdir(exist_ok=True)
+    profiler = make_profiler(args.profile)
 
-    content = extract_pdf_content(pdf_file, output_dir, args)
-    output_file = Path(output_dir) / "document_content.json"
-    with open(output_file, "w", encoding="utf-8") as json_file:
-        json.dump(content, json_file, ensure_ascii=False, indent=4)
+    if args.output_format == "ndjson":
+        with LayoutWriter(output_dir / "document_content.ndjson") as writer:
+            for page_content in iter_pdf_content(pdf_file, output_dir, args, profiler):
+                writer.write(page_content)
+    else:
+        content = extract_pdf_content(pdf_file, output_dir, args, profiler)
+        output_file = Path(output_dir) / "document_content.json"
+        with open(output_file, "w", encoding="utf-8") as json_file:
+            json.dump(content, json_file, ensure_ascii=False, indent=4)
+
+    if profiler.enabled:
+        profiler.write_trace(output_dir / "profile_trace.json")
+        print(profiler.summary())
 
 
 def parse_args():
@@ -171,6 +317,27 @@ def parse_args():
         default=50,
         help="Marging for the clustering algorithm",
     )
+    parser.add_argument(
+        "--layout_backend",
+        type=str,
+        choices=["pdfminer", "pymupdf"],
+        default="pdfminer",
+        help="Library used for the text/figure layout (pymupdf parses the PDF only once)",
+    )
+    parser.add_argument(
+        "--output_format",
+        type=str,
+        choices=["json", "ndjson"],
+        default="json",
+        help="ndjson streams one record per page as soon as it is extracted",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Time every stage of every page, write profile_trace.json and print the slowest pages and stages",
+    )
+    add_image_args(parser)
+    add_table_args(parser)
     args = parser.parse_args()
     return args
 
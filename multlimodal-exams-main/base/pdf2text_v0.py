@@ -6,7 +6,7 @@ It utilizes the PyMuPDF library (pymupdf) for PDF parsing and extraction.
 
 Key Features:
 1. **Text Extraction**: Extracts all text content from each page in the PDF.
-2. **Image Extraction**: Extracts images embedded within the PDF and saves them as separate image files.
+2. **Image Extraction**: Extracts images embedded within the PDF and saves each distinct image once, named by its content hash.
 3. **Table Extraction**: Detects and extracts tables from the PDF pages, saving table regions as images.
 4. **JSON Layout Representation**: Outputs a structured JSON file (`pages_content.json`) containing:
    - Page numbers
@@ -23,85 +23,321 @@ A directory with the following:
 Run the script with the following arguments:
     --pdf_path: Path to the input PDF file.
     --output_dir: Directory to save the extracted content.
+    --workers: Number of processes the pages are split across (default: 1).
+    --phash_distance: Drop near-identical images repeated on many pages (off by default).
+    --output_format: `json` (default) or `ndjson` to stream one record per page to `pages_content.ndjson`.
+    --table_cache / --no_table_cache / --no_table_prefilter: Table bounding boxes are cached per document
+        hash, page and settings (in `table_cache.sqlite` of the output directory by default), and
+        table detection only runs on pages with ruling lines.
+    --profile: Time every stage of every page, write `profile_trace.json` (Chrome trace events) to the
+        output directory and print the slowest pages and stages.
+    --image_dpi / --image_format / --image_compression / --image_max_pixels: How tables are rendered and
+        images are encoded (150 DPI PNG by default). Images are written by `--image_workers` threads.
+    --input_dir: Process every PDF under this directory instead of a single `--pdf_path`. `--workers`
+        then sets how many documents are processed in parallel, and a `manifest.json` in the output
+        directory is used to skip documents whose outputs are up to date.
 
 Example:
     python script.py --pdf_path "path/to/input.pdf" --output_dir "path/to/output_dir"
+    python script.py --input_dir "path/to/pdfs" --output_dir "path/to/output_dir" --workers 8
 """
 
 import argparse
 import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 import pymupdf
 from tqdm import tqdm
+from corpus_manifest import CorpusManifest
+from image_output import ImageWriter, add_image_args, image_options
+from image_store import ImageStore, filter_repeated_images
+from layout_stream import LayoutWriter
+from profiling import make_profiler
+from table_detection import TableDetector, add_table_args, table_options
+
+
+# Bump when a change to the extraction alters its output, corpus runs then redo every document
+EXTRACTOR_VERSION = "2"
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="PDF to Text")
-    parser.add_argument(
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
         "--pdf_path",
         type=str,
-        required=True,
         help="Path to the PDF file",
     )
+    source.add_argument(
+        "--input_dir",
+        type=str,
+        help="Directory with the PDF files to process",
+    )
     parser.add_argument(
         "--output_dir",
         type=str,
         default=None,
         help="Directory to store results",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes to split the pages (or, with --input_dir, the documents) across",
+    )
+    parser.add_argument(
+        "--phash_distance",
+        type=int,
+        default=None,
+        help="Drop images within this many bits (perceptual hash) of an image repeated on many pages",
+    )
+    parser.add_argument(
+        "--phash_min_pages",
+        type=int,
+        default=3,
+        help="Number of pages an image must repeat on to be dropped as a decoration",
+    )
+    parser.add_argument(
+        "--output_format",
+        type=str,
+        choices=["json", "ndjson"],
+        default="json",
+        help="ndjson streams one record per page as soon as it is extracted",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Time every stage of every page, write profile_trace.json and print the slowest pages and stages",
+    )
+    add_image_args(parser)
+    add_table_args(parser)
     args = parser.parse_args()
+    if args.output_format == "ndjson" and args.phash_distance is not None:
+        parser.error("--phash_distance needs the whole document and can't be used with --output_format ndjson")
     return args
 
 
-def main():
-    args = parse_args()
-    pdf_file = Path(args.pdf_path)
+def extract_page(page, page_num, image_writer, image_store, table_detector, profiler):
+    page_content = {"page_number": page_num, "layout": []}
+
+    page_layout = page_content["layout"]
+    with profiler.span("get_text", page_num):
+        text = page.get_text()
+    page_layout.append({"type": "text", "content": text})
+
+    with profiler.span("save_images", page_num):
+        images = page.get_images(full=True)
+        for img in images:
+            xref = img[0]
+            image_path = image_store.save_xref(xref)
+            page_layout.append({"type": "image", "content": str(image_path)})
+    profiler.count(page_num, "images", len(images))
+
+    with profiler.span("find_tables", page_num):
+        tables = table_detector.find(page)
+    profiler.count(page_num, "tables", len(tables))
+    for tab_num, bbox in enumerate(tables):
+        with profiler.span("render_table", page_num):
+            table_path = image_writer.render_region(page, bbox, f"table_page{page_num}_im{tab_num}")
+        page_layout.append({"type": "table", "content": str(table_path)})
+    return page_content
+
+
+def extract_page_range(pdf_file, images_folder, first_page, last_page, options, tables, image_paths, profile=False):
+    # Every worker opens its own document, pymupdf handles can't be shared across processes
     doc = pymupdf.open(pdf_file)
+    profiler = make_profiler(profile)
+    pages_content = []
+    image_writer = ImageWriter(images_folder, profiler=profiler, **options)
+    with image_writer, TableDetector(**tables) as table_detector:
+        image_store = ImageStore(doc, image_writer, image_paths)
+        for page_index in range(first_page, last_page):
+            page = doc[page_index]
+            with profiler.span("page", page_index + 1):
+                pages_content.append(
+                    extract_page(page, page_index + 1, image_writer, image_store, table_detector, profiler)
+                )
+    doc.close()
+    return pages_content, profiler.export()
 
-    if output_dir is None:
-        output_dir = pdf_file.parent / pdf_file.stem
-    else:
-        output_dir = Path(args.output_dir)
-    output_dir.mkdir(exist_ok=True)
+
+def split_page_ranges(page_count, workers):
+    # Contiguous ranges keep the merge trivial; a few more shards than workers evens out slow pages
+    shards = min(page_count, workers * 4)
+    if shards == 0:
+        return []
+    bounds = [round(i * page_count / shards) for i in range(shards + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(shards) if bounds[i] < bounds[i + 1]]
+
+
+def extract_parallel(doc, pdf_file, images_folder, workers, options, tables, profiler):
+    page_count = doc.page_count
+    page_ranges = split_page_ranges(page_count, workers)
+    # Embedded images are stored once per document here, before the pages are split, so an image
+    # repeated across page ranges isn't hashed and encoded by every worker. The workers only look
+    # up the paths; they are encoded by this writer's threads while the workers run.
+    with ImageWriter(images_folder, profiler=profiler, **options) as image_writer:
+        with profiler.span("save_images"):
+            image_paths = ImageStore(doc, image_writer).save_document_images()
+        doc.close()
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    extract_page_range,
+                    pdf_file,
+                    images_folder,
+                    first,
+                    last,
+                    options,
+                    tables,
+                    image_paths,
+                    profiler.enabled,
+                )
+                for first, last in page_ranges
+            ]
+            # Collect in submission order so pages stay sorted
+            with tqdm(total=page_count) as progress:
+                for future in futures:
+                    shard, profile = future.result()
+                    profiler.merge(profile)
+                    progress.update(len(shard))
+                    yield from shard
+
+
+def extract_serial(doc, images_folder, options, tables, profiler, progress=True):
+    # The writer is closed, i.e. every image is on disk, once the last page has been consumed
+    image_writer = ImageWriter(images_folder, profiler=profiler, **options)
+    with image_writer, TableDetector(**tables) as table_detector:
+        image_store = ImageStore(doc, image_writer)
+        for page_num, page in tqdm(enumerate(doc, start=1), disable=not progress):
+            with profiler.span("page", page_num):
+                page_content = extract_page(page, page_num, image_writer, image_store, table_detector, profiler)
+            yield page_content
+
+
+def layout_path(output_dir, output_format):
+    return output_dir / ("pages_content.ndjson" if output_format == "ndjson" else "pages_content.json")
+
+
+def extract_document(pdf_file, output_dir, args, workers, progress=True):
+    doc = pymupdf.open(pdf_file)
+    output_dir.mkdir(parents=True, exist_ok=True)
 
     images_folder = output_dir / "images"
     images_folder.mkdir(exist_ok=True)
 
-    pages_content = []
-    for page_num, page in tqdm(enumerate(doc, start=1)):
-        page_content = {"page_number": page_num, "layout": []}
+    profiler = make_profiler(args.profile)
+    tables = table_options(args, pdf_file, output_dir)
+    page_count = doc.page_count
+    if workers > 1:
+        pages = extract_parallel(doc, pdf_file, images_folder, workers, image_options(args), tables, profiler)
+    else:
+        pages = extract_serial(doc, images_folder, image_options(args), tables, profiler, progress)
 
-        page_layout = page_content["layout"]
-        text = page.get_text()
-        page_layout.append({"type": "text", "content": text})
+    if args.output_format == "ndjson":
+        with LayoutWriter(layout_path(output_dir, args.output_format)) as writer:
+            for page_content in pages:
+                writer.write(page_content)
+    else:
+        pages_content = list(pages)
+        if args.phash_distance is not None:
+            with profiler.span("filter_repeated_images"):
+                pages_content = filter_repeated_images(pages_content, args.phash_distance, args.phash_min_pages)
 
-        images = page.get_images(full=True)
-        for img_num, img in enumerate(images):
-            xref = img[0]
-            base_image = doc.extract_image(xref)
-            img_format = base_image["ext"]
-            img_bytes = base_image["image"]
+        with open(layout_path(output_dir, args.output_format), "w", encoding="utf-8") as json_file:
+            json.dump(pages_content, json_file, ensure_ascii=False, indent=4)
 
-            image_name = f"image_page{page_num}_im{img_num}.{img_format}"
-            image_path = images_folder / image_name
+    if profiler.enabled:
+        profiler.write_trace(output_dir / "profile_trace.json")
+        # Corpus runs only keep the trace, one summary per document would drown the progress output
+        if progress:
+            print(profiler.summary())
+    return page_count
 
-            with open(image_path, "wb") as img_file:
-                img_file.write(img_bytes)
 
-            page_layout.append({"type": "image", "content": str(image_path)})
+def extract_corpus_document(pdf_file, output_dir, args):
+    start = time.perf_counter()
+    try:
+        pages = extract_document(pdf_file, output_dir, args, workers=1, progress=False)
+        return pages, time.perf_counter() - start, None
+    except Exception as e:
+        return 0, time.perf_counter() - start, f"{type(e).__name__}: {e}"
+
+
+def extract_corpus(args):
+    input_dir = Path(args.input_dir)
+    output_root = Path(args.output_dir) if args.output_dir is not None else input_dir
+    output_root.mkdir(parents=True, exist_ok=True)
+
+    # Only the arguments that change the outputs invalidate them
+    extractor_args = {
+        "phash_distance": args.phash_distance,
+        "phash_min_pages": args.phash_min_pages,
+        "output_format": args.output_format,
+        **{key: value for key, value in image_options(args).items() if key != "workers"},
+        "table_prefilter": not args.no_table_prefilter,
+    }
+    # One table cache for the whole corpus instead of one per document
+    if args.table_cache is None:
+        args.table_cache = str(output_root / "table_cache.sqlite")
+    manifest = CorpusManifest(str(output_root / "manifest.json"), EXTRACTOR_VERSION, extractor_args)
+
+    pending = {}
+    skipped = 0
+    for pdf_file in sorted(input_dir.rglob("*.pdf")):
+        key = str(pdf_file.relative_to(input_dir))
+        output_dir = output_root / Path(key).with_suffix("")
+        if manifest.is_up_to_date(key, pdf_file, layout_path(output_dir, args.output_format)):
+            skipped += 1
+            continue
+        pending[key] = (pdf_file, output_dir)
+    # Refreshed mtimes of touched documents are kept even if nothing has to be processed
+    if manifest.changed:
+        manifest.save()
+    print(f"{len(pending)} documents to process, {skipped} up to date")
+
+    summary = []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(extract_corpus_document, pdf_file, output_dir, args): key
+            for key, (pdf_file, output_dir) in pending.items()
+        }
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            key = futures[future]
+            pages, seconds, error = future.result()
+            status = "ok" if error is None else "failed"
+            manifest.record(key, pending[key][0], status, pages, seconds, error)
+            # Saved after every document so an interrupted run keeps its progress
+            manifest.save()
+            summary.append((key, status, pages, seconds, error))
+
+    for key, status, pages, seconds, error in sorted(summary):
+        pages_per_sec = pages / seconds if seconds > 0 else 0.0
+        line = f"{status:6} {key}: {pages} pages in {seconds:.1f}s ({pages_per_sec:.2f} pages/s)"
+        print(line if error is None else f"{line} - {error}")
+
+    failures = sum(1 for _, status, *_ in summary if status != "ok")
+    total_pages = sum(pages for _, _, pages, _, _ in summary)
+    total_seconds = sum(seconds for _, _, _, seconds, _ in summary)
+    print(f"Processed {len(summary)} documents ({total_pages} pages, {total_seconds:.1f}s of work), "
+          f"{failures} failed, {skipped} skipped")
+
+
+def main():
+    args = parse_args()
+    if args.input_dir is not None:
+        extract_corpus(args)
+        return
+
+    pdf_file = Path(args.pdf_path)
+    if args.output_dir is None:
+        output_dir = pdf_file.parent / pdf_file.stem
+    else:
+        output_dir = Path(args.output_dir)
 
-        tables = page.find_tables()
-        for tab_num, table in enumerate(tables):
-            table_name = f"table_page{page_num}_im{tab_num}.png"
-            pix = page.get_pixmap(clip=table.bbox)
-            table_path = images_folder / table_name
-            pix.save(table_path)
-            page_layout.append({"type": "table", "content": str(table_path)})
-        pages_content.append(page_content)
-
-    layout_file = output_dir / "pages_content.json"
-    with open(layout_file, "w", encoding="utf-8") as json_file:
-        json.dump(pages_content, json_file, ensure_ascii=False, indent=4)
+    extract_document(pdf_file, output_dir, args, args.workers)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,112 @@
+"""
+Per-page, per-stage profiling for `pdf2text.py` and `pdf2text_v0.py` (`--profile`).
+
+Stages are timed with `profiler.span(stage, page)` and element counts are recorded with
+`profiler.count(page, key, n)`. The spans can be written as a Chrome trace-event JSON (open it
+in chrome://tracing or https://ui.perfetto.dev) and summarized as the slowest pages and stages.
+
+Without `--profile` the extractors get a `NullProfiler`, whose spans are a shared no-op context
+manager, so the instrumentation costs next to nothing.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+
+
+class Profiler:
+    enabled = True
+
+    def __init__(self):
+        self.events = []
+        self.counts = defaultdict(Counter)
+
+    @contextlib.contextmanager
+    def span(self, stage, page=None):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            # perf_counter is system-wide on Linux, so spans from worker processes line up
+            self.events.append(
+                (stage, page, start, time.perf_counter_ns() - start, os.getpid(), threading.get_ident())
+            )
+
+    def count(self, page, key, n=1):
+        self.counts[page][key] += n
+
+    def export(self):
+        return {"events": self.events, "counts": {page: dict(counts) for page, counts in self.counts.items()}}
+
+    def merge(self, data):
+        # Spans and counts recorded by a worker process
+        self.events.extend(tuple(event) for event in data["events"])
+        for page, counts in data["counts"].items():
+            self.counts[page].update(counts)
+
+    def write_trace(self, path):
+        origin = min((event[2] for event in self.events), default=0)
+        trace_events = []
+        for stage, page, start, duration, pid, tid in self.events:
+            trace_events.append({
+                "name": stage,
+                "cat": "page" if stage == "page" else "stage",
+                "ph": "X",
+                "ts": (start - origin) / 1000,
+                "dur": duration / 1000,
+                "pid": pid,
+                "tid": tid,
+                "args": {"page": page, **self.counts.get(page, {})} if stage == "page" else {"page": page},
+            })
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, file)
+
+    def summary(self, top=10):
+        page_times = {}
+        stage_times = defaultdict(list)
+        page_stages = defaultdict(Counter)
+        for stage, page, _, duration, _, _ in self.events:
+            if stage == "page":
+                page_times[page] = duration
+            else:
+                stage_times[stage].append(duration)
+                page_stages[page][stage] += duration
+
+        lines = [f"Slowest pages (of {len(page_times)}):", f"{'Page':>6} {'ms':>10}  {'Slowest stage':28} Counts"]
+        for page, duration in sorted(page_times.items(), key=lambda item: item[1], reverse=True)[:top]:
+            slowest = page_stages[page].most_common(1)
+            slowest = f"{slowest[0][0]} ({slowest[0][1] / 1e6:.1f} ms)" if slowest else "-"
+            counts = ", ".join(f"{key}={value}" for key, value in sorted(self.counts.get(page, {}).items()))
+            lines.append(f"{page:>6} {duration / 1e6:10.1f}  {slowest:28} {counts}")
+
+        lines += ["", "Stages:", f"{'Stage':20} {'Calls':>7} {'Total ms':>10} {'Mean ms':>9} {'Max ms':>9}"]
+        for stage, durations in sorted(stage_times.items(), key=lambda item: sum(item[1]), reverse=True):
+            lines.append(
+                f"{stage:20} {len(durations):7} {sum(durations) / 1e6:10.1f} "
+                f"{sum(durations) / len(durations) / 1e6:9.2f} {max(durations) / 1e6:9.2f}"
+            )
+        return "\n".join(lines)
+
+
+class NullProfiler:
+    enabled = False
+    _span = contextlib.nullcontext()
+
+    def span(self, stage, page=None):
+        return self._span
+
+    def count(self, page, key, n=1):
+        pass
+
+    def export(self):
+        return None
+
+    def merge(self, data):
+        pass
+
+
+def make_profiler(enabled):
+    return Profiler() if enabled else NullProfiler()
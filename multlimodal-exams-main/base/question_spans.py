@@ -0,0 +1,147 @@
+"""
+Local, rule-based detection of question spans for `text2mcq.py` and `batch_mcq.py`.
+
+Only the parts of a page that look like multiple-choice questions are sent to the model:
+
+- Question starts are numbered markers (`12.`, `12)`) or a question word followed by a number
+  (`Question 12`, `Pyetja 12`, ... see `QUESTION_WORDS`, like `question_denomination` in the
+  notebook). Numbered markers are only kept when they form a consecutive sequence, which drops
+  years, amounts and page numbers.
+- A span runs from one question start to the next. It is kept if it has at least two distinct
+  option markers (`A)`, `(b)`, `C.`, ...). With question words, numbered markers inside the span
+  count as options as well.
+- Text before the first question (front matter, instructions) is dropped, unless it has letter
+  options itself, i.e. a question continued from the previous page. Numbered lines there are
+  instructions rather than options.
+
+Kept spans are packed into chunks of at most `token_budget` estimated tokens. Pages without
+any span produce no chunk and are skipped.
+"""
+
+import re
+
+
+QUESTION_WORDS = {
+    "al": ["Pyetja"],
+    "sq": ["Pyetja"],
+    "en": ["Question"],
+    "fr": ["Question"],
+    "es": ["Pregunta"],
+    "pt": ["Questão", "Pergunta"],
+    "it": ["Domanda", "Quesito"],
+    "de": ["Frage", "Aufgabe"],
+    "nl": ["Vraag"],
+    "pl": ["Pytanie", "Zadanie"],
+    "cs": ["Otázka", "Úloha"],
+    "hr": ["Pitanje", "Zadatak"],
+    "sr": ["Pitanje", "Zadatak", "Питање"],
+    "hu": ["Kérdés", "Feladat"],
+    "ro": ["Întrebarea", "Subiectul"],
+    "lt": ["Klausimas", "Užduotis"],
+    "ru": ["Вопрос", "Задание"],
+    "uk": ["Питання", "Завдання"],
+    "bg": ["Въпрос", "Задача"],
+    "tr": ["Soru"],
+    "ar": ["السؤال", "سؤال"],
+    "fa": ["سوال", "پرسش"],
+    "hi": ["प्रश्न"],
+    "bn": ["প্রশ্ন"],
+    "te": ["ప్రశ్న"],
+    "ne": ["प्रश्न"],
+    "zh": ["问题", "题"],
+    "ja": ["問", "問題"],
+    "ko": ["문제", "문항"],
+}
+
+NUMBERED_MARKER = re.compile(r"(?:^|(?<=\s))(\d{1,3})\s?[.)](?=\s)")
+OPTION_MARKER = re.compile(
+    r"(?:^|(?<=\s))(?:\(([A-Ea-e])\)|([A-E])[.):]|([a-e])\)|([АБВГДабвгд])[.)])(?=\s)"
+)
+NUMBERED_OPTION = re.compile(r"(?:^|(?<=\s))\(?([1-6])[.)](?=\s)")
+
+
+def question_word_marker(words):
+    alternatives = "|".join(re.escape(word) for word in sorted(set(words), key=len, reverse=True))
+    return re.compile(rf"(?:^|(?<=\s))(?:{alternatives})\s*(?:No\.?|Nr\.?|№|#)?\s*(\d{{1,3}})", re.IGNORECASE)
+
+
+def longest_sequence(matches):
+    # Longest run of markers numbered n, n+1, n+2, ... in page order (not necessarily adjacent)
+    best_length = {}
+    previous = []
+    last_with_number = {}
+    for index, (number, _) in enumerate(matches):
+        before = last_with_number.get(number - 1)
+        previous.append(before)
+        best_length[index] = best_length[before] + 1 if before is not None else 1
+        last_with_number[number] = index
+
+    if not matches:
+        return []
+    index = max(best_length, key=lambda i: (best_length[i], -i))
+    chain = []
+    while index is not None:
+        chain.append(matches[index][1])
+        index = previous[index]
+    return chain[::-1]
+
+
+def count_options(text, numbered):
+    options = {next(group for group in match.groups() if group).lower() for match in OPTION_MARKER.finditer(text)}
+    if numbered:
+        options |= {match.group(1) for match in NUMBERED_OPTION.finditer(text)}
+    return len(options)
+
+
+def detect_spans(text, question_words=(), min_options=2):
+    """Text spans of the page that look like multiple-choice questions, in page order."""
+    if not isinstance(text, str) or not text.strip():
+        return []
+
+    word_matches = []
+    if question_words:
+        word_matches = [
+            (int(match.group(1)), match.start()) for match in question_word_marker(question_words).finditer(text)
+        ]
+    uses_words = bool(word_matches)
+    matches = word_matches or [(int(match.group(1)), match.start()) for match in NUMBERED_MARKER.finditer(text)]
+
+    starts = longest_sequence(matches)
+    bounds = [0] + starts + [len(text)]
+    spans = []
+    for index, (start, end) in enumerate(zip(bounds, bounds[1:])):
+        span = text[start:end].strip()
+        if not span:
+            continue
+        # Every span needs options, numbered ones only count inside a question
+        if count_options(span, numbered=uses_words and index > 0) >= min_options:
+            spans.append(span)
+    return spans
+
+
+def estimate_text_tokens(text):
+    # Rough count, also used by text2mcq.estimate_tokens: ~4 characters per token for ASCII, but
+    # Cyrillic, Greek, Arabic, Indic or CJK text takes 1-3 characters per token, so every other
+    # character is counted as a token to stay on the safe side
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return ascii_chars // 4 + len(text) - ascii_chars
+
+
+def chunk_spans(spans, token_budget):
+    chunks = []
+    current, current_tokens = [], 0
+    for span in spans:
+        tokens = estimate_text_tokens(span)
+        if current and current_tokens + tokens > token_budget:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        # A span larger than the budget still goes out whole, in a chunk of its own
+        current.append(span)
+        current_tokens += tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def question_chunks(text, token_budget, question_words=(), min_options=2):
+    return chunk_spans(detect_spans(text, question_words, min_options), token_budget)
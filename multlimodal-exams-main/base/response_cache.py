@@ -0,0 +1,130 @@
+"""
+On-disk cache for chat completion responses.
+
+Responses are stored in a SQLite file keyed on a hash of the model, the messages and the
+model arguments, so re-running `text2mcq.py` only pays for pages whose prompt changed.
+
+Modes:
+    readwrite: look up responses and store new ones (default).
+    readonly:  look up responses, never store.
+    offline:   look up responses, a miss raises `CacheMiss` instead of calling the API.
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+
+
+CACHE_MODES = ("readwrite", "readonly", "offline")
+
+
+class CacheMiss(Exception):
+    pass
+
+
+def cache_key(model, messages, model_args):
+    payload = json.dumps(
+        {"model": model, "messages": messages, "model_args": model_args or {}},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path, mode="readwrite", max_age_days=None, max_mb=None):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode '{mode}', expected one of {CACHE_MODES}")
+
+        self.path = path
+        self.mode = mode
+        self.max_age_days = max_age_days
+        self.max_mb = max_mb
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                text TEXT,
+                usage TEXT,
+                size INTEGER,
+                created_at REAL,
+                accessed_at REAL
+            )"""
+        )
+        self.connection.commit()
+
+    def get(self, model, messages, model_args):
+        key = cache_key(model, messages, model_args)
+        row = self.connection.execute(
+            "SELECT text, usage, created_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+
+        if row is not None and not self._expired(row[2]):
+            self.hits += 1
+            if self.mode == "readwrite":
+                self.connection.execute(
+                    "UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key)
+                )
+                self.connection.commit()
+            return row[0], json.loads(row[1])
+
+        self.misses += 1
+        if self.mode == "offline":
+            raise CacheMiss(f"No cached response for key {key}")
+        return None
+
+    def put(self, model, messages, model_args, text, usage):
+        if self.mode != "readwrite":
+            return
+
+        key = cache_key(model, messages, model_args)
+        now = time.time()
+        usage = json.dumps(usage, default=str)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, model, text, usage, len(text.encode("utf-8")) + len(usage), now, now),
+        )
+        self.connection.commit()
+
+    def evict(self):
+        if self.mode != "readwrite":
+            return 0
+
+        removed = 0
+        if self.max_age_days is not None:
+            cutoff = time.time() - self.max_age_days * 86400
+            removed += self.connection.execute(
+                "DELETE FROM responses WHERE created_at < ?", (cutoff,)
+            ).rowcount
+
+        if self.max_mb is not None:
+            # Drop least recently used entries until the stored payload fits
+            budget = self.max_mb * 1024 * 1024
+            total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > budget:
+                rows = self.connection.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed_at ASC"
+                ).fetchall()
+                for key, size in rows:
+                    if total <= budget:
+                        break
+                    self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    total -= size
+                    removed += 1
+
+        self.connection.commit()
+        return removed
+
+    def stats(self):
+        entries = self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def close(self):
+        self.connection.close()
+
+    def _expired(self, created_at):
+        return self.max_age_days is not None and created_at < time.time() - self.max_age_days * 86400
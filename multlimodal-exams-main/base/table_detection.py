@@ -0,0 +1,161 @@
+"""
+Table detection shared by `pdf2text.py` and `pdf2text_v0.py`.
+
+`page.find_tables()` is the most expensive call of both extractors. Two things keep it off most
+pages:
+
+- A pre-filter on the page's vector drawings. With its default "lines" strategy, pymupdf only
+  builds tables from ruling lines (strokes, thin rectangles and rectangle borders), so a page
+  with fewer than two horizontal and two vertical segments can't contain one and is skipped.
+- A SQLite cache of the detected bounding boxes, keyed on the document hash, the page number
+  and the detection settings. Re-running an extraction with other options (e.g. a different
+  `--cluster_margin`) reuses the boxes instead of detecting the tables again.
+"""
+
+import json
+import sqlite3
+
+import pymupdf
+
+from corpus_manifest import file_sha256
+
+
+# Bump when the detection changes in a way the settings don't capture
+DETECTOR_VERSION = "1"
+
+
+def add_table_args(parser):
+    parser.add_argument(
+        "--table_cache",
+        type=str,
+        default=None,
+        help="SQLite file caching table bounding boxes (default: table_cache.sqlite in the output directory)",
+    )
+    parser.add_argument(
+        "--no_table_cache",
+        action="store_true",
+        help="Always run table detection",
+    )
+    parser.add_argument(
+        "--no_table_prefilter",
+        action="store_true",
+        help="Run table detection on every page, even without ruling lines",
+    )
+
+
+def count_ruling_segments(page, tolerance=1.0, min_length=3.0):
+    horizontal = vertical = 0
+    for path in page.get_cdrawings():
+        for item in path["items"]:
+            if item[0] == "l":
+                (x0, y0), (x1, y1) = item[1], item[2]
+                edges = [(x0, y0, x1, y1)]
+            elif item[0] == "re":
+                x0, y0, x1, y1 = item[1]
+                # A thin rectangle is a line, a larger one contributes its four borders
+                if abs(y1 - y0) <= tolerance or abs(x1 - x0) <= tolerance:
+                    edges = [(x0, y0, x1, y1)]
+                else:
+                    edges = [(x0, y0, x1, y0), (x0, y1, x1, y1), (x0, y0, x0, y1), (x1, y0, x1, y1)]
+            elif item[0] == "qu":
+                points = item[1]
+                # Corners are upper left, upper right, lower left, lower right
+                edges = [(*points[a], *points[b]) for a, b in [(0, 1), (1, 3), (3, 2), (2, 0)]]
+            else:
+                continue
+
+            for x0, y0, x1, y1 in edges:
+                if abs(y1 - y0) <= tolerance and abs(x1 - x0) >= min_length:
+                    horizontal += 1
+                elif abs(x1 - x0) <= tolerance and abs(y1 - y0) >= min_length:
+                    vertical += 1
+    return horizontal, vertical
+
+
+def may_contain_table(page, min_horizontal=2, min_vertical=2):
+    horizontal, vertical = count_ruling_segments(page)
+    return horizontal >= min_horizontal and vertical >= min_vertical
+
+
+class TableCache:
+    def __init__(self, path):
+        self.path = path
+        # Worker processes of the same run share the file
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS tables (
+                doc_hash TEXT,
+                page INTEGER,
+                settings TEXT,
+                bboxes TEXT,
+                PRIMARY KEY (doc_hash, page, settings)
+            )"""
+        )
+        self.connection.commit()
+
+    def get(self, doc_hash, page, settings):
+        row = self.connection.execute(
+            "SELECT bboxes FROM tables WHERE doc_hash = ? AND page = ? AND settings = ?", (doc_hash, page, settings)
+        ).fetchone()
+        return None if row is None else [tuple(bbox) for bbox in json.loads(row[0])]
+
+    def put(self, doc_hash, page, settings, bboxes):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO tables VALUES (?, ?, ?, ?)", (doc_hash, page, settings, json.dumps(bboxes))
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+class TableDetector:
+    def __init__(self, doc_hash=None, cache_path=None, prefilter=True, find_tables_args=None):
+        self.doc_hash = doc_hash
+        self.prefilter = prefilter
+        self.find_tables_args = find_tables_args or {}
+        self.cache = TableCache(cache_path) if cache_path is not None and doc_hash is not None else None
+        self.settings = json.dumps(
+            {
+                "version": DETECTOR_VERSION,
+                "pymupdf": pymupdf.VersionBind,
+                "prefilter": prefilter,
+                "find_tables": self.find_tables_args,
+            },
+            sort_keys=True,
+        )
+
+    def find(self, page):
+        """Bounding boxes (pymupdf coordinates) of the tables on the page."""
+        if self.cache is not None:
+            bboxes = self.cache.get(self.doc_hash, page.number, self.settings)
+            if bboxes is not None:
+                return bboxes
+
+        if self.prefilter and not may_contain_table(page):
+            bboxes = []
+        else:
+            bboxes = [tuple(table.bbox) for table in page.find_tables(**self.find_tables_args)]
+
+        if self.cache is not None:
+            self.cache.put(self.doc_hash, page.number, self.settings, bboxes)
+        return bboxes
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def table_options(args, pdf_file, output_dir):
+    cache_path = doc_hash = None
+    if not args.no_table_cache:
+        cache_path = args.table_cache or str(output_dir / "table_cache.sqlite")
+        doc_hash = file_sha256(pdf_file)
+    return {"doc_hash": doc_hash, "cache_path": cache_path, "prefilter": not args.no_table_prefilter}
@@ -1,7 +1,10 @@
 import pandas as pd
 import argparse
+import asyncio
+import random
 from openai import (
     OpenAI,
+    AsyncOpenAI,
     AzureOpenAI,
     APITimeoutError,
     APIConnectionError,
@@ -14,6 +17,9 @@ from os import listdir
 from os.path import isfile, join
 import os
 from metadata_conf import *
+from page_journal import PageJournal
+from question_spans import QUESTION_WORDS, estimate_text_tokens, question_chunks
+from response_cache import CACHE_MODES, CacheMiss, ResponseCache
 
 
 pre_prompt = """Please extract the multiple-choice questions that are present in the following text. The out format should be the following:
@@ -25,13 +31,40 @@ pre_prompt = """Please extract the multiple-choice questions that are present in
 
 The text is the following:"""
 
+MODEL = "gpt-4o"
+MODEL_ARGS = {
+    "temperature": 0.0,
+    "max_tokens": 4096,
+    "frequency_penalty": 0,
+    "presence_penalty": 0,
+}
+# Estimated prompt tokens per request with --question_spans
+SPAN_TOKEN_BUDGET = 1500
+# Default rate limits of the async mode
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 300000
+RETRYABLE_ERRORS = (
+    APITimeoutError,
+    APIConnectionError,
+    RateLimitError,
+    InternalServerError,
+)
+
 
 def chat_completion(
-    client, messages, model, return_text=True, return_usage=True, model_args=None
+    client, messages, model, return_text=True, return_usage=True, model_args=None, cache=None
 ):
     if model_args is None:
         model_args = {}
 
+    if cache is not None and (return_text or return_usage):
+        cached = cache.get(model, messages, model_args)
+        if cached is not None:
+            text, usage = cached
+            if return_text and return_usage:
+                return text, usage
+            return text if return_text else usage
+
     while True:
         try:
             response = client.chat.completions.create(
@@ -39,6 +72,8 @@ def chat_completion(
             )
             text = response.choices[0].message.content.strip()
             usage = response.usage
+            if cache is not None:
+                cache.put(model, messages, model_args, text, dict(usage))
 
             if return_text and return_usage:
                 return text, dict(usage)
@@ -50,17 +85,95 @@ def chat_completion(
                 return usage
 
             return response
-        except (
-            APITimeoutError,
-            APIConnectionError,
-            RateLimitError,
-            InternalServerError,
-        ) as e:
+        except RETRYABLE_ERRORS as e:
             print(f"OpenAI error: {str(e)}. Waiting for 1 minute.")
             time.sleep(60)
             continue
 
 
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        # A single request larger than the bucket would otherwise wait forever
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    async def acquire(self, tokens):
+        await self.requests.acquire(1)
+        await self.tokens.acquire(tokens)
+
+
+def estimate_tokens(messages, model_args):
+    # max_tokens is reserved against the TPM limit as well
+    prompt_tokens = estimate_text_tokens("".join(message["content"] for message in messages))
+    return prompt_tokens + model_args.get("max_tokens", 0)
+
+
+def retry_delay(error, attempt, base=1.0, cap=60.0):
+    response = getattr(error, "response", None)
+    if response is not None:
+        retry_after_ms = response.headers.get("retry-after-ms")
+        retry_after = response.headers.get("retry-after")
+        try:
+            if retry_after_ms is not None:
+                return float(retry_after_ms) / 1000
+            if retry_after is not None:
+                return float(retry_after)
+        except ValueError:
+            pass
+    # Full jitter so concurrent requests don't retry in lockstep
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+async def async_chat_completion(client, messages, model, limiter, model_args=None, cache=None):
+    if model_args is None:
+        model_args = {}
+
+    if cache is not None:
+        cached = cache.get(model, messages, model_args)
+        if cached is not None:
+            return cached
+
+    estimated_tokens = estimate_tokens(messages, model_args)
+    attempt = 0
+    while True:
+        await limiter.acquire(estimated_tokens)
+        try:
+            response = await client.chat.completions.create(
+                model=model, messages=messages, **model_args
+            )
+            text = response.choices[0].message.content.strip()
+            usage = dict(response.usage)
+            if cache is not None:
+                cache.put(model, messages, model_args, text, usage)
+            return text, usage
+        except RETRYABLE_ERRORS as e:
+            delay = retry_delay(e, attempt)
+            print(f"OpenAI error: {str(e)}. Retrying in {delay:.1f}s.")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
 def parse_gpt_output(q):
     parts = q.split("\n")
     try:
@@ -96,77 +209,246 @@ def parse_gpt_output(q):
     return question, choice_1, choice_2, choice_3, choice_4, choice_5
 
 
-def main(dir_path, openai_key):
-    client = OpenAI(api_key=openai_key)
-
+def build_prompt(parsed_text):
+    prompt = "{}\n\n{}".format(pre_prompt, parsed_text)
+    return [{"role": "user", "content": prompt.strip()}]
+
+
+def span_filter_options(token_budget=SPAN_TOKEN_BUDGET, extra_question_words=()):
+    return {
+        "token_budget": token_budget,
+        "question_words": QUESTION_WORDS.get(LANGUAGE, []) + list(extra_question_words),
+    }
+
+
+def add_span_args(parser):
+    parser.add_argument(
+        "--question_spans",
+        action="store_true",
+        help="Only send the detected question spans instead of whole pages, pages without any are skipped",
+    )
+    parser.add_argument("--token_budget", type=int, default=SPAN_TOKEN_BUDGET, help="Estimated prompt tokens per request")
+    parser.add_argument("--question_words", nargs="*", default=[], help="Extra words introducing a question, e.g. Pyetja")
+
+
+def span_filter_from_args(args):
+    return span_filter_options(args.token_budget, args.question_words) if args.question_spans else None
+
+
+def page_requests(parsed_text, span_filter=None):
+    """(messages, model_args) of every request for a page, none when the page has no question."""
+    if span_filter is None:
+        return [(build_prompt(parsed_text), MODEL_ARGS)]
+
+    requests = []
+    for chunk in question_chunks(parsed_text, span_filter["token_budget"], span_filter["question_words"]):
+        # The answer restates the questions, so it can't be much longer than the chunk
+        max_tokens = min(MODEL_ARGS["max_tokens"], 2 * estimate_text_tokens(chunk) + 256)
+        requests.append((build_prompt(chunk), {**MODEL_ARGS, "max_tokens": max_tokens}))
+    return requests
+
+
+def record_page_stats(stats, parsed_text, requests, page_label):
+    stats["pages"] += 1
+    stats["skipped"] += not requests
+    if not requests and isinstance(parsed_text, str) and parsed_text.strip():
+        # The detector can miss questions, the dropped pages are listed so they can be checked
+        print("No question span found, skipping {}".format(page_label))
+    stats["page_tokens"] += estimate_text_tokens(build_prompt(parsed_text)[0]["content"])
+    stats["sent_tokens"] += sum(estimate_text_tokens(messages[0]["content"]) for messages, _ in requests)
+
+
+def new_page_stats():
+    return {"pages": 0, "skipped": 0, "page_tokens": 0, "sent_tokens": 0}
+
+
+def print_page_stats(stats):
+    print("Sent ~{} prompt tokens instead of ~{} for whole pages, skipped {} of {} pages without questions".format(
+        stats["sent_tokens"], stats["page_tokens"], stats["skipped"], stats["pages"]
+    ))
+
+
+def build_rows(row, response):
+    rows = []
+    for q in response.split("\n\n"):
+        if q:
+            (
+                question,
+                choice_1,
+                choice_2,
+                choice_3,
+                choice_4,
+                choice_5,
+            ) = parse_gpt_output(q)
+
+            new_row = {
+                "language": LANGUAGE,
+                "category_og_en": CATEGORY_ORIGINAL_LANG,
+                "category_og": CATEGORY_EN,
+                "level": LEVEL,
+                "license": LICENSE,
+                "source": SOURCE,
+                "country": COUNTRY,
+                "file_name": SOURCE.split("/")[-1].split(".")[0],
+                "original_question_num": None,
+                "page_num": row["page_num"],
+                "parsed_text": row["parsed_text"],
+                "question": question,
+                "options": [i for i in [choice_1, choice_2, choice_3, choice_4, choice_5] if i is not None],
+                "answer": None,
+                "image_png": None,
+                "image_information": None,
+                "image_type": None,
+                "parallel_question_id": None,
+            }
+
+            rows.append(new_row)
+    return rows
+
+
+def list_parsed_files(dir_path):
     dir_path_parsed = dir_path + "/parsed"
-    onlyfiles = [
+    return [
         f for f in listdir(dir_path_parsed) if isfile(join(dir_path_parsed, f))
     ]
+
+
+def save_results(dir_path, f, results):
+    output_file = os.path.join(dir_path, "mcq", f)
+    output_data = pd.DataFrame(results)
+    output_data.to_csv(output_file, index=False)
+    print("Data saved: {}".format(output_file))
+
+
+def journal_path(dir_path, f):
+    return os.path.join(dir_path, "mcq", f + ".partial.jsonl")
+
+
+def is_compacted(dir_path, f):
+    # A finished file has its output written and its journal removed
+    return isfile(os.path.join(dir_path, "mcq", f)) and not isfile(journal_path(dir_path, f))
+
+
+def compact_journal(dir_path, f, pages, journal):
+    missing = [page_num for page_num in pages["page_num"] if not journal.is_completed(page_num)]
+    if missing:
+        # Keep the journal and don't write the output, so --resume fills in the missing pages
+        journal.close()
+        print("{} pages of {} have no result yet, run again with --resume: {}".format(len(missing), f, missing))
+        return False
+    save_results(dir_path, f, journal.rows_in_order(pages["page_num"]))
+    journal.remove()
+    return True
+
+
+def main(dir_path, openai_key, cache=None, resume=False, span_filter=None):
+    client = OpenAI(api_key=openai_key)
+    stats = new_page_stats()
+
+    onlyfiles = list_parsed_files(dir_path)
     print(onlyfiles)
 
     for f in onlyfiles:
-        file_path = os.path.join(dir_path_parsed, f)
+        if resume and is_compacted(dir_path, f):
+            print("Skipping completed file: {}".format(f))
+            continue
+
+        file_path = os.path.join(dir_path, "parsed", f)
         print("Parsing file: {}".format(f))
         pages = pd.read_csv(file_path)
+        journal = PageJournal(journal_path(dir_path, f), resume=resume)
 
-        results = list()
         print(len(pages))
         for _, row in tqdm(pages.iterrows()):
-            prompt = "{}\n\n{}".format(pre_prompt, row["parsed_text"])
-            response, _ = chat_completion(
-                client,
-                [{"role": "user", "content": prompt.strip()}],
-                model="gpt-4o",
-                return_text=True,
-                return_usage=True,
-                model_args={
-                    "temperature": 0.0,
-                    "max_tokens": 4096,
-                    "frequency_penalty": 0,
-                    "presence_penalty": 0,
-                },
+            if journal.is_completed(row["page_num"]):
+                continue
+            requests = page_requests(row["parsed_text"], span_filter)
+            record_page_stats(stats, row["parsed_text"], requests, "page {} of {}".format(row["page_num"], f))
+            try:
+                responses = [
+                    chat_completion(
+                        client,
+                        messages,
+                        model=MODEL,
+                        return_text=True,
+                        return_usage=True,
+                        model_args=model_args,
+                        cache=cache,
+                    )[0]
+                    for messages, model_args in requests
+                ]
+            except CacheMiss:
+                print("Offline cache miss, skipping page {}".format(row["page_num"]))
+                continue
+            # Pages without questions are journaled with no rows, so they aren't retried
+            journal.append(row["page_num"], build_rows(row, "\n\n".join(responses)))
+
+        compact_journal(dir_path, f, pages, journal)
+
+    if span_filter is not None:
+        print_page_stats(stats)
+
+
+async def process_file_async(
+    dir_path, f, client, limiter, semaphore, progress, stats, cache=None, resume=False, span_filter=None
+):
+    pages = pd.read_csv(os.path.join(dir_path, "parsed", f))
+    if resume and is_compacted(dir_path, f):
+        progress.update(len(pages))
+        return
+    journal = PageJournal(journal_path(dir_path, f), resume=resume)
+
+    async def process_request(messages, model_args):
+        async with semaphore:
+            response, _ = await async_chat_completion(
+                client, messages, model=MODEL, limiter=limiter, model_args=model_args, cache=cache,
             )
-            row["output"] = response
-
-            for q in response.split("\n\n"):
-                if q:
-                    (
-                        question,
-                        choice_1,
-                        choice_2,
-                        choice_3,
-                        choice_4,
-                        choice_5,
-                    ) = parse_gpt_output(q)
-
-                    new_row = {
-                        "language": LANGUAGE,
-                        "category_og_en": CATEGORY_ORIGINAL_LANG,
-                        "category_og": CATEGORY_EN,
-                        "level": LEVEL,
-                        "license": LICENSE,
-                        "source": SOURCE,
-                        "country": COUNTRY,
-                        "file_name": SOURCE.split("/")[-1].split(".")[0],
-                        "original_question_num": None,
-                        "page_num": row["page_num"],
-                        "parsed_text": row["parsed_text"],
-                        "question": question,
-                        "options": [i for i in [choice_1, choice_2, choice_3, choice_4, choice_5] if i is not None],
-                        "answer": None,
-                        "image_png": None,
-                        "image_information": None,
-                        "image_type": None,
-                        "parallel_question_id": None,
-                    }
-
-                    results.append(new_row)
-
-        output_file = os.path.join(dir_path, "mcq", f)
-        output_data = pd.DataFrame(results)
-        output_data.to_csv(output_file, index=False)
-        print("Data saved: {}".format(output_file))
+        return response
+
+    async def process_page(row):
+        if journal.is_completed(row["page_num"]):
+            progress.update(1)
+            return
+        requests = page_requests(row["parsed_text"], span_filter)
+        record_page_stats(stats, row["parsed_text"], requests, "page {} of {}".format(row["page_num"], f))
+        try:
+            # The chunks of a page are sent concurrently, each one holding its own slot
+            responses = await asyncio.gather(*[
+                process_request(messages, model_args) for messages, model_args in requests
+            ])
+        except CacheMiss:
+            print("Offline cache miss, skipping page {} of {}".format(row["page_num"], f))
+            return
+        finally:
+            progress.update(1)
+        # Journaled in completion order, compaction restores the page order
+        journal.append(row["page_num"], build_rows(row, "\n\n".join(responses)))
+
+    await asyncio.gather(*[process_page(row) for _, row in pages.iterrows()])
+    compact_journal(dir_path, f, pages, journal)
+
+
+async def main_async(
+    dir_path, openai_key, concurrency, requests_per_minute, tokens_per_minute, cache=None, resume=False,
+    span_filter=None,
+):
+    # Retries are handled by async_chat_completion so they go through the limiter
+    client = AsyncOpenAI(api_key=openai_key, max_retries=0)
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    onlyfiles = list_parsed_files(dir_path)
+    print(onlyfiles)
+
+    stats = new_page_stats()
+    total_pages = sum(len(pd.read_csv(os.path.join(dir_path, "parsed", f))) for f in onlyfiles)
+    with tqdm(total=total_pages) as progress:
+        await asyncio.gather(*[
+            process_file_async(dir_path, f, client, limiter, semaphore, progress, stats, cache, resume, span_filter)
+            for f in onlyfiles
+        ])
+    if span_filter is not None:
+        print_page_stats(stats)
 
 
 if __name__ == "__main__":
@@ -176,5 +458,40 @@ if __name__ == "__main__":
 
     parser.add_argument("-k", "--key", help="", default="")
 
+    parser.add_argument("--async_mode", action="store_true", help="Send requests concurrently across all files")
+
+    parser.add_argument("--concurrency", type=int, default=16, help="Maximum in-flight requests in async mode")
+
+    parser.add_argument("--rpm", type=int, default=REQUESTS_PER_MINUTE, help="Requests per minute limit in async mode")
+
+    parser.add_argument("--tpm", type=int, default=TOKENS_PER_MINUTE, help="Tokens per minute limit in async mode")
+
+    parser.add_argument("--cache_path", help="SQLite file used to cache responses", default=None)
+
+    parser.add_argument("--cache_mode", choices=CACHE_MODES, default="readwrite", help="offline never calls the API")
+
+    parser.add_argument("--cache_max_age_days", type=float, default=None, help="Evict cached responses older than this")
+
+    parser.add_argument("--cache_max_mb", type=float, default=None, help="Evict least recently used responses above this size")
+
+    parser.add_argument("--resume", action="store_true", help="Skip pages completed by an interrupted run")
+
+    add_span_args(parser)
+
     args = parser.parse_args()
-    main(dir_path=args.dir, client=args.key)
+    span_filter = span_filter_from_args(args)
+    cache = None
+    if args.cache_path:
+        cache = ResponseCache(args.cache_path, args.cache_mode, args.cache_max_age_days, args.cache_max_mb)
+
+    if args.async_mode:
+        asyncio.run(main_async(
+            args.dir, args.key, args.concurrency, args.rpm, args.tpm, cache, args.resume, span_filter
+        ))
+    else:
+        main(dir_path=args.dir, openai_key=args.key, cache=cache, resume=args.resume, span_filter=span_filter)
+
+    if cache is not None:
+        cache.evict()
+        print("Cache stats: {}".format(cache.stats()))
+        cache.close()
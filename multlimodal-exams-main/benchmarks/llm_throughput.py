@@ -0,0 +1,199 @@
+"""
+Throughput benchmark of the LLM client code of `text2mcq.py` against `mock_llm_server.py`.
+
+Synthetic exam pages are sent through `async_chat_completion` (the `--async_mode` path, with
+its rate limiter and retries) or `chat_completion` (the sequential path). By default the mock
+server is started in this process; `--base_url` points the benchmark at a server started
+separately instead, which keeps its threads out of the measurement.
+
+Reported are the completed calls per second, the latency percentiles of a call (retries
+included), the requests the server received per call and the overhead: the mean call latency
+minus the mean service time of the successful requests. Without injected faults this is the
+cost of the client itself; a run with faults against the same settings shows the retry
+overhead on top of it. The results can be written
+to JSON and compared against a `--baseline`, which exits with status 1 if the throughput
+dropped or the p99 latency grew by more than the tolerance.
+
+`chat_completion` waits a minute after every error, so the sync mode is only meaningful
+without injected faults.
+
+### How to Use:
+    python llm_throughput.py --requests 500 --concurrency 32 --latency lognormal:0.2,0.5 --output llm.json
+    python llm_throughput.py --requests 500 --concurrency 32 --latency lognormal:0.2,0.5 --rate_limit_ratio 0.05 \
+        --server_error_ratio 0.02 --timeout_ratio 0.01 --timeout_seconds 5 --client_timeout 2 --baseline llm.json
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+from openai import AsyncOpenAI, OpenAI
+
+from mock_llm_server import MockLLMServer, add_mock_args, mock_options
+from synthetic import sentence
+
+# text2mcq.py imports its siblings as top-level modules
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "base"))
+from text2mcq import MODEL, MODEL_ARGS, RateLimiter, async_chat_completion, build_prompt, chat_completion  # noqa: E402
+
+
+RESULTS_VERSION = "1"
+
+
+def make_prompts(count, questions_per_page=5, seed=0):
+    rng = random.Random(seed)
+    prompts = []
+    for _ in range(count):
+        lines = []
+        for number in range(1, questions_per_page + 1):
+            lines.append(f"{number}. {sentence(rng, rng.randint(8, 20))}?")
+            lines += [f"{option}) {sentence(rng, rng.randint(1, 5))}" for option in "ABCD"]
+        prompts.append(build_prompt("\n".join(lines)))
+    return prompts
+
+
+async def run_async(base_url, prompts, concurrency, requests_per_minute, tokens_per_minute, client_timeout):
+    # Retries are left to async_chat_completion, as in text2mcq.main_async
+    client = AsyncOpenAI(base_url=base_url, api_key="mock", max_retries=0, timeout=client_timeout)
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def call(messages):
+        async with semaphore:
+            start = time.perf_counter()
+            await async_chat_completion(client, messages, model=MODEL, limiter=limiter, model_args=MODEL_ARGS)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[call(messages) for messages in prompts])
+    seconds = time.perf_counter() - start
+    await client.close()
+    return seconds, latencies
+
+
+def run_sync(base_url, prompts, client_timeout):
+    client = OpenAI(base_url=base_url, api_key="mock", max_retries=0, timeout=client_timeout)
+    latencies = []
+    start = time.perf_counter()
+    for messages in prompts:
+        call_start = time.perf_counter()
+        chat_completion(client, messages, model=MODEL, model_args=MODEL_ARGS)
+        latencies.append(time.perf_counter() - call_start)
+    return time.perf_counter() - start, latencies
+
+
+def server_stats(base_url):
+    with urllib.request.urlopen(f"{base_url.rstrip('/')}/stats") as response:
+        return json.load(response)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_benchmark(args, base_url, stats):
+    prompts = make_prompts(args.requests, args.questions_per_page, args.seed)
+    before = stats()
+    if args.mode == "async":
+        seconds, latencies = asyncio.run(run_async(
+            base_url, prompts, args.concurrency, args.rpm, args.tpm, args.client_timeout
+        ))
+    else:
+        seconds, latencies = run_sync(base_url, prompts, args.client_timeout)
+    after = stats()
+
+    requests = after["requests"] - before["requests"]
+    statuses = {
+        status: count - before["statuses"].get(status, 0)
+        for status, count in after["statuses"].items()
+        if count - before["statuses"].get(status, 0)
+    }
+    successes = statuses.get("200", 0)
+    service_seconds = (after["success_seconds"] - before["success_seconds"]) / successes if successes else 0.0
+    return {
+        "calls": len(latencies),
+        "seconds": round(seconds, 3),
+        "calls_per_sec": round(len(latencies) / seconds, 2),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.5) * 1000, 1),
+            "p90": round(percentile(latencies, 0.9) * 1000, 1),
+            "p99": round(percentile(latencies, 0.99) * 1000, 1),
+            "max": round(max(latencies) * 1000, 1),
+        },
+        "server_requests": requests,
+        "requests_per_call": round(requests / len(latencies), 3),
+        "statuses": statuses,
+        # Requests still held by the server, i.e. the timed out ones
+        "unanswered": requests - sum(statuses.values()),
+        "overhead_ms": round((statistics.mean(latencies) - service_seconds) * 1000, 1),
+    }
+
+
+def compare(results, baseline, tolerance):
+    if baseline["config"] != results["config"]:
+        print("Warning: the baseline was recorded with different settings, the comparison may be meaningless")
+
+    regressions = []
+    for name, value, reference, worse in [
+        ("calls_per_sec", results["calls_per_sec"], baseline["calls_per_sec"], lambda change: change < -tolerance),
+        ("p99_ms", results["latency_ms"]["p99"], baseline["latency_ms"]["p99"], lambda change: change > tolerance),
+    ]:
+        change = value / reference - 1 if reference else 0.0
+        flag = "regression" if worse(change) else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:14} {value:10.2f} {reference:10.2f} {change:+8.1%} {flag}")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the LLM client code against the mock server")
+    parser.add_argument("--base_url", type=str, default=None, help="Running mock server (default: start one in process)")
+    parser.add_argument("--mode", choices=["async", "sync"], default="async")
+    parser.add_argument("--requests", type=int, default=200, help="Pages to send")
+    parser.add_argument("--questions_per_page", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent requests of the async mode")
+    parser.add_argument("--rpm", type=int, default=10**9, help="Requests per minute allowed by the client's limiter")
+    parser.add_argument("--tpm", type=int, default=10**12, help="Tokens per minute allowed by the client's limiter")
+    parser.add_argument("--client_timeout", type=float, default=10.0, help="Client timeout per request in seconds")
+    parser.add_argument("--output", type=str, default=None, help="Results file to write")
+    parser.add_argument("--baseline", type=str, default=None, help="Results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative slowdown allowed")
+    add_mock_args(parser)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    config = {key: value for key, value in vars(args).items() if key not in ("base_url", "output", "baseline", "tolerance")}
+    config["latency"] = args.latency.spec
+    if args.mode == "sync" and (args.rate_limit_ratio or args.server_error_ratio or args.timeout_ratio):
+        print("Warning: chat_completion waits 60s after every error")
+
+    if args.base_url is None:
+        with MockLLMServer(**mock_options(args)) as server:
+            results = run_benchmark(args, server.base_url, server.state.stats)
+    else:
+        results = run_benchmark(args, args.base_url, lambda: server_stats(args.base_url))
+    results = {"version": RESULTS_VERSION, "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "config": config, **results}
+    print(json.dumps({key: results[key] for key in results if key not in ("version", "created", "config")}, indent=2))
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"Regressions in: {', '.join(regressions)}")
+            sys.exit(1)
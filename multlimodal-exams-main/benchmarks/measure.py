@@ -0,0 +1,41 @@
+"""
+Runs a command and prints its wall time and peak RSS as JSON.
+
+Linux carries a process's peak RSS over fork and exec, so a stage started straight from
+`run_benchmarks.py` would report at least the RSS of the benchmark process itself (which holds
+the generated inputs). Starting it from this small process keeps that floor at the size of a
+bare interpreter. The peak is the largest one of the command and of the worker processes it
+waited for (not their sum).
+
+### How to Use:
+    python measure.py --log_file "stage.log" -- python check_dataset.py ...
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure a command")
+    parser.add_argument("--log_file", type=str, required=True, help="File receiving the command's stderr")
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="Command to run, after --")
+    args = parser.parse_args()
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+
+    with open(args.log_file, "w") as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=log)
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss_mb = usage.ru_maxrss / 1024 if sys.platform != "darwin" else usage.ru_maxrss / (1024 * 1024)
+    print(json.dumps({"returncode": os.waitstatus_to_exitcode(status), "seconds": seconds, "peak_rss_mb": peak_rss_mb}))
+
+
+if __name__ == "__main__":
+    main()
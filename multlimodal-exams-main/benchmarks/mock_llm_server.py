@@ -0,0 +1,309 @@
+"""
+Local stand-in for the OpenAI chat-completions API, to load-test the LLM clients without
+paying for real calls.
+
+`POST /v1/chat/completions` answers with deterministic MCQs in the format asked for by
+`text2mcq.py` (question, then `1.` to `4.` choices, questions separated by a blank line),
+after a latency drawn from a configurable distribution. A share of the requests can be made
+to fail with 429 (optionally with a `retry-after-ms` header), 5xx or a timeout (the server
+holds the request for `--timeout_seconds` before answering). `GET /v1/stats` returns the
+request counts and service times.
+
+Latencies and faults are drawn from a random generator seeded with `--seed`, the request body
+and the number of times that body was received before. A run with the same requests therefore
+sees the same faults, however they are scheduled, and a retried request gets a new draw.
+
+Any OpenAI client can be pointed at it, e.g. `text2mcq.py` through the `OPENAI_BASE_URL`
+environment variable. With `--certfile`/`--keyfile` it serves HTTPS, for clients that only
+speak TLS like `generateMCQ` in `pipeline.cpp` (see `OPENAI_HOST`/`OPENAI_PORT` there).
+
+### How to Use:
+    python mock_llm_server.py --port 8000 --latency lognormal:0.8,0.4 --rate_limit_ratio 0.05 --server_error_ratio 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:8000/v1 python ../base/text2mcq.py -d pdfs -k mock --async_mode
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import ssl
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+LATENCY_DISTRIBUTIONS = {
+    # name: (parameters, sampler)
+    "fixed": (1, lambda rng, seconds: seconds),
+    "uniform": (2, lambda rng, low, high: rng.uniform(low, high)),
+    "exponential": (1, lambda rng, mean: rng.expovariate(1 / mean) if mean > 0 else 0.0),
+    "lognormal": (2, lambda rng, median, sigma: rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0),
+}
+SERVER_ERROR_CODES = [500, 502, 503]
+
+
+class Latency:
+    """Sampler for "fixed:0.5", "uniform:0.2,1.0", "exponential:0.5" or "lognormal:0.5,0.4" (seconds)."""
+
+    def __init__(self, spec):
+        name, _, params = spec.partition(":")
+        if name not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution {name!r}, use one of {list(LATENCY_DISTRIBUTIONS)}")
+        count, self.sampler = LATENCY_DISTRIBUTIONS[name]
+        self.values = [float(value) for value in params.split(",")] if params else []
+        if len(self.values) != count:
+            raise ValueError(f"{name} latency takes {count} parameter(s), got {spec!r}")
+        self.spec = spec
+
+    def __call__(self, rng):
+        return max(0.0, self.sampler(rng, *self.values))
+
+    def __repr__(self):
+        return f"Latency({self.spec!r})"
+
+
+def add_mock_args(parser):
+    parser.add_argument("--latency", type=Latency, default=Latency("fixed:0.05"),
+                        help="Latency distribution, e.g. fixed:0.5, uniform:0.2,1.0, exponential:0.5, lognormal:0.5,0.4")
+    parser.add_argument("--latency_per_token", type=float, default=0.0, help="Extra seconds per completion token")
+    parser.add_argument("--rate_limit_ratio", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--retry_after_ms", type=int, default=None, help="retry-after-ms header sent with 429")
+    parser.add_argument("--server_error_ratio", type=float, default=0.0, help="Share of requests answered with 5xx")
+    parser.add_argument("--timeout_ratio", type=float, default=0.0, help="Share of requests held until --timeout_seconds")
+    parser.add_argument("--timeout_seconds", type=float, default=30.0, help="How long timed out requests are held")
+    parser.add_argument("--questions", type=int, default=None, help="Questions per response (1-3 by prompt hash by default)")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def mock_options(args):
+    return {
+        "latency": args.latency,
+        "latency_per_token": args.latency_per_token,
+        "rate_limit_ratio": args.rate_limit_ratio,
+        "retry_after_ms": args.retry_after_ms,
+        "server_error_ratio": args.server_error_ratio,
+        "timeout_ratio": args.timeout_ratio,
+        "timeout_seconds": args.timeout_seconds,
+        "questions": args.questions,
+        "seed": args.seed,
+    }
+
+
+def mock_mcq_response(messages, questions=None):
+    """Deterministic MCQs for a prompt, in the output format asked for by text2mcq.py."""
+    digest = hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).hexdigest()
+    if questions is None:
+        questions = 1 + int(digest[:8], 16) % 3
+    blocks = []
+    for number in range(questions):
+        key = digest[number * 8:number * 8 + 8]
+        choices = "\n".join(f"{choice}. Choice {choice} of question {key}" for choice in range(1, 5))
+        blocks.append(f"Mock question {number + 1} ({key})?\n{choices}")
+    return "\n\n".join(blocks)
+
+
+class MockState:
+    def __init__(self, latency, latency_per_token=0.0, rate_limit_ratio=0.0, retry_after_ms=None,
+                 server_error_ratio=0.0, timeout_ratio=0.0, timeout_seconds=30.0, questions=None, seed=0):
+        self.latency = latency
+        self.latency_per_token = latency_per_token
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after_ms = retry_after_ms
+        self.server_error_ratio = server_error_ratio
+        self.timeout_ratio = timeout_ratio
+        self.timeout_seconds = timeout_seconds
+        self.questions = questions
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.seen = Counter()
+        self.statuses = Counter()
+        self.requests = 0
+        self.in_flight = self.max_in_flight = 0
+        self.success_seconds = 0.0
+
+    def rng_for(self, body):
+        digest = hashlib.sha256(body).hexdigest()
+        with self.lock:
+            attempt = self.seen[digest]
+            self.seen[digest] += 1
+        return random.Random(f"{self.seed}:{digest}:{attempt}")
+
+    def outcome(self, rng):
+        draw = rng.random()
+        for outcome, ratio in [
+            ("rate_limit", self.rate_limit_ratio),
+            ("server_error", self.server_error_ratio),
+            ("timeout", self.timeout_ratio),
+        ]:
+            if draw < ratio:
+                return outcome
+            draw -= ratio
+        return "ok"
+
+    def started(self):
+        with self.lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def finished(self, status, seconds):
+        with self.lock:
+            self.in_flight -= 1
+            self.statuses[str(status)] += 1
+            if status == 200:
+                self.success_seconds += seconds
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "statuses": dict(self.statuses),
+                "max_in_flight": self.max_in_flight,
+                "success_seconds": self.success_seconds,
+            }
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockLLM/1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up on the request (e.g. a timeout)
+            self.close_connection = True
+
+    def do_GET(self):
+        if self.path.rstrip("/") in ("/v1/stats", "/stats"):
+            self.send_json(200, self.server.state.stats())
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+        try:
+            request = json.loads(body)
+            messages = request["messages"]
+        except (ValueError, KeyError, TypeError):
+            self.send_json(400, {"error": {"message": "Invalid request body", "type": "invalid_request_error"}})
+            return
+
+        state = self.server.state
+        state.started()
+        start = time.perf_counter()
+        rng = state.rng_for(body)
+        outcome = state.outcome(rng)
+        status = 200
+        try:
+            if outcome == "timeout":
+                time.sleep(state.timeout_seconds)
+                status = 504
+                self.send_json(status, {"error": {"message": "Request timed out", "type": "timeout"}})
+            elif outcome == "rate_limit":
+                status = 429
+                headers = {} if state.retry_after_ms is None else {"retry-after-ms": str(state.retry_after_ms)}
+                self.send_json(status, {"error": {"message": "Rate limit reached", "type": "requests"}}, headers)
+            elif outcome == "server_error":
+                status = rng.choice(SERVER_ERROR_CODES)
+                time.sleep(state.latency(rng))
+                self.send_json(status, {"error": {"message": "The server had an error", "type": "server_error"}})
+            else:
+                text = mock_mcq_response(messages, state.questions)
+                prompt_tokens = sum(len(str(message.get("content", ""))) for message in messages) // 4
+                completion_tokens = len(text) // 4
+                if request.get("max_tokens") is not None:
+                    completion_tokens = min(completion_tokens, request["max_tokens"])
+                time.sleep(state.latency(rng) + completion_tokens * state.latency_per_token)
+                self.send_json(status, {
+                    "id": f"chatcmpl-mock-{hashlib.sha256(body).hexdigest()[:24]}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "mock"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": text},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens,
+                    },
+                })
+        finally:
+            state.finished(status, time.perf_counter() - start)
+
+
+class MockLLMServer:
+    """The mock server on a background thread, e.g. for a benchmark in the same process."""
+
+    def __init__(self, host="127.0.0.1", port=0, certfile=None, keyfile=None, **options):
+        self.httpd = ThreadingHTTPServer((host, port), MockHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = MockState(**options)
+        self.scheme = "http"
+        if certfile is not None:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self.httpd.socket = context.wrap_socket(self.httpd.socket, server_side=True)
+            self.scheme = "https"
+        self.thread = None
+
+    @property
+    def state(self):
+        return self.httpd.state
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"{self.scheme}://{host}:{port}/v1"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock OpenAI chat-completions server")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--certfile", type=str, default=None, help="Serve HTTPS with this certificate")
+    parser.add_argument("--keyfile", type=str, default=None, help="Private key of --certfile")
+    add_mock_args(parser)
+    args = parser.parse_args()
+
+    server = MockLLMServer(args.host, args.port, args.certfile, args.keyfile, **mock_options(args))
+    print(f"Serving the mock chat-completions API on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
@@ -0,0 +1,216 @@
+"""
+Benchmarks for the extraction, validation and Label Studio scripts.
+
+Every stage runs its script as a subprocess on synthetic inputs from `synthetic.py` and records
+the throughput (pages/sec or entries/sec) and the peak RSS of the script's processes
+(see `measure.py`). Timings include the interpreter startup and imports of each script.
+Results are written to a JSON file, which can later be passed as `--baseline` to compare a
+change against. The comparison exits with status 1 if a stage got slower or uses more memory
+than the tolerance allows.
+
+### How to Use:
+    python run_benchmarks.py --output baseline.json
+    # ... change something ...
+    python run_benchmarks.py --output results.json --baseline baseline.json
+    python run_benchmarks.py --stages check_dataset check_dataset_streaming --entries 100000
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from synthetic import make_dataset, make_exam_pdf
+
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+RESULTS_VERSION = "1"
+
+
+def pdf_stages(pdf_file, work_dir, workers):
+    base_dir = REPO_DIR / "base"
+    return {
+        "pdf2text_v0": (base_dir, ["pdf2text_v0.py", "--pdf_path", pdf_file, "--output_dir", work_dir / "v0"]),
+        "pdf2text_v0_workers": (
+            base_dir,
+            ["pdf2text_v0.py", "--pdf_path", pdf_file, "--output_dir", work_dir / "v0_workers", "--workers", str(workers)],
+        ),
+        "pdf2text_pdfminer": (base_dir, ["pdf2text.py", "--pdf_path", pdf_file, "--output_dir", work_dir / "pdfminer"]),
+        "pdf2text_pymupdf": (
+            base_dir,
+            ["pdf2text.py", "--pdf_path", pdf_file, "--output_dir", work_dir / "pymupdf", "--layout_backend", "pymupdf"],
+        ),
+    }
+
+
+def dataset_stages(json_file, workers):
+    validator_dir = REPO_DIR / "validator"
+    check = ["check_dataset.py", "--json_file", json_file, "--language_code", "en"]
+    return {
+        "check_dataset": (validator_dir, check),
+        "check_dataset_workers": (validator_dir, check + ["--workers", str(workers)]),
+        "check_dataset_streaming": (validator_dir, check + ["--streaming"]),
+        "format_json": (REPO_DIR / "label_studio", ["format_json.py", "--source_path", json_file]),
+    }
+
+
+STAGE_UNITS = {
+    **{name: "pages" for name in pdf_stages(Path(), Path(), 1)},
+    **{name: "entries" for name in dataset_stages(Path(), 1)},
+}
+
+
+def run_stage(cwd, command, log_file):
+    # Started through measure.py, so the peak RSS doesn't include this process's own
+    measure = [sys.executable, str(Path(__file__).resolve().parent / "measure.py"), "--log_file", str(log_file), "--"]
+    output = subprocess.run(
+        measure + [sys.executable] + [str(arg) for arg in command], cwd=cwd, capture_output=True, text=True, check=True,
+    ).stdout
+    result = json.loads(output)
+
+    if result["returncode"] != 0:
+        with open(log_file, "r") as log:
+            raise RuntimeError(f"{' '.join(str(arg) for arg in command)} failed:\n{log.read()[-2000:]}")
+    return result["seconds"], result["peak_rss_mb"]
+
+
+def clean_outputs(work_dir, json_file):
+    for name in ["v0", "v0_workers", "pdfminer", "pymupdf"]:
+        shutil.rmtree(work_dir / name, ignore_errors=True)
+    # The Label Studio export state goes too, otherwise an incremental export skips every entry
+    for path in json_file.parent.glob("*"):
+        if path.name.endswith(".validation_cache.sqlite") or path.name.startswith(f"{json_file.stem}_label_studio"):
+            path.unlink()
+
+
+def run_benchmarks(args):
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix="mm_exams_bench_"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    pdf_file = work_dir / "exam.pdf"
+    json_file = work_dir / "dataset" / "exam.json"
+
+    config = {
+        "pages": args.pages,
+        "lines_per_page": args.lines_per_page,
+        "images_per_page": args.images_per_page,
+        "tables_per_page": args.tables_per_page,
+        "diagrams_per_page": args.diagrams_per_page,
+        "entries": args.entries,
+        "image_ratio": args.image_ratio,
+        "workers": args.workers,
+        "seed": args.seed,
+    }
+    print(f"Generating inputs in {work_dir}")
+    make_exam_pdf(
+        pdf_file, args.pages, args.lines_per_page, args.images_per_page, args.tables_per_page,
+        args.diagrams_per_page, seed=args.seed,
+    )
+    make_dataset(json_file, args.entries, args.image_ratio, seed=args.seed)
+
+    stages = {**pdf_stages(pdf_file, work_dir, args.workers), **dataset_stages(json_file, args.workers)}
+    items = {"pages": args.pages, "entries": args.entries}
+
+    results = {}
+    for name in args.stages or list(stages):
+        cwd, command = stages[name]
+        runs = []
+        for _ in range(args.repeat):
+            clean_outputs(work_dir, json_file)
+            runs.append(run_stage(cwd, command, work_dir / f"{name}.log"))
+
+        # Best of the repeats, the least disturbed by whatever else runs on the machine
+        seconds = min(seconds for seconds, _ in runs)
+        unit = STAGE_UNITS[name]
+        results[name] = {
+            "unit": unit,
+            "items": items[unit],
+            "seconds": round(seconds, 3),
+            "rate": round(items[unit] / seconds, 2),
+            "peak_rss_mb": round(max(peak_rss for _, peak_rss in runs), 1),
+        }
+        print(f"{name:26} {results[name]['rate']:10.2f} {unit}/s {results[name]['peak_rss_mb']:8.1f} MB peak RSS")
+
+    if args.work_dir is None:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "version": RESULTS_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": config,
+        "stages": results,
+    }
+
+
+def compare(results, baseline, tolerance):
+    if baseline["config"] != results["config"]:
+        print("Warning: the baseline was recorded with different inputs, the comparison may be meaningless")
+    if (baseline["platform"], baseline["cpus"]) != (results["platform"], results["cpus"]):
+        print("Warning: the baseline was recorded on a different machine")
+
+    regressions = []
+    print(f"{'Stage':26} {'Rate':>10} {'Baseline':>10} {'Change':>8} {'RSS MB':>8} {'Baseline':>9} {'Change':>8}")
+    for name, stage in results["stages"].items():
+        reference = baseline["stages"].get(name)
+        if reference is None:
+            print(f"{name:26} {stage['rate']:10.2f} {'-':>10}")
+            continue
+
+        rate_change = stage["rate"] / reference["rate"] - 1
+        rss_change = stage["peak_rss_mb"] / reference["peak_rss_mb"] - 1
+        flags = []
+        if rate_change < -tolerance:
+            flags.append("slower")
+        if rss_change > tolerance:
+            flags.append("more memory")
+        if flags:
+            regressions.append(name)
+
+        print(
+            f"{name:26} {stage['rate']:10.2f} {reference['rate']:10.2f} {rate_change:+8.1%} "
+            f"{stage['peak_rss_mb']:8.1f} {reference['peak_rss_mb']:9.1f} {rss_change:+8.1%} {', '.join(flags)}"
+        )
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the extraction, validation and Label Studio scripts")
+    parser.add_argument("--output", type=str, default="benchmark_results.json", help="Results file to write")
+    parser.add_argument("--baseline", type=str, default=None, help="Results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative slowdown or memory growth allowed")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGE_UNITS), default=None, help="Stages to run (all by default)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage, the fastest one is kept")
+    parser.add_argument("--work_dir", type=str, default=None, help="Keep the inputs and outputs here instead of a temp dir")
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--lines_per_page", type=int, default=30)
+    parser.add_argument("--images_per_page", type=int, default=1)
+    parser.add_argument("--tables_per_page", type=int, default=1)
+    parser.add_argument("--diagrams_per_page", type=int, default=1)
+    parser.add_argument("--entries", type=int, default=20000)
+    parser.add_argument("--image_ratio", type=float, default=0.3)
+    parser.add_argument("--workers", type=int, default=4, help="Workers of the *_workers stages")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = run_benchmarks(args)
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"Regressions in: {', '.join(regressions)}")
+            sys.exit(1)
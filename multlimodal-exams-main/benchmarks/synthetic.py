@@ -0,0 +1,205 @@
+"""
+Deterministic synthetic inputs for the benchmarks.
+
+The same arguments and seed always produce byte-identical files, so timings from different
+commits are measured on the same data.
+
+### How to Use:
+    python synthetic.py pdf --path "exam.pdf" --pages 50 --lines_per_page 30 --images_per_page 2 --tables_per_page 1
+    python synthetic.py dataset --path "dataset/exam.json" --entries 10000 --image_ratio 0.3
+"""
+
+import argparse
+import io
+import json
+import random
+from pathlib import Path
+
+import pymupdf
+from PIL import Image
+
+
+WORDS = (
+    "the of and a to in is which following what value figure table shows energy force mass "
+    "reaction cell river country year equation function graph area volume speed answer correct "
+    "choose statement true false most likely because therefore average population temperature"
+).split()
+PAGE_WIDTH, PAGE_HEIGHT, MARGIN = 595, 842, 50
+LOGO_SIZE = 24
+
+
+def sentence(rng, words):
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:]
+
+
+def noise_image(rng, width, height, image_format):
+    # Blocks of random colors, so images have some structure but compress like photos
+    block = 8
+    small = Image.frombytes(
+        "RGB", (width // block, height // block), rng.randbytes((width // block) * (height // block) * 3)
+    )
+    buffer = io.BytesIO()
+    small.resize((width, height), Image.NEAREST).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def draw_table(page, rng, top, rows, cols):
+    cell_width = (PAGE_WIDTH - 2 * MARGIN) / cols
+    cell_height = 18
+    for row in range(rows + 1):
+        y = top + row * cell_height
+        page.draw_line((MARGIN, y), (PAGE_WIDTH - MARGIN, y))
+    for col in range(cols + 1):
+        x = MARGIN + col * cell_width
+        page.draw_line((x, top), (x, top + rows * cell_height))
+    for row in range(rows):
+        for col in range(cols):
+            text = str(rng.randint(0, 999)) if row else sentence(rng, 1)
+            page.insert_text((MARGIN + col * cell_width + 4, top + row * cell_height + 13), text, fontsize=9)
+    return top + rows * cell_height
+
+
+def draw_diagram(page, rng, top, height):
+    # Axes, a curve and a few shapes, all vector drawings
+    left, right = MARGIN + 40, PAGE_WIDTH / 2
+    page.draw_line((left, top + height), (right, top + height))
+    page.draw_line((left, top), (left, top + height))
+    points = [
+        pymupdf.Point(left + i * (right - left) / 3, top + rng.uniform(0.1, 0.9) * height) for i in range(4)
+    ]
+    page.draw_bezier(*points, color=(0, 0, 1))
+    center = pymupdf.Point(rng.uniform(right + 60, PAGE_WIDTH - MARGIN - 60), top + height / 2)
+    page.draw_circle(center, rng.uniform(15, height / 2), color=(1, 0, 0))
+    page.draw_rect(pymupdf.Rect(right + 20, top, right + 60, top + 30), color=(0, 0.5, 0), fill=(0.8, 1, 0.8))
+    return top + height
+
+
+def make_exam_pdf(path, pages=20, lines_per_page=30, images_per_page=1, tables_per_page=1,
+                  diagrams_per_page=1, logo=True, seed=0):
+    rng = random.Random(seed)
+    logo_bytes = noise_image(rng, 64, 64, "PNG")
+    doc = pymupdf.open()
+    question = 1
+
+    for _ in range(pages):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        if logo:
+            # The same image on every page, like a header logo
+            page.insert_image(pymupdf.Rect(MARGIN, 15, MARGIN + LOGO_SIZE, 15 + LOGO_SIZE), stream=logo_bytes)
+
+        # Interleave questions (text and options) with the other elements until the page is full
+        elements = ["image"] * images_per_page + ["table"] * tables_per_page + ["diagram"] * diagrams_per_page
+        rng.shuffle(elements)
+        lines_left = lines_per_page
+        y = MARGIN + 10
+        while (lines_left > 0 or elements) and y < PAGE_HEIGHT - MARGIN - 120:
+            if lines_left > 0:
+                page.insert_text((MARGIN, y), f"{question}. {sentence(rng, rng.randint(8, 14))}?", fontsize=10)
+                y += 14
+                for letter in "ABCD"[:min(4, max(0, lines_left - 1))]:
+                    page.insert_text((MARGIN + 15, y), f"{letter}) {sentence(rng, rng.randint(2, 5))}", fontsize=10)
+                    y += 14
+                lines_left -= 5
+                question += 1
+                y += 6
+
+            if elements:
+                element = elements.pop()
+                if element == "image":
+                    width, height = rng.choice([(160, 100), (200, 140), (120, 120)])
+                    image = noise_image(rng, width * 2, height * 2, rng.choice(["PNG", "JPEG"]))
+                    page.insert_image(pymupdf.Rect(MARGIN, y, MARGIN + width, y + height), stream=image)
+                    y += height
+                elif element == "table":
+                    y = draw_table(page, rng, y, rng.randint(3, 6), rng.randint(3, 5))
+                else:
+                    y = draw_diagram(page, rng, y, 90)
+                y += 12
+
+    # Fixed metadata and document id keep the output byte-identical across runs
+    doc.set_metadata({})
+    doc.save(path, garbage=3, deflate=True, no_new_id=True)
+    doc.close()
+    return pages
+
+
+def make_dataset(path, entries=1000, image_ratio=0.3, image_option_ratio=0.05, language="en", seed=0):
+    """Writes a dataset JSON that passes check_dataset.py, with its images in an `images/` folder."""
+    rng = random.Random(seed)
+    path = Path(path)
+    images_dir = path.parent / "images"
+    images_dir.mkdir(parents=True, exist_ok=True)
+
+    data = []
+    for index in range(entries):
+        entry = {
+            "language": language,
+            "country": "Synthetic",
+            "file_name": path.name,
+            "source": "synthetic",
+            "license": "CC BY 4.0",
+            "level": rng.choice(["University Entrance", "High School"]),
+            "category_en": rng.choice(["Physics", "Biology", "Mathematics", "History", "Geography"]),
+            "category_original_lang": "Synthetic",
+            "original_question_num": index + 1,
+            "question": f"{index + 1}. {sentence(rng, rng.randint(8, 30))}?",
+            "options": [f"{letter}) {sentence(rng, rng.randint(2, 8))}" for letter in "ABCD"],
+            "answer": rng.randint(0, 3),
+            "image_png": None,
+            "image_information": None,
+            "image_type": None,
+            "parallel_question_id": None,
+        }
+
+        if rng.random() < image_ratio:
+            entry["image_png"] = f"question_{index}.png"
+            entry["image_information"] = rng.choice(["useful", "essential"])
+            entry["image_type"] = rng.choice(["graph", "table", "diagram", "photo"])
+            (images_dir / entry["image_png"]).write_bytes(noise_image(rng, 96, 64, "PNG"))
+
+        if rng.random() < image_option_ratio:
+            entry["options"] = [f"question_{index}_option_{option}.png" for option in range(4)]
+            for option in entry["options"]:
+                (images_dir / option).write_bytes(noise_image(rng, 48, 48, "PNG"))
+
+        data.append(entry)
+
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(data, file, ensure_ascii=False, indent=2)
+    return entries
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Synthetic exam PDFs and datasets")
+    subparsers = parser.add_subparsers(dest="kind", required=True)
+
+    pdf = subparsers.add_parser("pdf", help="Exam PDF with questions, images, ruled tables and vector diagrams")
+    pdf.add_argument("--path", type=str, required=True, help="PDF file to write")
+    pdf.add_argument("--pages", type=int, default=20)
+    pdf.add_argument("--lines_per_page", type=int, default=30, help="Text density, lines of questions and options")
+    pdf.add_argument("--images_per_page", type=int, default=1)
+    pdf.add_argument("--tables_per_page", type=int, default=1)
+    pdf.add_argument("--diagrams_per_page", type=int, default=1)
+    pdf.add_argument("--no_logo", action="store_true", help="Don't repeat a logo on every page")
+    pdf.add_argument("--seed", type=int, default=0)
+
+    dataset = subparsers.add_parser("dataset", help="Dataset JSON in the format checked by check_dataset.py")
+    dataset.add_argument("--path", type=str, required=True, help="JSON file to write, images go next to it")
+    dataset.add_argument("--entries", type=int, default=1000)
+    dataset.add_argument("--image_ratio", type=float, default=0.3, help="Share of entries with an image_png")
+    dataset.add_argument("--image_option_ratio", type=float, default=0.05, help="Share of entries with image options")
+    dataset.add_argument("--language", type=str, default="en")
+    dataset.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.kind == "pdf":
+        make_exam_pdf(
+            args.path, args.pages, args.lines_per_page, args.images_per_page, args.tables_per_page,
+            args.diagrams_per_page, not args.no_logo, args.seed,
+        )
+    else:
+        make_dataset(args.path, args.entries, args.image_ratio, args.image_option_ratio, args.language, args.seed)
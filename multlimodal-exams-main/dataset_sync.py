@@ -0,0 +1,130 @@
+"""
+Incremental sync of dataset repos into a local directory.
+
+Every synced repo directory keeps a `.sync_manifest.json` with the hash of each file as reported
+by the source. On the next sync only new or changed files are transferred, files removed from the
+source are removed locally, and only JSON files whose hash changed are normalized again into their
+`valid__*.json` copy (indent=2, ensure_ascii=False).
+
+Two sources are supported:
+- `HubSource`: a Hugging Face dataset repo (file hashes from the repo tree, no download needed).
+- `LocalSource`: a plain directory, used as a stand-in for the hub to test and run offline.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+
+MANIFEST_NAME = ".sync_manifest.json"
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class HubSource:
+    def __init__(self, api, repo):
+        self.api = api
+        self.repo = repo
+        self.name = f"hub:{repo}"
+
+    def list_files(self):
+        files = {}
+        for item in self.api.list_repo_tree(self.repo, repo_type="dataset", recursive=True):
+            # Folders have no blob id; LFS files are identified by their sha256
+            blob_id = getattr(item, "blob_id", None)
+            if blob_id is None:
+                continue
+            lfs = getattr(item, "lfs", None)
+            files[item.path] = lfs.sha256 if lfs is not None else blob_id
+        return files
+
+    def fetch(self, path, save_dir):
+        from huggingface_hub import hf_hub_download
+
+        hf_hub_download(repo_id=self.repo, filename=path, repo_type="dataset", local_dir=save_dir)
+
+
+class LocalSource:
+    def __init__(self, root):
+        self.root = root
+        self.name = f"local:{os.path.abspath(root)}"
+
+    def list_files(self):
+        files = {}
+        for root, dirs, names in os.walk(self.root):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for name in names:
+                path = os.path.join(root, name)
+                files[os.path.relpath(path, self.root).replace(os.sep, "/")] = file_sha256(path)
+        return files
+
+    def fetch(self, path, save_dir):
+        destination = os.path.join(save_dir, path)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copy2(os.path.join(self.root, path), destination)
+
+
+def valid_path(save_dir, path):
+    directory, name = os.path.split(os.path.join(save_dir, path))
+    return os.path.join(directory, "valid__" + name)
+
+
+def normalize_json(save_dir, path):
+    with open(os.path.join(save_dir, path), "r", encoding="utf-8") as f:
+        data = json.load(f)
+    with open(valid_path(save_dir, path), "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+
+def sync_repo(source, save_dir, max_workers=8):
+    os.makedirs(save_dir, exist_ok=True)
+    manifest_path = os.path.join(save_dir, MANIFEST_NAME)
+    manifest = {"source": source.name, "files": {}}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        if previous.get("source") == source.name:
+            manifest = previous
+
+    local_files = manifest["files"]
+    remote_files = source.list_files()
+
+    changed = [
+        path for path, file_hash in sorted(remote_files.items())
+        if local_files.get(path) != file_hash or not os.path.exists(os.path.join(save_dir, path))
+    ]
+    removed = [path for path in local_files if path not in remote_files]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(lambda path: source.fetch(path, save_dir), changed))
+
+    for path in removed:
+        for local_path in [os.path.join(save_dir, path), valid_path(save_dir, path)]:
+            if os.path.exists(local_path):
+                os.remove(local_path)
+
+    normalized = 0
+    for path in changed:
+        if path.endswith(".json") and not os.path.basename(path).startswith("valid__"):
+            try:
+                normalize_json(save_dir, path)
+                normalized += 1
+            except ValueError as e:
+                print(f"Could not normalize {path}: {e}")
+
+    # Written last, so an interrupted sync transfers the missing files again
+    manifest["files"] = remote_files
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+    return {"transferred": len(changed), "removed": len(removed), "normalized": normalized, "total": len(remote_files)}
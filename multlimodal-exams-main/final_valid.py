@@ -2,19 +2,114 @@ import pandas as pd
 import json
 import os
 import argparse
-from collections import defaultdict
-from huggingface_hub import HfApi, HfFolder, Repository
-from huggingface_hub import hf_hub_download
-from huggingface_hub import snapshot_download
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from huggingface_hub import HfApi
+
+from dataset_sync import HubSource, LocalSource, sync_repo
 
 from rich.console import Console
 from rich.table import Table
 import shutil
 
 
-def main(local_dir):
-  api = HfApi()
+# Bump when the computed statistics change so cached sidecars are recomputed
+STATS_VERSION = "1"
+BREAKDOWNS = ["image_type", "image_information", "category_en", "language"]
+
+
+def is_multimodal(item):
+  if item.get("image_png"):
+    return True
+  return any(str(option).lower().endswith(".png") for option in item.get("options") or [])
+
+
+def compute_stats(data):
+  stats = {"total": len(data), "multimodal": 0, "text": 0, "category_original_lang": Counter()}
+  for key in BREAKDOWNS:
+    stats[key] = Counter()
+
+  for item in data:
+    if is_multimodal(item):
+      stats["multimodal"] += 1
+    else:
+      stats["text"] += 1
+    stats["category_original_lang"][str(item.get("category_original_lang"))] += 1
+    for key in BREAKDOWNS:
+      stats[key][str(item.get(key))] += 1
+  return stats
+
+
+def file_stats(root, file):
+  # Stats are cached in a sidecar next to the JSON file and reused while the file is unchanged
+  path = os.path.join(root, file)
+  sidecar = path + ".stats"
+  valid_file = os.path.join(root, "valid__" + file)
+  stat = os.stat(path)
+  fingerprint = {"size": stat.st_size, "mtime": stat.st_mtime, "version": STATS_VERSION}
+
+  if os.path.exists(sidecar) and os.path.exists(valid_file):
+    try:
+      with open(sidecar, "r", encoding="utf-8") as f:
+        cached = json.load(f)
+      if cached["fingerprint"] == fingerprint:
+        return path, cached["stats"], None
+    except (ValueError, KeyError):
+      pass
+
+  try:
+    with open(path, "r", encoding="utf-8") as f:
+      data = json.load(f)
+    stats = compute_stats(data)
+  except Exception as e:
+    return path, None, f"{type(e).__name__}: {e}"
+
+  if not os.path.exists(valid_file):
+    with open(valid_file, "w", encoding="utf-8") as f:
+      json.dump(data, f, indent=2, ensure_ascii=False)
+
+  with open(sidecar, "w", encoding="utf-8") as f:
+    json.dump({"fingerprint": fingerprint, "stats": stats}, f, ensure_ascii=False)
+  return path, stats, None
+
 
+def collect_stats(local_dir, workers):
+  jobs = []
+  for root, dirs, files in os.walk(local_dir):
+    # Skip ".cache" directories
+    dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+    for file in sorted(files):
+      # Skip the normalized copies and the sync manifest
+      if file.endswith(".json") and not file.startswith(("valid__", ".")):
+        jobs.append((root, file))
+
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+    results = list(executor.map(file_stats, [root for root, _ in jobs], [file for _, file in jobs]))
+
+  per_repo = defaultdict(lambda: {"json": 0, "multimodal": 0, "text": 0, "total": 0})
+  breakdowns = {key: Counter() for key in BREAKDOWNS}
+  for path, stats, error in results:
+    if error is not None:
+      print(f"Could not read {path}: {error}")
+      continue
+
+    print(path)
+    print(f"Category_en: {set(stats['category_en'])}")
+    print(f"Category_original_lang: {set(stats['category_original_lang'])}")
+    print(f"Image information: {set(stats['image_information'])}")
+    print(f"Image type: {set(stats['image_type'])}")
+    print("-"*80)
+
+    repo = os.path.relpath(path, local_dir).split(os.sep)[0]
+    per_repo[repo]["json"] += 1
+    for key in ["multimodal", "text", "total"]:
+      per_repo[repo][key] += stats[key]
+    for key in BREAKDOWNS:
+      breakdowns[key].update(stats[key])
+  return per_repo, breakdowns
+
+
+def list_hub_sources(api):
   sheet = "Completed_and_Validated_Exams"
   gsheet_id = "1f4nkmFyTaYu0-iBeRQ1D-KTD3JoyC-FI7V9G6hTdn5o"
   data_url = f"https://docs.google.com/spreadsheets/d/{gsheet_id}/gviz/tq?tqx=out:csv&sheet={sheet}"
@@ -26,83 +121,80 @@ def main(local_dir):
 
   hf_links = [link.replace("tree/main", "") for link in hf_links]
   print(hf_links)
-  
-  console = Console()
-  table = Table(show_header=True, header_style="bold magenta")
-  table.add_column("Repo", justify="left")
-  table.add_column("JSON", justify="right")
-  table.add_column("Multimodal", justify="right")
-  table.add_column("Text", justify="right")
-  table.add_column("Total", justify="right")
-  grand_total = grand_text = grand_multimodal = 0
-  
+
+  sources = []
   visited = defaultdict(bool)
   for idx, link in enumerate(hf_links):
-    # break
     if visited[link]:
       continue
     visited[link] = True
     link = link.strip()
     if not link.startswith("https://"):
       continue
-    
+
     if link.endswith("/"):
       link = link[:-1]
     link = link.strip()
     repo_user = link.split("/")[-2]
     repo_id = link.split("/")[-1]
     repo = f"{repo_user}/{repo_id}"
-    repo_files = api.list_repo_files(repo, repo_type="dataset")
-    # Download full repo from hub
-    
+    sources.append((idx, repo, HubSource(api, repo)))
+  return sources
+
+
+def list_local_sources(source_dir):
+  # Offline stand-in for the hub: every subdirectory is a repo named like "user__repo"
+  sources = []
+  for idx, name in enumerate(sorted(d for d in os.listdir(source_dir) if not d.startswith("."))):
+    path = os.path.join(source_dir, name)
+    if os.path.isdir(path):
+      sources.append((idx, name.replace("__", "/", 1), LocalSource(path)))
+  return sources
+
+
+def main(local_dir, workers=None, source_dir=None):
+  console = Console()
+  table = Table(show_header=True, header_style="bold magenta")
+  table.add_column("Repo", justify="left")
+  table.add_column("JSON", justify="right")
+  table.add_column("Multimodal", justify="right")
+  table.add_column("Text", justify="right")
+  table.add_column("Total", justify="right")
+  grand_total = grand_text = grand_multimodal = 0
+
+  sources = list_local_sources(source_dir) if source_dir else list_hub_sources(HfApi())
+  for idx, repo, source in sources:
     save_dir = os.path.join(local_dir, f"{idx:03d}__"+ repo.replace("/", "__"))
-    # old_save_dir = os.path.join(local_dir, repo.replace("/", "__"))
-    # shutil.move(old_save_dir, save_dir)
+    # Only files whose hash changed since the last sync are transferred and normalized
     try:
-      snapshot_download(repo_id=repo, repo_type="dataset", 
-                      local_dir=save_dir, max_workers=8)
-    except:
+      counts = sync_repo(source, save_dir, max_workers=8)
+    except Exception:
       # Access issue
       print( f"Access issue with {repo}")
-  
-  # For all json files in the local_dir open and save as indent=2, ensure ascii=False
-  
-  for root, dirs, files in os.walk(local_dir):
-    # Skip ".cache" directories
-    
-    for file in files:
-      if file.endswith(".json"):
-        # import ipdb; ipdb.set_trace()
-        valid_file = os.path.join(root, "valid__" + file)
-        if file.startswith("valid__"):
-          continue
-        
-        with open(os.path.join(root, file), "r", encoding="utf-8") as f:
-          data = json.load(f)
-          # Get category_en, category_original_lang and print set
-          cats_en = set()
-          cats_original = set()
-          image_png = set()
-          image_information = set()
-          
-          for item in data:
-            cats_en.add(item["category_en"])
-            cats_original.add(item["category_original_lang"])
-            image_information.add(item["image_information"])
-            image_png.add(item["image_type"])
-          print(os.path.join(root, file))
-          print(f"Category_en: {cats_en}")
-          print(f"Category_original_lang: {cats_original}")
-          print(f"Image information: {image_information}")
-          print(f"Image type: {image_png}")
-          print("-"*80)
-        
-        if os.path.exists(valid_file):
-          continue
-        
-        with open(os.path.join(root, "valid__" + file), "w", encoding="utf-8") as f:
-          json.dump(data, f, indent=2, ensure_ascii=False)
-  
+      continue
+    print(f"{repo}: {counts['transferred']} transferred, {counts['removed']} removed, "
+          f"{counts['normalized']} normalized, {counts['total']} files")
+
+  # For all json files in the local_dir compute the statistics and save as indent=2, ensure ascii=False
+  per_repo, breakdowns = collect_stats(local_dir, workers)
+
+  for repo, counts in sorted(per_repo.items()):
+    table.add_row(repo, str(counts["json"]), str(counts["multimodal"]), str(counts["text"]), str(counts["total"]))
+    grand_total += counts["total"]
+    grand_text += counts["text"]
+    grand_multimodal += counts["multimodal"]
+  table.add_row("Total", str(sum(counts["json"] for counts in per_repo.values())),
+                str(grand_multimodal), str(grand_text), str(grand_total), style="bold")
+  console.print(table)
+
+  for key in BREAKDOWNS:
+    breakdown_table = Table(show_header=True, header_style="bold magenta")
+    breakdown_table.add_column(key, justify="left")
+    breakdown_table.add_column("Questions", justify="right")
+    for value, count in breakdowns[key].most_common():
+      breakdown_table.add_row(value, str(count))
+    console.print(breakdown_table)
+
   # find . -type f -name "*.zip" -exec sh -c 'unzip -d "${1%.*}" "$1"' _ {} \;
   # find . -type f -name "valid__*.json" -delete
     
@@ -110,6 +202,9 @@ def main(local_dir):
 if __name__ == "__main__":
   parser = argparse.ArgumentParser()
   parser.add_argument("--local_dir", type=str, default="./a_final_validation")
+  parser.add_argument("--workers", type=int, default=None, help="Processes used to compute the statistics")
+  parser.add_argument("--source_dir", type=str, default=None,
+                      help="Sync from the repo directories in this local mirror instead of the hub")
   args = parser.parse_args()
   local_dir = args.local_dir
-  main(local_dir)
+  main(local_dir, args.workers, args.source_dir)
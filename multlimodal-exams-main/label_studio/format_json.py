@@ -1,62 +1,261 @@
+"""
+Converts a dataset JSON file into Label Studio tasks.
+
+The dataset is read one entry at a time and the tasks are written as they are converted, so
+memory stays flat on large datasets. The tasks go to `<stem>_label_studio.json`, or with
+`--max_tasks`/`--max_mb` to shards `<stem>_label_studio-00000.json`, ... of at most that many
+tasks or MB each, which Label Studio imports without timing out.
+
+`Black.png` (the placeholder for missing images) is hardlinked into the dataset's `images/`
+folder, and left alone when an identical file is already there.
+
+A full export removes the files of the other layout (the shards, or the single file), so
+Label Studio doesn't import stale tasks next to the new ones.
+
+With `--incremental` only the entries that were not exported before are converted, into new
+shards numbered after the previous ones. The content hashes of every exported entry, sharded or
+not, are kept in `<stem>_label_studio.state.json`, which is saved after every finished shard so
+a run that fails partway doesn't export the tasks of its finished shards again.
+
+The files are laid out like `json.dump(tasks, file, ensure_ascii=False, indent=2)`.
+
+### How to Use:
+    python format_json.py --source_path "dataset/exam.json"
+    python format_json.py --source_path "dataset/exam.json" --max_tasks 5000 --max_mb 50
+    python format_json.py --source_path "dataset/exam.json" --max_tasks 5000 --incremental
+"""
+
 import json
+import os
+import sys
 from pathlib import Path
+import filecmp
 import shutil
 import argparse
 
+# The validator scripts are imported as top-level modules, as in run_pipeline.py
+VALIDATOR_DIR = str(Path(__file__).resolve().parent.parent / "validator")
+if VALIDATOR_DIR not in sys.path:
+    sys.path.insert(0, VALIDATOR_DIR)
+from check_dataset import entry_content_hash, iter_json_array  # noqa: E402
 
-def process_data(source_path):
-    source_path = Path(source_path)
-    dataset_dir = source_path.parent
-    images_dir = dataset_dir / "images"
-    image_basedir = f"/data/local-files/?d={dataset_dir.name}/images/"
 
-    dest_path = source_path.with_name(f"{source_path.stem}_label_studio.json")
+BLACK_IMAGE = Path(__file__).parent / "img" / "Black.png"
+# Option slots shown by interface_v3.xml, shorter option lists are padded to it
+INTERFACE_OPTIONS = 4
+STATE_VERSION = "1"
+
+
+def image_basedir_for(dataset_dir):
+    return f"/data/local-files/?d={Path(dataset_dir).name}/images/"
+
+
+def link_black_image(images_dir):
+    Path(images_dir).mkdir(exist_ok=True)
+    target = Path(images_dir) / BLACK_IMAGE.name
+    if target.exists():
+        if os.path.samefile(BLACK_IMAGE, target) or filecmp.cmp(BLACK_IMAGE, target, shallow=False):
+            return
+        target.unlink()
+    try:
+        os.link(BLACK_IMAGE, target)
+    except OSError:
+        # Another filesystem, or links not supported
+        shutil.copy2(BLACK_IMAGE, target)
+
+
+def to_task(item, image_basedir):
     black_image = image_basedir + "Black.png"
 
-    # Copy default black image
-    black_image_file = source = Path(__file__).parent / "img" / "Black.png"
-    shutil.copy(black_image_file, images_dir)
+    assert item["original_question_num"] is not None, "Invalid Question Number"
+    item["id"] = item["original_question_num"]
+    # Entries straight from text2mcq have no answer yet, it is picked during the annotation
+    answer = item["options"][item["answer"]] if item["answer"] is not None else ""
 
-    with open(source_path, "r", encoding="utf-8") as file:
-        data = json.load(file)
+    if item["image_png"]:
+        item["image_png"] = image_basedir + item["image_png"]
+    else:
+        item["image_png"] = black_image
 
-    output_data = []
-    for item in data:
-        assert item["original_question_num"] is not None, "Invalid Question Number"
-        item["id"] = item["original_question_num"]
-        answer = item["options"][item["answer"]]
+    if answer.endswith(".png"):
+        answer = image_basedir + answer
+        item["answer_img"] = answer
+        item["answer"] = ""
+    else:
+        item["answer_img"] = black_image
+        item["answer"] = answer
 
-        if item["image_png"]:
-            item["image_png"] = image_basedir + item["image_png"]
+    options = item.get("options", [])
+    item["option_img"] = [""] * max(INTERFACE_OPTIONS, len(options))
+    for i, option in enumerate(options):
+        if option.endswith(".png"):
+            item["options"][i] = ""
+            option = image_basedir + option
+            item["option_img"][i] = option
         else:
-            item["image_png"] = black_image
+            item["option_img"][i] = black_image
+
+    return item
+
+
+class TaskWriter:
+    """Writes tasks to one JSON array file, or to shards capped by task count and size."""
+
+    def __init__(self, source_path, max_tasks=None, max_mb=None, sharded=False, first_shard=0, on_shard_done=None):
+        self.source_path = Path(source_path)
+        self.max_tasks = max_tasks
+        self.max_bytes = max_mb * 1024 * 1024 if max_mb else None
+        self.sharded = sharded or bool(max_tasks or max_mb)
+        self.shard_index = first_shard
+        self.paths = []
+        self.count = 0
+        self.file = None
+        self.shard_tasks = self.shard_bytes = 0
+        # Called with the keys of the tasks of every shard once it is in place
+        self.on_shard_done = on_shard_done
+        self.shard_keys = []
+
+    def shard_path(self, index):
+        if not self.sharded:
+            return self.source_path.with_name(f"{self.source_path.stem}_label_studio.json")
+        return self.source_path.with_name(f"{self.source_path.stem}_label_studio-{index:05d}.json")
 
-        if answer.endswith(".png"):
-            answer = image_basedir + answer
-            item["answer_img"] = answer
-            item["answer"] = ""
+    def open_shard(self):
+        path = self.shard_path(self.shard_index)
+        self.shard_index += 1
+        self.paths.append(path)
+        self.file = open(f"{path}.tmp", "w", encoding="utf-8")
+        self.file.write("[")
+        self.shard_tasks = self.shard_bytes = 0
+        self.shard_keys = []
+
+    def close_shard(self, complete=True):
+        self.file.write("\n]" if self.shard_tasks else "]")
+        self.file.close()
+        self.file = None
+        path = self.paths[-1]
+        if complete:
+            os.replace(f"{path}.tmp", path)
+            if self.on_shard_done is not None:
+                self.on_shard_done(self.shard_keys)
         else:
-            item["answer_img"] = black_image
-            item["answer"] = answer
+            os.remove(f"{path}.tmp")
+
+    def write(self, task, key=None):
+        # Indented as an item of the array, JSON strings have no raw newlines
+        data = "\n  " + json.dumps(task, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+        size = len(data.encode("utf-8"))
+        if self.file is not None and self.sharded and self.shard_tasks and (
+            (self.max_tasks and self.shard_tasks >= self.max_tasks)
+            or (self.max_bytes and self.shard_bytes + size > self.max_bytes)
+        ):
+            self.close_shard()
+        if self.file is None:
+            self.open_shard()
+
+        self.file.write(("," if self.shard_tasks else "") + data)
+        self.shard_keys.append(key)
+        self.shard_tasks += 1
+        self.shard_bytes += size
+        self.count += 1
+
+    def close(self, complete=True):
+        if self.file is not None:
+            self.close_shard(complete)
+        elif not self.sharded and complete:
+            # An empty dataset still replaces the previous output
+            self.open_shard()
+            self.close_shard()
+
+    def remove_stale_files(self):
+        # Shards of a previous, larger export, and the file of the other layout, would otherwise be
+        # imported as well
+        if self.sharded:
+            self.source_path.with_name(f"{self.source_path.stem}_label_studio.json").unlink(missing_ok=True)
+        first_stale = self.shard_index if self.sharded else 0
+        prefix = f"{self.source_path.stem}_label_studio-"
+        for path in self.source_path.parent.glob(f"{prefix}*.json"):
+            index = path.stem[len(prefix):]
+            if index.isdigit() and int(index) >= first_stale:
+                path.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(complete=exc_type is None)
+
+
+def state_path_for(source_path):
+    return source_path.with_name(f"{source_path.stem}_label_studio.state.json")
+
+
+def load_state(state_path):
+    try:
+        with open(state_path, "r", encoding="utf-8") as file:
+            state = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+    return state if state.get("version") == STATE_VERSION else None
+
+
+def save_state(state_path, exported, next_shard):
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump({"version": STATE_VERSION, "next_shard": next_shard, "exported": sorted(exported)}, file)
+    os.replace(tmp_path, state_path)
+
+
+def process_data(source_path, max_tasks=None, max_mb=None, incremental=False):
+    source_path = Path(source_path)
+    dataset_dir = source_path.parent
+    images_dir = dataset_dir / "images"
+    image_basedir = image_basedir_for(dataset_dir)
+
+    link_black_image(images_dir)
+
+    state_path = state_path_for(source_path)
+    state = load_state(state_path) if incremental else None
+    exported = set(state["exported"]) if state else set()
+    first_shard = state["next_shard"] if state else 0
+    seen = set(exported)
+
+    def shard_done(keys):
+        # Recorded as soon as the shard is in place, so a run failing later doesn't export it again
+        exported.update(keys)
+        if writer.sharded:
+            save_state(state_path, exported, writer.shard_index)
 
-        item["option_img"] = ["", "", "", ""]
-        for i, option in enumerate(item.get("options", [])):
-            if option.endswith(".png"):
-                item["options"][i] = ""
-                option = image_basedir + option
-                item["option_img"][i] = option
-            else:
-                item["option_img"][i] = black_image
+    max_options = 0
+    with TaskWriter(
+        source_path, max_tasks, max_mb, sharded=incremental, first_shard=first_shard, on_shard_done=shard_done
+    ) as writer:
+        for _, _, item in iter_json_array(str(source_path)):
+            # Every export is recorded, so a full export can be followed by incremental ones
+            entry_hash = entry_content_hash(item)
+            if incremental and entry_hash in seen:
+                continue
+            seen.add(entry_hash)
+            max_options = max(max_options, len(item.get("options", [])))
+            writer.write(to_task(item, image_basedir), entry_hash)
 
-        output_data.append(item)
+    if not incremental:
+        writer.remove_stale_files()
+    # An unsharded export leaves the shard numbers to the incremental ones
+    save_state(state_path, exported, writer.shard_index if writer.sharded else 0)
 
-    with open(dest_path, "w", encoding="utf-8") as file:
-        json.dump(output_data, file, ensure_ascii=False, indent=2)
+    print("{} tasks written to {} file(s): {}".format(writer.count, len(writer.paths), [str(p) for p in writer.paths]))
+    if max_options > INTERFACE_OPTIONS:
+        print(f"Some entries have {max_options} options, interface_v3.xml only shows the first {INTERFACE_OPTIONS}")
+    return writer.paths
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process JSON data for Label Studio.")
     parser.add_argument("--source_path", type=str, help="Full path to the source JSON file.")
+    parser.add_argument("--max_tasks", type=int, default=None, help="Maximum tasks per output shard")
+    parser.add_argument("--max_mb", type=float, default=None, help="Maximum size of an output shard in MB")
+    parser.add_argument("--incremental", action="store_true", help="Only export entries added since the last export")
 
     args = parser.parse_args()
-    process_data(args.source_path)
+    process_data(args.source_path, args.max_tasks, args.max_mb, args.incremental)
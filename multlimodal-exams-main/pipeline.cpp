@@ -5,6 +5,7 @@
 #include <vector>
 #include <map>
 #include <cassert>
+#include <cstdlib>
 #include <thread>
 #include <nlohmann/json.hpp>
 #include <httplib.h>
@@ -42,7 +43,10 @@ PageContent extractPDF(const std::string& filename) {
 // 🧠 Generate MCQ with OpenAI API
 std::string generateMCQ(const std::string& text) {
     try {
-        httplib::SSLClient cli("api.openai.com", 443);
+        // OPENAI_HOST/OPENAI_PORT point the call at another endpoint, e.g. benchmarks/mock_llm_server.py
+        const char* host = std::getenv("OPENAI_HOST");
+        const char* port = std::getenv("OPENAI_PORT");
+        httplib::SSLClient cli(host ? host : "api.openai.com", port ? std::stoi(port) : 443);
         cli.enable_server_certificate_verification(false);
 
         nlohmann::json request = {
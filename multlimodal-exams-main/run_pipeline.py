@@ -0,0 +1,440 @@
+"""
+Streaming end-to-end pipeline: PDF extraction -> MCQ generation -> validation -> Label Studio tasks.
+
+The stages run concurrently and hand items to each other through bounded queues, so MCQs are
+generated for the first pages while later pages are still being extracted:
+
+- extract: every PDF is extracted by `pdf2text.py`'s `iter_pdf_content` in its own process
+  (pymupdf is not thread-safe), which streams pages back as they are done. The pages are also
+  written to `<output_dir>/<pdf path>/document_content.ndjson`, with the PDF's path relative to
+  the directory holding all the input PDFs and without its suffix, as in `pdf2text_v0.py
+  --input_dir`. A PDF that fails to extract is reported in the summary, the other PDFs go on.
+- mcq: every page, or with `--question_spans` its detected question spans, is sent to the model
+  as in `text2mcq.py --async_mode` (same prompt, rate limiter, retries and response cache).
+- validate: the MCQs of a page are checked with `check_dataset.py`'s schema, in a pool of
+  `--validate_workers` processes. The answer is not checked, it is picked during the annotation.
+- export: valid, non-duplicate entries are appended to `<output_dir>/dataset.json` and, as
+  Label Studio tasks, to `<output_dir>/dataset_label_studio.json`. Rejected entries and their
+  errors go to `<output_dir>/rejected.ndjson`.
+
+A full queue blocks the stage feeding it (backpressure), so a slow stage never makes the run
+hold more than `--queue_size` items between two stages. At the end a summary of every stage
+(items, throughput, time spent working, waiting for input and blocked on the next stage) is
+printed and written to `<output_dir>/run_summary.json`.
+
+The metadata of the entries comes from `base/metadata_conf.py`, like for `text2mcq.py`. The
+client honours `OPENAI_BASE_URL`, e.g. to run against `benchmarks/mock_llm_server.py`.
+
+### How to Use:
+    python run_pipeline.py --pdf_path exams/*.pdf --output_dir out -k <openai key> --mcq_workers 16
+    python run_pipeline.py --pdf_path exam.pdf --output_dir out -k <key> --cache_path cache.sqlite --layout_backend pymupdf
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from openai import AsyncOpenAI
+
+# The stages import their siblings as top-level modules
+REPO_DIR = Path(__file__).resolve().parent
+for directory in ["base", "validator", "label_studio"]:
+    sys.path.insert(0, str(REPO_DIR / directory))
+
+from check_dataset import _init_worker, _validate_worker_chunk, list_image_files  # noqa: E402
+from format_json import image_basedir_for, link_black_image, to_task  # noqa: E402
+from image_output import add_image_args  # noqa: E402
+from layout_stream import LayoutWriter  # noqa: E402
+from metadata_conf import CATEGORY_EN, CATEGORY_ORIGINAL_LANG, LANGUAGE  # noqa: E402
+from pdf2text import iter_pdf_content  # noqa: E402
+from response_cache import CACHE_MODES, CacheMiss, ResponseCache  # noqa: E402
+from table_detection import add_table_args  # noqa: E402
+from text2mcq import (  # noqa: E402
+    MODEL,
+    REQUESTS_PER_MINUTE,
+    TOKENS_PER_MINUTE,
+    RateLimiter,
+    add_span_args,
+    async_chat_completion,
+    build_rows,
+    page_requests,
+    span_filter_from_args,
+)
+
+
+STOP = object()
+
+
+def extract_process(pdf_file, output_dir, extract_args, pages):
+    # Runs in a child process, a full queue blocks the extraction
+    try:
+        with LayoutWriter(output_dir / "document_content.ndjson") as writer:
+            for page in iter_pdf_content(pdf_file, output_dir, extract_args):
+                writer.write(page)
+                pages.put(page)
+        pages.put(None)
+    except Exception as e:
+        pages.put(RuntimeError(repr(e)))
+
+
+def next_page(pages, process):
+    while True:
+        try:
+            return pages.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                # The last page may have arrived since the timeout
+                try:
+                    return pages.get_nowait()
+                except queue.Empty:
+                    raise RuntimeError(f"Extraction process exited with code {process.exitcode}")
+
+
+def entry_key(entry):
+    # Same fields as the duplicate check of check_dataset.py
+    key = (entry["question"], entry["image_png"], tuple(entry["options"]))
+    return hashlib.blake2b(json.dumps(key).encode("utf-8"), digest_size=16).digest()
+
+
+def to_entry(row, pdf_file, question_num):
+    # build_rows keeps the column names of the mcq/ CSVs, the dataset uses the schema of check_dataset.py
+    return {
+        "language": row["language"],
+        "country": row["country"],
+        "file_name": pdf_file.name,
+        "source": row["source"],
+        "license": row["license"],
+        "level": row["level"],
+        "category_en": CATEGORY_EN,
+        "category_original_lang": CATEGORY_ORIGINAL_LANG,
+        "original_question_num": f"{row['page_num']}-{question_num}",
+        "question": row["question"],
+        "options": row["options"],
+        "answer": row["answer"],
+        "image_png": row["image_png"],
+        "image_information": row["image_information"],
+        "image_type": row["image_type"],
+        "parallel_question_id": row["parallel_question_id"],
+    }
+
+
+class JsonArrayWriter:
+    """Appends items to a JSON array file, which only replaces the previous file once closed."""
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.file = open(self.tmp_path, "w", encoding="utf-8")
+        self.file.write("[")
+        self.count = 0
+
+    def write(self, item):
+        self.file.write(("," if self.count else "") + "\n" + json.dumps(item, ensure_ascii=False, indent=2))
+        self.count += 1
+
+    def close(self, complete=True):
+        self.file.write("\n]\n" if self.count else "]\n")
+        self.file.close()
+        if complete:
+            os.replace(self.tmp_path, self.path)
+
+
+class StageStats:
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items_in = 0
+        self.items_out = 0
+        self.working = 0.0
+        self.waiting = 0.0
+        self.blocked = 0.0
+        self.max_backlog = 0
+        self.start = None
+        self.end = None
+
+    def summary(self):
+        seconds = (self.end - self.start) if self.start is not None else 0.0
+        return {
+            "stage": self.name,
+            "workers": self.workers,
+            "items_in": self.items_in,
+            "items_out": self.items_out,
+            "seconds": round(seconds, 3),
+            "rate": round(self.items_in / seconds, 2) if seconds else 0.0,
+            # Summed over the workers of the stage
+            "working_seconds": round(self.working, 3),
+            "waiting_seconds": round(self.waiting, 3),
+            "blocked_seconds": round(self.blocked, 3),
+            "max_backlog": self.max_backlog,
+        }
+
+
+async def run_stage(stats, process, inbox, outbox, downstream_workers):
+    async def worker():
+        while True:
+            waited = time.perf_counter()
+            item = await inbox.get()
+            started = time.perf_counter()
+            stats.waiting += started - waited
+            if item is STOP:
+                return
+
+            if stats.start is None:
+                stats.start = started
+            stats.items_in += 1
+            stats.max_backlog = max(stats.max_backlog, inbox.qsize() + 1)
+            async for result in process(item):
+                produced = time.perf_counter()
+                stats.working += produced - started
+                if outbox is not None:
+                    await outbox.put(result)
+                started = time.perf_counter()
+                stats.blocked += started - produced
+                stats.items_out += 1
+            stats.end = time.perf_counter()
+            stats.working += stats.end - started
+
+    await asyncio.gather(*[worker() for _ in range(stats.workers)])
+    if outbox is not None:
+        for _ in range(downstream_workers):
+            await outbox.put(STOP)
+
+
+class Pipeline:
+    def __init__(self, args):
+        self.args = args
+        self.output_dir = Path(args.output_dir)
+        self.images_dir = self.output_dir / "images"
+        self.span_filter = span_filter_from_args(args)
+        self.cache = None
+        if args.cache_path:
+            self.cache = ResponseCache(args.cache_path, args.cache_mode)
+        self.validation_context = None
+        self.validation_pool = None
+        self.seen_entries = {}
+        self.input_root = None
+        self.failures = {}
+        self.writers = {}
+        self.rejected = 0
+
+    async def extract(self, pdf_file):
+        key = pdf_file.resolve().relative_to(self.input_root)
+        # PDFs with the same name in different directories get their own output
+        output_dir = self.output_dir / key.with_suffix("")
+        output_dir.mkdir(parents=True, exist_ok=True)
+        context = multiprocessing.get_context("spawn")
+        pages = context.Queue(maxsize=self.args.queue_size)
+        process = context.Process(target=extract_process, args=(pdf_file, output_dir, self.args, pages), daemon=True)
+        process.start()
+        try:
+            while True:
+                page = await asyncio.to_thread(next_page, pages, process)
+                if page is None:
+                    break
+                if isinstance(page, Exception):
+                    raise page
+                yield pdf_file, page
+            await asyncio.to_thread(process.join)
+        except Exception as e:
+            # Like the corpus mode of pdf2text_v0.py, one broken PDF doesn't stop the run
+            self.failures[str(key)] = str(e)
+            print(f"Extraction of {key} failed: {e}")
+        finally:
+            if process.is_alive():
+                process.terminate()
+
+    async def generate(self, item):
+        pdf_file, page = item
+        row = {"page_num": page["page"], "parsed_text": page["content"]}
+        responses = []
+        requests = page_requests(row["parsed_text"], self.span_filter)
+        if not requests and row["parsed_text"].strip():
+            print("No question span found, skipping page {} of {}".format(row["page_num"], pdf_file.name))
+        try:
+            for messages, model_args in requests:
+                response, _ = await async_chat_completion(
+                    self.client, messages, model=MODEL, limiter=self.limiter, model_args=model_args, cache=self.cache,
+                )
+                responses.append(response)
+        except CacheMiss:
+            print("Offline cache miss, skipping page {} of {}".format(row["page_num"], pdf_file.name))
+            return
+
+        rows = build_rows(row, "\n\n".join(responses))
+        if rows:
+            yield [to_entry(row, pdf_file, question_num) for question_num, row in enumerate(rows, 1)]
+
+    async def validate(self, entries):
+        # Validation is CPU bound, it runs in worker processes set up like check_dataset.py --workers
+        results = await asyncio.get_running_loop().run_in_executor(self.validation_pool, _validate_worker_chunk, entries)
+        for entry, (_, entry_errors, _) in zip(entries, results):
+            # The answer is picked in Label Studio, so it is still missing here
+            entry_errors = [(message, location) for message, location in entry_errors if location != ("answer",)]
+            yield entry, entry_errors
+
+    async def export(self, item):
+        entry, entry_errors = item
+        # Duplicates are checked here, the only stage seeing the entries of every page
+        entry_hash = entry_key(entry) if not entry_errors else None
+        if entry_hash in self.seen_entries:
+            entry_errors = [(f"Duplicate of {self.seen_entries[entry_hash]}", None)]
+
+        if entry_errors:
+            self.rejected += 1
+            self.writers["rejected"].write(
+                json.dumps({"entry": entry, "errors": [[message, location] for message, location in entry_errors]},
+                           ensure_ascii=False) + "\n"
+            )
+            return
+
+        self.seen_entries[entry_hash] = f"{entry['file_name']} question {entry['original_question_num']}"
+        self.writers["dataset"].write(entry)
+        self.writers["tasks"].write(to_task(json.loads(json.dumps(entry)), self.image_basedir))
+        yield entry
+
+    async def run(self, pdf_files):
+        args = self.args
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.images_dir.mkdir(exist_ok=True)
+        link_black_image(self.images_dir)
+        if pdf_files:
+            self.input_root = Path(os.path.commonpath([pdf_file.resolve().parent for pdf_file in pdf_files]))
+        self.image_basedir = image_basedir_for(self.output_dir)
+        self.validation_context = {
+            "dataset_language": LANGUAGE,
+            "images_path": str(self.images_dir),
+            "image_files": list_image_files(str(self.images_dir)),
+        }
+        self.validation_pool = ProcessPoolExecutor(
+            args.validate_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.validation_context,),
+        )
+        # Retries are handled by async_chat_completion so they go through the limiter
+        self.client = AsyncOpenAI(api_key=args.key, max_retries=0)
+        self.limiter = RateLimiter(args.rpm, args.tpm)
+
+        stats = [
+            StageStats("extract", args.extract_workers),
+            StageStats("mcq", args.mcq_workers),
+            StageStats("validate", args.validate_workers),
+            StageStats("export", 1),
+        ]
+        pdf_queue = asyncio.Queue()
+        for pdf_file in pdf_files:
+            pdf_queue.put_nowait(pdf_file)
+        for _ in range(args.extract_workers):
+            pdf_queue.put_nowait(STOP)
+        queues = [pdf_queue] + [asyncio.Queue(maxsize=args.queue_size) for _ in range(3)]
+
+        self.writers = {
+            "dataset": JsonArrayWriter(self.output_dir / "dataset.json"),
+            "tasks": JsonArrayWriter(self.output_dir / "dataset_label_studio.json"),
+            "rejected": open(self.output_dir / "rejected.ndjson", "w", encoding="utf-8"),
+        }
+        start = time.perf_counter()
+        complete = False
+        tasks = [
+            asyncio.create_task(run_stage(stats[0], self.extract, queues[0], queues[1], stats[1].workers)),
+            asyncio.create_task(run_stage(stats[1], self.generate, queues[1], queues[2], stats[2].workers)),
+            asyncio.create_task(run_stage(stats[2], self.validate, queues[2], queues[3], stats[3].workers)),
+            asyncio.create_task(run_stage(stats[3], self.export, queues[3], None, 0)),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+            complete = True
+        finally:
+            # When a stage fails the others are still running, they have to stop before the writers close
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.writers["dataset"].close(complete)
+            self.writers["tasks"].close(complete)
+            self.writers["rejected"].close()
+            self.validation_pool.shutdown(cancel_futures=True)
+            await self.client.close()
+            if self.cache is not None:
+                self.cache.evict()
+                self.cache.close()
+
+            # Also written when the run fails, with what the stages got done until then
+            summary = {
+                "status": "ok" if complete else "failed",
+                "seconds": round(time.perf_counter() - start, 3),
+                "pdfs": len(pdf_files),
+                "entries": self.writers["dataset"].count,
+                "rejected": self.rejected,
+                "failed": self.failures,
+                "stages": [stage.summary() for stage in stats],
+            }
+            with open(self.output_dir / "run_summary.json", "w", encoding="utf-8") as file:
+                json.dump(summary, file, indent=2)
+            print_summary(summary)
+        return summary
+
+
+def print_summary(summary):
+    print("Pipeline {} in {:.1f}s: {} PDFs, {} entries, {} rejected".format(
+        "finished" if summary["status"] == "ok" else "failed",
+        summary["seconds"], summary["pdfs"], summary["entries"], summary["rejected"],
+    ))
+    for key, error in sorted(summary["failed"].items()):
+        print(f"failed {key}: {error}")
+    print(f"{'Stage':10} {'Workers':>7} {'In':>7} {'Out':>7} {'Items/s':>9} {'Working s':>10} {'Waiting s':>10} "
+          f"{'Blocked s':>10} {'Backlog':>8}")
+    for stage in summary["stages"]:
+        print(f"{stage['stage']:10} {stage['workers']:7} {stage['items_in']:7} {stage['items_out']:7} "
+              f"{stage['rate']:9.2f} {stage['working_seconds']:10.1f} {stage['waiting_seconds']:10.1f} "
+              f"{stage['blocked_seconds']:10.1f} {stage['max_backlog']:8}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Streaming PDF -> MCQ -> validation -> Label Studio pipeline")
+    parser.add_argument("--pdf_path", type=str, nargs="+", required=True, help="PDF files, or directories of PDFs")
+    parser.add_argument("--output_dir", type=str, required=True, help="Directory to store results")
+    parser.add_argument("-k", "--key", type=str, default=os.environ.get("OPENAI_API_KEY"), help="OpenAI API key")
+    parser.add_argument("--extract_workers", type=int, default=2, help="PDFs extracted at the same time")
+    parser.add_argument("--mcq_workers", type=int, default=8, help="Pages sent to the model at the same time")
+    parser.add_argument("--validate_workers", type=int, default=1, help="Processes validating the MCQs")
+    parser.add_argument("--queue_size", type=int, default=32, help="Items held between two stages")
+    parser.add_argument("--rpm", type=int, default=REQUESTS_PER_MINUTE, help="Requests per minute limit")
+    parser.add_argument("--tpm", type=int, default=TOKENS_PER_MINUTE, help="Tokens per minute limit")
+    parser.add_argument("--cache_path", type=str, default=None, help="SQLite file caching model responses")
+    parser.add_argument("--cache_mode", type=str, choices=CACHE_MODES, default="readwrite")
+    parser.add_argument("--cluster_margin", type=int, default=50, help="Marging for the clustering algorithm")
+    parser.add_argument(
+        "--layout_backend",
+        type=str,
+        choices=["pdfminer", "pymupdf"],
+        default="pdfminer",
+        help="Library used for the text/figure layout (pymupdf parses the PDF only once)",
+    )
+    add_image_args(parser)
+    add_table_args(parser)
+    add_span_args(parser)
+    return parser.parse_args()
+
+
+def list_pdf_files(paths):
+    pdf_files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            pdf_files.extend(sorted(path.glob("*.pdf")))
+        else:
+            pdf_files.append(path)
+    # The same PDF given twice would be written to the same output
+    return list(dict.fromkeys(pdf_files))
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    asyncio.run(Pipeline(args).run(list_pdf_files(args.pdf_path)))
@@ -0,0 +1,8 @@
+import sys
+from pathlib import Path
+
+# The scripts import their siblings as top-level modules
+REPO_DIR = Path(__file__).resolve().parent.parent
+for directory in ["base", "validator", "label_studio"]:
+    if str(REPO_DIR / directory) not in sys.path:
+        sys.path.insert(0, str(REPO_DIR / directory))
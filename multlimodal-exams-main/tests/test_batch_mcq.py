@@ -0,0 +1,110 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+import batch_mcq
+from text2mcq import span_filter_options
+
+
+LONG_PAGE = " ".join(f"{number}. Question {number}? A) a B) b C) c" + " filler" * 200 for number in range(1, 8))
+ANSWER = "Question?\n1. a\n2. b\n3. c\n4. d"
+
+
+def write_parsed(dir_path, f, texts):
+    os.makedirs(dir_path / "parsed", exist_ok=True)
+    os.makedirs(dir_path / "mcq", exist_ok=True)
+    pd.DataFrame({"page_num": range(1, len(texts) + 1), "parsed_text": texts}).to_csv(dir_path / "parsed" / f, index=False)
+
+
+def write_results(results_dir, custom_ids, failed=()):
+    os.makedirs(results_dir, exist_ok=True)
+    with open(results_dir / "results.jsonl", "w", encoding="utf-8") as file:
+        for custom_id in custom_ids:
+            if custom_id in failed:
+                result = {"custom_id": custom_id, "error": {"message": "failed"}}
+            else:
+                body = {"choices": [{"message": {"content": ANSWER}}]}
+                result = {"custom_id": custom_id, "response": {"status_code": 200, "body": body}}
+            file.write(json.dumps(result) + "\n")
+
+
+def issued_ids(shard_paths):
+    custom_ids = []
+    for path in shard_paths:
+        with open(path, "r", encoding="utf-8") as file:
+            custom_ids.extend(json.loads(line)["custom_id"] for line in file)
+    return custom_ids
+
+
+@pytest.fixture
+def prepared(tmp_path):
+    write_parsed(tmp_path, "x.csv", [LONG_PAGE, "no questions here", "1. Q? A) x B) y"])
+    shard_paths = batch_mcq.prepare(str(tmp_path), str(tmp_path / "batches"), span_filter=span_filter_options())
+    return tmp_path, issued_ids(shard_paths)
+
+
+def test_prepare_records_the_chunks_of_every_page(prepared):
+    dir_path, custom_ids = prepared
+    assert custom_ids == ["x.csv::page-1", "x.csv::page-1::chunk-1", "x.csv::page-3"]
+    assert batch_mcq.load_manifest(str(dir_path / "batches")) == {"x.csv": {"1": 2, "3": 1}}
+
+
+def test_ingest_with_every_result(prepared):
+    dir_path, custom_ids = prepared
+    write_results(dir_path / "results", custom_ids)
+
+    failures, missing = batch_mcq.ingest(str(dir_path), str(dir_path / "results"), str(dir_path / "batches"))
+
+    assert (failures, missing) == ({}, [])
+    output = pd.read_csv(dir_path / "mcq" / "x.csv")
+    # Both chunks of page 1 are joined into one response
+    assert output["page_num"].tolist() == [1, 1, 3]
+
+
+def test_missing_trailing_chunk_and_missing_page_are_reported(prepared):
+    dir_path, _ = prepared
+    write_results(dir_path / "results", ["x.csv::page-1"])
+
+    failures, missing = batch_mcq.ingest(str(dir_path), str(dir_path / "results"), str(dir_path / "batches"))
+
+    assert failures == {}
+    assert missing == ["x.csv::page-1::chunk-1", "x.csv::page-3"]
+    # Page 1 lacks a chunk, so no page has rows yet
+    assert (dir_path / "mcq" / "x.csv").read_text(encoding="utf-8").strip() == ""
+
+
+def test_failed_requests_are_not_counted_as_missing(prepared):
+    dir_path, custom_ids = prepared
+    write_results(dir_path / "results", custom_ids, failed={"x.csv::page-3"})
+
+    failures, missing = batch_mcq.ingest(str(dir_path), str(dir_path / "results"), str(dir_path / "batches"))
+
+    assert list(failures) == ["x.csv::page-3"]
+    assert missing == []
+    assert pd.read_csv(dir_path / "mcq" / "x.csv")["page_num"].tolist() == [1, 1]
+
+
+def test_file_without_any_result_keeps_its_output(prepared):
+    dir_path, _ = prepared
+    (dir_path / "mcq" / "x.csv").write_text("previous output\n", encoding="utf-8")
+    write_results(dir_path / "results", [])
+
+    _, missing = batch_mcq.ingest(str(dir_path), str(dir_path / "results"), str(dir_path / "batches"))
+
+    assert len(missing) == 3
+    assert (dir_path / "mcq" / "x.csv").read_text(encoding="utf-8") == "previous output\n"
+
+
+def test_ingest_needs_the_manifest(tmp_path):
+    write_parsed(tmp_path, "x.csv", ["1. Q? A) x B) y"])
+    write_results(tmp_path / "results", [])
+    with pytest.raises(FileNotFoundError):
+        batch_mcq.ingest(str(tmp_path), str(tmp_path / "results"), str(tmp_path / "batches"))
+
+
+def test_full_pages_by_default(tmp_path):
+    write_parsed(tmp_path, "x.csv", ["no questions here", "1. Q? A) x B) y"])
+    shard_paths = batch_mcq.prepare(str(tmp_path), str(tmp_path / "batches"))
+    assert issued_ids(shard_paths) == ["x.csv::page-1", "x.csv::page-2"]
@@ -0,0 +1,99 @@
+import json
+import sqlite3
+
+import pytest
+
+from check_dataset import DatasetValidator, iter_json_array
+
+
+def make_entry(index, **fields):
+    entry = {
+        "language": "en",
+        "country": "US",
+        "file_name": "exam.pdf",
+        "source": "https://example.org/exam.pdf",
+        "license": "CC BY 4.0",
+        "level": "University",
+        "category_en": "Math",
+        "category_original_lang": "Math",
+        "original_question_num": index,
+        "question": f"Question {index} ünïcode?",
+        "options": ["a", "b", "c"],
+        "answer": 0,
+        "image_png": None,
+        "image_information": None,
+        "image_type": None,
+        "parallel_question_id": None,
+    }
+    entry.update(fields)
+    return entry
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    (tmp_path / "images").mkdir()
+    (tmp_path / "images" / "figure.png").write_bytes(b"png")
+    entries = [make_entry(index) for index in range(2500)]
+    entries += [
+        make_entry(1),
+        make_entry(9000, options=["only one"]),
+        make_entry(9001, image_png="missing.png", image_information="essential", image_type="graph"),
+        make_entry(9002, image_png="figure.png", image_information="essential", image_type="graph"),
+        make_entry(9003, language=" "),
+    ]
+    json_file = tmp_path / "exam.json"
+    json_file.write_text(json.dumps(entries, ensure_ascii=False, indent=2), encoding="utf-8")
+    return json_file
+
+
+def validation_errors(json_file, **options):
+    validator = DatasetValidator(str(json_file), "en", **options)
+    if not validator.streaming:
+        assert validator._load_json()
+    validator._validate_entries()
+    if validator.streaming:
+        # The report reads the erroneous entries back from their offsets
+        assert all(validator._get_entry(error.index) is not None for error in validator.errors)
+    return [(error.index, str(error)) for error in validator.errors]
+
+
+def test_iter_json_array_matches_json_load(dataset):
+    items = list(iter_json_array(str(dataset), read_size=256))
+    assert [value for _, _, value in items] == json.loads(dataset.read_text(encoding="utf-8"))
+
+    raw = dataset.read_bytes()
+    for offset, length, value in items[:5] + items[-5:]:
+        assert json.loads(raw[offset:offset + length].decode("utf-8")) == value
+
+
+@pytest.mark.parametrize("options", [
+    {"streaming": True},
+    {"streaming": True, "workers": 2},
+    {"streaming": True, "use_cache": True},
+    {"use_cache": True, "workers": 2},
+])
+def test_streaming_and_cached_runs_match_the_in_memory_run(dataset, options):
+    expected = validation_errors(dataset)
+    assert {index for index, _ in expected} == {2500, 2501, 2502, 2504}
+
+    assert validation_errors(dataset, **options) == expected
+    if options.get("use_cache"):
+        # A second run reuses the cached results
+        assert validation_errors(dataset, **options) == expected
+
+
+def test_cache_drops_removed_entries(dataset):
+    validation_errors(dataset, streaming=True, use_cache=True)
+    entries = json.loads(dataset.read_text(encoding="utf-8"))[:10]
+    dataset.write_text(json.dumps(entries), encoding="utf-8")
+    assert validation_errors(dataset, streaming=True, use_cache=True) == []
+
+    with sqlite3.connect(f"{dataset}.validation_cache.sqlite") as connection:
+        assert connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0] == 10
+
+
+def test_unclosed_array_is_an_error(tmp_path):
+    json_file = tmp_path / "broken.json"
+    json_file.write_text('[{"a": 1}, {"b": 2}', encoding="utf-8")
+    with pytest.raises(ValueError):
+        list(iter_json_array(str(json_file)))
@@ -0,0 +1,59 @@
+from question_spans import chunk_spans, detect_spans, estimate_text_tokens
+
+
+def test_numbered_questions_keep_the_consecutive_sequence():
+    text = (
+        "Exam 2024, 100 points.\n"
+        "1. What is 2+2? A) 3 B) 4\n"
+        "2. Which is a prime? A) 4 B) 7\n"
+        "3. Pick the even number. A) 2 B) 3"
+    )
+    spans = detect_spans(text)
+    assert [span.split(".")[0] for span in spans] == ["1", "2", "3"]
+    assert spans[0].endswith("B) 4")
+
+
+def test_numbered_span_without_options_is_dropped():
+    text = "1. What is 2+2? A) 3 B) 4\n2. Explain your answer.\n3. Pick one. A) x B) y"
+    assert detect_spans(text) == ["1. What is 2+2? A) 3 B) 4", "3. Pick one. A) x B) y"]
+
+
+def test_question_word_span_without_options_is_dropped():
+    text = "Question 1 What is x?\nQuestion 2 Which is y? A) a B) b"
+    assert detect_spans(text, ["Question"]) == ["Question 2 Which is y? A) a B) b"]
+
+
+def test_question_words_count_numbered_options():
+    text = "Question 1 What? 1. a 2. b\nQuestion 2 Why? A) x B) y"
+    assert detect_spans(text, ["Question"]) == ["Question 1 What? 1. a 2. b", "Question 2 Why? A) x B) y"]
+
+
+def test_numbered_instructions_before_the_first_question_are_dropped():
+    text = "Read carefully:\n1. Use a pen\n2. No phones\nQuestion 1 What? A) a B) b"
+    assert detect_spans(text, ["Question"]) == ["Question 1 What? A) a B) b"]
+
+
+def test_question_continued_from_the_previous_page_is_kept():
+    text = "B) rest C) more\n1. What? A) a B) b\n2. Who? no options"
+    assert detect_spans(text) == ["B) rest C) more", "1. What? A) a B) b"]
+
+
+def test_blank_page_has_no_span():
+    assert detect_spans("") == []
+    assert detect_spans(float("nan")) == []
+
+
+def test_chunks_respect_the_token_budget():
+    spans = ["a" * 400, "b" * 400, "c" * 400]
+    assert chunk_spans(spans, token_budget=200) == ["a" * 400 + "\n\n" + "b" * 400, "c" * 400]
+
+
+def test_span_over_the_budget_gets_a_chunk_of_its_own():
+    spans = ["a" * 40, "b" * 4000, "c" * 40]
+    assert chunk_spans(spans, token_budget=100) == ["a" * 40, "b" * 4000, "c" * 40]
+
+
+def test_non_latin_text_is_not_underestimated():
+    assert estimate_text_tokens("abcd" * 10) == 10
+    assert estimate_text_tokens("Вопрос") == 6
+    assert estimate_text_tokens("问题 12") == 2
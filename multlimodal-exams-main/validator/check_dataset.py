@@ -2,9 +2,14 @@
 
 import os
 import json
+import codecs
+import sqlite3
+import hashlib
 import argparse
 
-from typing import Union, Literal, Optional
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Union, Literal, Optional
 
 from pydantic import BaseModel, ValidationError, field_validator, model_validator
 from pydantic_core.core_schema import ValidationInfo
@@ -16,6 +21,11 @@ from rich.tree import Tree
 
 
 MIN_OPTIONS_COUNT = 2
+STREAM_CHUNK_SIZE = 1000
+# Hashes looked up per query, below SQLite's limit on query parameters
+CACHE_LOOKUP_SIZE = 500
+# Bump whenever EntrySchema changes, so cached validation results are not reused
+SCHEMA_VERSION = "1"
 
 
 class EntrySchema(BaseModel):
@@ -49,11 +59,17 @@ class EntrySchema(BaseModel):
     @staticmethod
     def _validate_image(image_name: str, config: ValidationInfo) -> None:
         images_path = config.context.get("images_path")
+        image_files = config.context.get("image_files")
 
         if os.path.basename(image_name) != image_name:
             raise ValueError(f"The image name '{image_name}' must not include directories")
 
-        if not os.path.isfile(os.path.join(images_path, image_name)):
+        if image_files is not None:
+            image_exists = image_name in image_files
+        else:
+            image_exists = os.path.isfile(os.path.join(images_path, image_name))
+
+        if not image_exists:
             raise ValueError(f"The specified image '{image_name}' does not exist in {images_path}")
 
     @field_validator("language")
@@ -147,12 +163,223 @@ class EntryError:
         return message
 
 
+def list_image_files(images_path: str) -> set[str]:
+    try:
+        with os.scandir(images_path) as entries:
+            return {entry.name for entry in entries if entry.is_file()}
+    except FileNotFoundError:
+        return set()
+
+
+def list_image_mtimes(images_path: str) -> dict[str, int]:
+    try:
+        with os.scandir(images_path) as entries:
+            return {entry.name: entry.stat().st_mtime_ns for entry in entries if entry.is_file()}
+    except FileNotFoundError:
+        return {}
+
+
+def entry_content_hash(entry: object) -> str:
+    return hashlib.blake2b(json.dumps(entry, sort_keys=True).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def referenced_images(entry: object) -> list[str]:
+    if not isinstance(entry, dict):
+        return []
+
+    images = [entry["image_png"]] if isinstance(entry.get("image_png"), str) else []
+    if isinstance(entry.get("options"), list):
+        images.extend(option for option in entry["options"] if isinstance(option, str) and option.lower().endswith(".png"))
+
+    return images
+
+
+def iter_json_array(json_file: str, read_size: int = 1 << 20) -> Iterator[tuple[int, int, object]]:
+    """Yields (byte offset, byte length, value) for every item of a top-level JSON array."""
+    decoder = json.JSONDecoder()
+    utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+
+    with open(json_file, "rb") as file:
+        buffer, position, eof = "", 0, False
+        # Byte offset of buffer[mark], advanced as items are consumed so offsets cost O(file size)
+        mark, mark_offset = 0, 0
+        started = False
+
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+
+            need_data = position >= len(buffer)
+            if not need_data and not started:
+                if buffer[position] != "[":
+                    raise ValueError("The file must contain a JSON array (list of entries)")
+                started = True
+                position += 1
+                continue
+
+            if not need_data:
+                if buffer[position] == "]":
+                    return
+
+                try:
+                    value, end = decoder.raw_decode(buffer, position)
+                    # A value running up to the end of the buffer may continue in the next read
+                    need_data = end == len(buffer) and not eof
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    need_data = True
+
+            if need_data:
+                if eof:
+                    raise ValueError("Unexpected end of file, the JSON array is not closed")
+                if position > read_size:
+                    mark_offset += len(buffer[mark:position].encode("utf-8"))
+                    buffer, mark, position = buffer[position:], 0, 0
+                chunk = file.read(read_size)
+                eof = not chunk
+                buffer += utf8_decoder.decode(chunk, final=eof)
+                continue
+
+            offset = mark_offset + len(buffer[mark:position].encode("utf-8"))
+            length = len(buffer[position:end].encode("utf-8"))
+            mark, mark_offset = end, offset + length
+            position = end
+            yield offset, length, value
+
+
+def read_json_at(json_file: str, offset: int, length: int) -> object:
+    with open(json_file, "rb") as file:
+        file.seek(offset)
+        return json.loads(file.read(length).decode("utf-8"))
+
+
+class ValidationCache:
+    """Validation results of the entries, in a SQLite file so only the looked up rows are in memory."""
+
+    def __init__(self, path: str, language_code: str) -> None:
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                hash TEXT,
+                errors TEXT,
+                images TEXT,
+                run INTEGER
+            )"""
+        )
+        meta = dict(self.connection.execute("SELECT key, value FROM meta").fetchall())
+        if meta.get("schema_version") != SCHEMA_VERSION or meta.get("language_code") != language_code:
+            self.connection.execute("DELETE FROM entries")
+            meta = {"schema_version": SCHEMA_VERSION, "language_code": language_code, "run": "0"}
+        # Rows not written by this run belong to entries that were removed, they are dropped at the end
+        self.run = int(meta.get("run", "0")) + 1
+        meta["run"] = str(self.run)
+        self.connection.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", meta.items())
+        self.connection.commit()
+
+    def lookup(self, entries: list[dict]) -> dict[str, dict]:
+        keys = list({entry_content_hash(entry) for entry in entries})
+        cached = {}
+        for start in range(0, len(keys), CACHE_LOOKUP_SIZE):
+            batch = keys[start:start + CACHE_LOOKUP_SIZE]
+            rows = self.connection.execute(
+                f"SELECT key, hash, errors, images FROM entries WHERE key IN ({','.join('?' * len(batch))})", batch
+            )
+            for key, entry_hash, errors, images in rows:
+                cached[key] = {"hash": entry_hash, "errors": json.loads(errors), "images": json.loads(images)}
+        return cached
+
+    def store(self, results: list[tuple[Optional[bytes], list[tuple], tuple]]) -> None:
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    cache_key[0],
+                    entry_hash.hex() if entry_hash is not None else None,
+                    json.dumps(entry_errors),
+                    json.dumps(cache_key[1]),
+                    self.run,
+                )
+                for entry_hash, entry_errors, cache_key in results
+            ],
+        )
+        self.connection.commit()
+
+    def prune(self) -> None:
+        self.connection.execute("DELETE FROM entries WHERE run != ?", (self.run,))
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def validate_chunk(
+    entries: list[dict], context: dict, cache: Optional[dict[str, dict]] = None
+) -> list[tuple[Optional[bytes], list[tuple], Optional[tuple]]]:
+    """Validates the entries, reusing the results in `cache` (cached rows of these entries by content hash)."""
+    results = []
+
+    for entry in entries:
+        cache_key = None
+
+        if cache is not None:
+            # Reuse the previous result if neither the entry nor the images it references changed
+            image_mtimes = context["image_mtimes"]
+            cache_key = (
+                entry_content_hash(entry),
+                {image: image_mtimes.get(image) for image in referenced_images(entry)},
+            )
+            cached = cache.get(cache_key[0])
+
+            if cached is not None and cached["images"] == cache_key[1]:
+                entry_hash = bytes.fromhex(cached["hash"]) if cached["hash"] is not None else None
+                entry_errors = [(message, tuple(location) if location is not None else None) for message, location in cached["errors"]]
+                results.append((entry_hash, entry_errors, cache_key))
+                continue
+
+        try:
+            entry_model = EntrySchema.model_validate(entry, context=context)
+            entry_key = (entry_model.question, entry_model.image_png, tuple(opt for opt in entry_model.options))
+            # A fixed-size digest keeps the duplicate index small on huge files
+            entry_hash = hashlib.blake2b(json.dumps(entry_key).encode("utf-8"), digest_size=16).digest()
+            results.append((entry_hash, [], cache_key))
+        except ValidationError as e:
+            results.append((None, [(error.get("msg"), error.get("loc", None)) for error in e.errors()], cache_key))
+
+    return results
+
+
+_worker_context: Optional[dict] = None
+
+
+def _init_worker(context: dict) -> None:
+    # The context (with the image index) is sent once per worker instead of once per chunk
+    global _worker_context
+    _worker_context = context
+
+
+def _validate_worker_chunk(
+    entries: list[dict], cache: Optional[dict[str, dict]] = None
+) -> list[tuple[Optional[bytes], list[tuple], Optional[tuple]]]:
+    return validate_chunk(entries, _worker_context, cache)
+
+
 class DatasetValidator:
-    def __init__(self, json_file: str, language_code: str) -> None:
+    def __init__(
+        self, json_file: str, language_code: str, workers: int = 1, streaming: bool = False, use_cache: bool = False
+    ) -> None:
         self.json_file: str = json_file
         self.json_entries: list[dict] = []
         self.language_code: str = language_code.lower()
         self.images_path: str = os.path.join(os.path.dirname(json_file), "images")
+        self.workers: int = workers
+        self.streaming: bool = streaming
+        self.cache_file: Optional[str] = f"{json_file}.validation_cache.sqlite" if use_cache else None
+        self.cache: Optional[ValidationCache] = None
+        self.entry_offsets: dict[int, tuple[int, int]] = {}
         self.console: Console = Console()
         self.errors: list[EntryError] = []
 
@@ -162,10 +389,18 @@ class DatasetValidator:
         self.console.print(f"Images path: {self.images_path}", style="cyan")
         self.console.print(f"Language code: {self.language_code}", style="cyan")
 
-        if not self._load_json():
-            return
+        if self.streaming:
+            try:
+                self._validate_entries()
+            except ValueError as e:
+                self.console.print(f"Error loading file {self.json_file}: {e}", style="red")
+                return
+        else:
+            if not self._load_json():
+                return
+
+            self._validate_entries()
 
-        self._validate_entries()
         self._print_validation_report()
 
     def _load_json(self) -> bool:
@@ -182,26 +417,94 @@ class DatasetValidator:
             self.console.print(f"Error loading file {self.json_file}: {e}", style="red")
             return False
 
+    def _chunk_entries(self) -> Iterator[tuple[list, Optional[list[tuple[int, int]]]]]:
+        if self.streaming:
+            # Only one chunk of entries (and their offsets) is held at a time
+            entries, offsets = [], []
+            for offset, length, entry in iter_json_array(self.json_file):
+                entries.append(entry)
+                offsets.append((offset, length))
+                if len(entries) == STREAM_CHUNK_SIZE:
+                    yield entries, offsets
+                    entries, offsets = [], []
+            if entries:
+                yield entries, offsets
+            return
+
+        chunk_size = max(1, -(-len(self.json_entries) // (self.workers * 4)))
+        for start in range(0, len(self.json_entries), chunk_size):
+            yield self.json_entries[start:start + chunk_size], None
+
+    def _validate_chunks(self, context: dict) -> Iterator[tuple[list, Optional[list[tuple[int, int]]]]]:
+        # The cached results are looked up one chunk at a time, so the cache is never loaded whole
+        if self.workers <= 1:
+            for entries, offsets in self._chunk_entries():
+                cache = self.cache.lookup(entries) if self.cache is not None else None
+                yield validate_chunk(entries, context, cache), offsets
+            return
+
+        with ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(context,)) as executor:
+            # Bounded number of chunks in flight, results are consumed in submission order
+            pending = deque()
+            for entries, offsets in self._chunk_entries():
+                cache = self.cache.lookup(entries) if self.cache is not None else None
+                pending.append((executor.submit(_validate_worker_chunk, entries, cache), offsets))
+                if len(pending) >= self.workers * 2:
+                    future, chunk_offsets = pending.popleft()
+                    yield future.result(), chunk_offsets
+
+            while pending:
+                future, chunk_offsets = pending.popleft()
+                yield future.result(), chunk_offsets
+
     def _validate_entries(self) -> None:
-        seen_entries = {}
+        context = {
+            "dataset_language": self.language_code,
+            "images_path": self.images_path,
+            "image_files": list_image_files(self.images_path),
+        }
 
-        for index, entry in enumerate(self.json_entries):
-            try:
-                entry_model = EntrySchema.model_validate(entry, context={
-                    "dataset_language": self.language_code,
-                    "images_path": self.images_path,
-                })
+        if self.cache_file is not None:
+            self.cache = ValidationCache(self.cache_file, self.language_code)
+            context["image_mtimes"] = list_image_mtimes(self.images_path)
+
+        try:
+            self._merge_results(context)
+            if self.cache is not None:
+                # Only entries of the current file are kept, so removed entries don't pile up
+                self.cache.prune()
+        finally:
+            if self.cache is not None:
+                self.cache.close()
+                self.cache = None
+
+    def _merge_results(self, context: dict) -> None:
+        # Duplicates are checked after the chunks are merged, so they are found across chunks
+        seen_entries = {}
+        index = 0
 
-                entry_hash = (entry_model.question, entry_model.image_png, tuple(opt for opt in entry_model.options))
+        for chunk_results, offsets in self._validate_chunks(context):
+            if self.cache is not None:
+                self.cache.store(chunk_results)
 
-                if entry_hash not in seen_entries:
+            for chunk_index, (entry_hash, entry_errors, cache_key) in enumerate(chunk_results):
+                if entry_errors:
+                    self.errors.extend([EntryError(index, message, location) for message, location in entry_errors])
+                elif entry_hash not in seen_entries:
                     seen_entries[entry_hash] = index
                 else:
                     self.errors.append(EntryError(index, f"Duplicate of entry with index {seen_entries[entry_hash]}"))
-            except ValidationError as e:
-                self.errors.extend([
-                    EntryError(index, error.get("msg"), error.get("loc", None)) for error in e.errors()
-                ])
+
+                if offsets is not None and (entry_errors or seen_entries[entry_hash] != index):
+                    self.entry_offsets[index] = offsets[chunk_index]
+
+                index += 1
+
+    def _get_entry(self, index: int) -> dict:
+        if self.streaming:
+            return read_json_at(self.json_file, *self.entry_offsets[index])
+
+        return self.json_entries[index]
 
     def _print_validation_report(self) -> None:
         if len(self.errors) == 0:
@@ -213,7 +516,7 @@ class DatasetValidator:
             self.console.print(Panel(self._create_error_tree(error), expand=False, border_style="red"))
 
     def _create_error_tree(self, error: EntryError) -> Tree:
-        entry = self.json_entries[error.index]
+        entry = self._get_entry(error.index)
 
         tree = Tree(f"Error in entry with index {error.index}", style="red")
         tree.add(Text(str(error), style="yellow"))
@@ -235,7 +538,10 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("--json_file", type=str, required=True, help="Path to the JSON file to be validated")
     parser.add_argument("--language_code", type=str, required=True, help="The language code for the dataset")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes used to validate entries")
+    parser.add_argument("--streaming", action="store_true", help="Validate entries as they are read, for files too large for memory")
+    parser.add_argument("--cache", action="store_true", help="Only re-validate entries that changed since the last cached run")
     args = parser.parse_args()
 
-    validator = DatasetValidator(args.json_file, args.language_code)
+    validator = DatasetValidator(args.json_file, args.language_code, args.workers, args.streaming, args.cache)
     validator.validate()
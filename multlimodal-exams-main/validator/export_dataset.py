@@ -0,0 +1,262 @@
+import os
+import json
+import shutil
+import argparse
+
+from collections import Counter
+from typing import Iterator, Optional
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as fs
+import pyarrow.parquet as pq
+from rich.console import Console
+
+from check_dataset import list_image_files, validate_chunk
+from find_near_duplicates import iter_dataset_files
+
+
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+IMAGE_COLUMNS = ["image_png_bytes", "option_images"]
+# Low-cardinality columns are dictionary encoded and used to prune row groups
+DICTIONARY_COLUMNS = [
+    "language", "country", "source", "license", "level", "category_en", "category_original_lang",
+    "image_information", "image_type",
+]
+
+# Fields copied from the dataset entries, the other columns of SCHEMA are computed by to_row
+SOURCE_FIELDS = (
+    "language", "country", "file_name", "source", "license", "level", "category_en", "category_original_lang",
+    "original_question_num", "question", "options", "answer", "image_png", "image_information", "image_type",
+    "parallel_question_id",
+)
+
+SCHEMA = pa.schema([
+    ("language", pa.string()),
+    ("country", pa.string()),
+    ("file_name", pa.string()),
+    ("source", pa.string()),
+    ("license", pa.string()),
+    ("level", pa.string()),
+    ("category_en", pa.string()),
+    ("category_original_lang", pa.string()),
+    ("original_question_num", pa.string()),
+    ("question", pa.string()),
+    ("options", pa.list_(pa.string())),
+    ("answer", pa.int32()),
+    ("image_png", pa.string()),
+    ("image_information", pa.string()),
+    ("image_type", pa.string()),
+    ("parallel_question_id", pa.struct([("file_name", pa.string()), ("question_num", pa.int64())])),
+    ("image_png_bytes", pa.binary()),
+    # One item per option, null for text options
+    ("option_images", pa.list_(pa.binary())),
+    ("dataset_file", pa.string()),
+    ("entry_index", pa.int64()),
+])
+
+
+def read_image(images_path: str, image_name: str) -> bytes:
+    with open(os.path.join(images_path, image_name), "rb") as file:
+        return file.read()
+
+
+def to_row(entry: dict, images_path: str, dataset_file: str, entry_index: int) -> dict:
+    image_png = entry.get("image_png")
+    parallel_question_id = entry.get("parallel_question_id")
+
+    row = {name: entry.get(name) for name in SOURCE_FIELDS}
+    row["original_question_num"] = str(entry["original_question_num"])
+    row["parallel_question_id"] = (
+        {"file_name": parallel_question_id[0], "question_num": parallel_question_id[1]}
+        if parallel_question_id is not None else None
+    )
+    row["image_png_bytes"] = read_image(images_path, image_png) if image_png else None
+    row["option_images"] = [
+        read_image(images_path, option) if option.lower().endswith(".png") else None for option in entry["options"]
+    ]
+    row["dataset_file"] = dataset_file
+    row["entry_index"] = entry_index
+    return row
+
+
+def row_size(row: dict) -> int:
+    images = [row["image_png_bytes"]] + row["option_images"]
+    return sum(len(image) for image in images if image) + len(row["question"]) + 512
+
+
+class ShardWriter:
+    """Writes the rows of one language partition as size-capped shards, one row group per flushed batch."""
+
+    def __init__(self, partition_dir: str, output_format: str, row_group_mb: float, shard_mb: float) -> None:
+        self.partition_dir = partition_dir
+        self.output_format = output_format
+        self.row_group_bytes = int(row_group_mb * 1024 * 1024)
+        self.shard_bytes = int(shard_mb * 1024 * 1024)
+        self.rows: list[dict] = []
+        self.buffered_bytes = 0
+        self.shard_count = 0
+        self.shard_written = 0
+        self.writer = None
+        self.total_rows = 0
+
+    def add(self, row: dict) -> None:
+        self.rows.append(row)
+        self.buffered_bytes += row_size(row)
+        if self.buffered_bytes >= self.row_group_bytes:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.rows:
+            return
+
+        if self.writer is not None and self.shard_written + self.buffered_bytes > self.shard_bytes:
+            self._close_shard()
+        if self.writer is None:
+            self._open_shard()
+
+        table = pa.Table.from_pylist(self.rows, schema=SCHEMA)
+        if self.output_format == "parquet":
+            self.writer.write_table(table, row_group_size=len(self.rows))
+        else:
+            self.writer.write_table(table, max_chunksize=len(self.rows))
+
+        self.shard_written += self.buffered_bytes
+        self.total_rows += len(self.rows)
+        self.rows, self.buffered_bytes = [], 0
+
+    def close(self) -> None:
+        self.flush()
+        self._close_shard()
+
+    def _open_shard(self) -> None:
+        os.makedirs(self.partition_dir, exist_ok=True)
+        path = os.path.join(self.partition_dir, f"part-{self.shard_count:05d}{FORMATS[self.output_format]}")
+
+        if self.output_format == "parquet":
+            # PNG bytes are already compressed, recompressing them only slows reads down
+            compression = {name: "zstd" for name in SCHEMA.names}
+            compression.update({name: "none" for name in IMAGE_COLUMNS})
+            self.writer = pq.ParquetWriter(
+                path, SCHEMA, compression=compression, use_dictionary=DICTIONARY_COLUMNS, write_page_index=True,
+            )
+        else:
+            # Uncompressed IPC files can be memory-mapped and read without copying
+            self.writer = pa.ipc.new_file(path, SCHEMA)
+
+        self.shard_count += 1
+        self.shard_written = 0
+
+    def _close_shard(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def dataset_language(entries: list) -> Optional[str]:
+    languages = Counter(entry.get("language") for entry in entries if isinstance(entry, dict))
+    return languages.most_common(1)[0][0] if languages else None
+
+
+class DatasetExporter:
+    def __init__(
+        self, output_dir: str, output_format: str = "parquet", language_code: Optional[str] = None,
+        row_group_mb: float = 32, shard_mb: float = 512,
+    ) -> None:
+        self.output_dir = output_dir
+        self.output_format = output_format
+        self.language_code = language_code.lower() if language_code else None
+        self.row_group_mb = row_group_mb
+        self.shard_mb = shard_mb
+        self.writers: dict[str, ShardWriter] = {}
+        self.console = Console()
+
+    def export(self, paths: list[str]) -> None:
+        for json_file in iter_dataset_files(paths):
+            try:
+                with open(json_file, "r", encoding="utf-8") as file:
+                    entries = json.load(file)
+                if not isinstance(entries, list):
+                    raise ValueError("The file must contain a JSON array (list of entries)")
+            except Exception as e:
+                self.console.print(f"Skipping {json_file}: {e}", style="red")
+                continue
+
+            exported, rejected = self._export_file(json_file, entries)
+            self.console.print(f"Exported {exported} entries from {json_file}, rejected {rejected}", style="cyan")
+
+        for writer in self.writers.values():
+            writer.close()
+
+        total = sum(writer.total_rows for writer in self.writers.values())
+        shards = sum(writer.shard_count for writer in self.writers.values())
+        self.console.print(f"Wrote {total} entries to {shards} shards in {self.output_dir}", style="green")
+
+    def _export_file(self, json_file: str, entries: list) -> tuple[int, int]:
+        images_path = os.path.join(os.path.dirname(json_file), "images")
+        context = {
+            "dataset_language": self.language_code or dataset_language(entries),
+            "images_path": images_path,
+            "image_files": list_image_files(images_path),
+        }
+
+        # Only entries that pass EntrySchema are exported, duplicates are kept once
+        seen_entries = set()
+        exported = 0
+        for entry_index, (entry, (entry_hash, entry_errors, _)) in enumerate(zip(entries, validate_chunk(entries, context))):
+            if entry_errors or entry_hash in seen_entries:
+                continue
+            seen_entries.add(entry_hash)
+
+            language = entry["language"]
+            if language not in self.writers:
+                partition_dir = os.path.join(self.output_dir, f"language={language}")
+                self.writers[language] = ShardWriter(partition_dir, self.output_format, self.row_group_mb, self.shard_mb)
+            self.writers[language].add(to_row(entry, images_path, json_file, entry_index))
+            exported += 1
+
+        return exported, len(entries) - exported
+
+
+def open_dataset(output_dir: str, output_format: str = "parquet") -> ds.Dataset:
+    # Shards are memory-mapped, only the row groups and columns a scan needs are read
+    filesystem = fs.LocalFileSystem(use_mmap=True)
+    file_format = "parquet" if output_format == "parquet" else "ipc"
+    return ds.dataset(output_dir, format=file_format, partitioning="hive", filesystem=filesystem)
+
+
+def iter_entries(
+    output_dir: str, output_format: str = "parquet", language: Optional[str] = None, category: Optional[str] = None,
+    columns: Optional[list[str]] = None, batch_size: int = 256,
+) -> Iterator[dict]:
+    """Lazily yields exported entries, optionally restricted to a language and/or category."""
+    dataset = open_dataset(output_dir, output_format)
+
+    expression = None
+    for name, value in [("language", language), ("category_en", category)]:
+        if value is not None:
+            condition = ds.field(name) == value
+            expression = condition if expression is None else expression & condition
+
+    for batch in dataset.to_batches(columns=columns, filter=expression, batch_size=batch_size):
+        yield from batch.to_pylist()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="+", help="Dataset JSON files or directories to export")
+    parser.add_argument("--output_dir", type=str, required=True, help="Directory where the shards are written")
+    parser.add_argument("--format", type=str, default="parquet", choices=list(FORMATS), help="Shard file format")
+    parser.add_argument("--language_code", type=str, default=None, help="Expected language, defaults to the most common one of each file")
+    parser.add_argument("--row_group_mb", type=float, default=32, help="Approximate size of a row group, the unit of random access")
+    parser.add_argument("--shard_mb", type=float, default=512, help="Approximate maximum size of a shard file")
+    parser.add_argument("--overwrite", action="store_true", help="Remove an existing output directory first")
+    args = parser.parse_args()
+
+    if os.path.exists(args.output_dir) and os.listdir(args.output_dir):
+        if not args.overwrite:
+            parser.error(f"{args.output_dir} is not empty, pass --overwrite to replace it")
+        shutil.rmtree(args.output_dir)
+
+    exporter = DatasetExporter(args.output_dir, args.format, args.language_code, args.row_group_mb, args.shard_mb)
+    exporter.export(args.paths)
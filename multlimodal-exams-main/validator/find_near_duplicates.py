@@ -0,0 +1,258 @@
+import os
+import re
+import json
+import hashlib
+import argparse
+import unicodedata
+
+from typing import Iterator, Optional
+
+import numpy as np
+from rich.console import Console
+from rich.table import Table
+
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+INDEX_VERSION = "1"
+
+NUMBERING_PATTERN = re.compile(r"^\s*(?:q(?:uestion)?\s*)?[\(\[]?(?:\d+|[a-z]|[ivx]+)[\)\]\.:-]\s+", re.IGNORECASE)
+PUNCTUATION_PATTERN = re.compile(r"[^\w\s]")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = NUMBERING_PATTERN.sub("", text)
+    text = PUNCTUATION_PATTERN.sub(" ", text)
+    return WHITESPACE_PATTERN.sub(" ", text).strip()
+
+
+def normalize_entry(entry: dict) -> str:
+    # Options are sorted so that reordered choices still match
+    options = sorted(normalize_text(str(option)) for option in entry.get("options") or [])
+    return " | ".join([normalize_text(str(entry.get("question", "")))] + options)
+
+
+def shingle_hashes(text: str, shingle_size: int) -> np.ndarray:
+    if len(text) < shingle_size:
+        shingles = {text}
+    else:
+        shingles = {text[i:i + shingle_size] for i in range(len(text) - shingle_size + 1)}
+
+    digests = b"".join(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest() for shingle in shingles)
+    return np.frombuffer(digests, dtype=np.uint32).astype(np.uint64)
+
+
+class MinHasher:
+    def __init__(self, num_perm: int, seed: int = 1) -> None:
+        # 32-bit coefficients keep a * hash + b within uint64 for 32-bit shingle hashes
+        generator = np.random.RandomState(seed)
+        self.a = generator.randint(1, MAX_HASH, size=num_perm, dtype=np.uint64)
+        self.b = generator.randint(0, MAX_HASH, size=num_perm, dtype=np.uint64)
+
+    def signature(self, hashes: np.ndarray) -> np.ndarray:
+        permuted = (hashes[:, None] * self.a[None, :] + self.b[None, :]) % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+
+def lsh_parameters(num_perm: int, threshold: float) -> tuple[int, int]:
+    # Pick the (bands, rows) split whose S-curve midpoint is closest to the threshold
+    candidates = [(bands, num_perm // bands) for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    return min(candidates, key=lambda params: abs((1 / params[0]) ** (1 / params[1]) - threshold))
+
+
+def iter_dataset_files(paths: list[str]) -> Iterator[str]:
+    for path in paths:
+        if os.path.isfile(path):
+            yield os.path.abspath(path)
+            continue
+
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            for file in sorted(files):
+                # Skip the normalized copies and sync manifests made by final_valid.py and validator sidecars
+                if file.endswith(".json") and not file.startswith(("valid__", ".")) and ".validation_cache" not in file:
+                    yield os.path.abspath(os.path.join(root, file))
+
+
+class NearDuplicateIndex:
+    """MinHash signatures of dataset entries, stored as one shard per dataset file so files can be added incrementally."""
+
+    def __init__(self, index_dir: str, num_perm: int = 128, shingle_size: int = 5) -> None:
+        self.index_dir = index_dir
+        self.manifest_file = os.path.join(index_dir, "manifest.json")
+        self.console = Console()
+        os.makedirs(index_dir, exist_ok=True)
+
+        self.manifest = {"version": INDEX_VERSION, "num_perm": num_perm, "shingle_size": shingle_size, "files": {}}
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file, "r", encoding="utf-8") as file:
+                manifest = json.load(file)
+            if (manifest["version"], manifest["num_perm"], manifest["shingle_size"]) == (INDEX_VERSION, num_perm, shingle_size):
+                self.manifest = manifest
+            else:
+                self.console.print("Index parameters changed, rebuilding the index", style="yellow")
+
+        self.hasher = MinHasher(num_perm)
+
+    def _remove_file(self, json_file: str) -> None:
+        shard = self.manifest["files"].pop(json_file)["shard"]
+        for extension in (".npy", ".json"):
+            try:
+                os.remove(os.path.join(self.index_dir, f"{shard}{extension}"))
+            except FileNotFoundError:
+                pass
+        self.console.print(f"Removed {json_file} from the index", style="cyan")
+
+    def add_files(self, paths: list[str]) -> None:
+        dataset_files = list(iter_dataset_files(paths))
+
+        # Files deleted, renamed or no longer found under the given directories leave the index, files
+        # indexed from other paths in earlier runs stay
+        current, directories = set(dataset_files), [os.path.abspath(path) for path in paths if os.path.isdir(path)]
+        for json_file in list(self.manifest["files"]):
+            under_directory = any(os.path.commonpath([directory, json_file]) == directory for directory in directories)
+            if json_file not in current and (not os.path.isfile(json_file) or under_directory):
+                self._remove_file(json_file)
+
+        for json_file in dataset_files:
+            stat = os.stat(json_file)
+            known = self.manifest["files"].get(json_file)
+            if known and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+                continue
+
+            try:
+                with open(json_file, "r", encoding="utf-8") as file:
+                    entries = json.load(file)
+                if not isinstance(entries, list):
+                    raise ValueError("The file must contain a JSON array (list of entries)")
+            except Exception as e:
+                self.console.print(f"Skipping {json_file}: {e}", style="red")
+                continue
+
+            shard = hashlib.blake2b(json_file.encode("utf-8"), digest_size=8).hexdigest()
+            signatures, records = [], []
+            for index, entry in enumerate(entries):
+                if not isinstance(entry, dict):
+                    continue
+                text = normalize_entry(entry)
+                signatures.append(self.hasher.signature(shingle_hashes(text, self.manifest["shingle_size"])))
+                records.append([index, str(entry.get("question", ""))[:200]])
+
+            signatures = np.array(signatures, dtype=np.uint32).reshape(-1, self.manifest["num_perm"])
+            np.save(os.path.join(self.index_dir, f"{shard}.npy"), signatures)
+            with open(os.path.join(self.index_dir, f"{shard}.json"), "w", encoding="utf-8") as file:
+                json.dump(records, file, ensure_ascii=False)
+
+            self.manifest["files"][json_file] = {
+                "size": stat.st_size, "mtime": stat.st_mtime, "shard": shard, "entries": len(records),
+            }
+            self.console.print(f"Indexed {len(records)} entries from {json_file}", style="cyan")
+
+        with open(self.manifest_file, "w", encoding="utf-8") as file:
+            json.dump(self.manifest, file, ensure_ascii=False, indent=2)
+
+    def _load(self) -> tuple[np.ndarray, list[tuple[str, int, str]]]:
+        signatures, records = [], []
+        for json_file, info in sorted(self.manifest["files"].items()):
+            signatures.append(np.load(os.path.join(self.index_dir, f"{info['shard']}.npy")))
+            with open(os.path.join(self.index_dir, f"{info['shard']}.json"), "r", encoding="utf-8") as file:
+                records.extend((json_file, index, question) for index, question in json.load(file))
+
+        if not signatures:
+            return np.zeros((0, self.manifest["num_perm"]), dtype=np.uint32), records
+        return np.concatenate(signatures), records
+
+    def find_clusters(self, threshold: float) -> list[list[dict]]:
+        signatures, records = self._load()
+        bands, rows = lsh_parameters(self.manifest["num_perm"], threshold)
+
+        # Entries sharing any band bucket are candidates, verified on the estimated Jaccard similarity
+        parent = list(range(len(records)))
+
+        def find(idx: int) -> int:
+            while parent[idx] != idx:
+                parent[idx] = parent[parent[idx]]
+                idx = parent[idx]
+            return idx
+
+        similarity: dict[int, float] = {}
+        for band in range(bands):
+            buckets: dict[bytes, list[int]] = {}
+            band_values = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+            for idx in range(len(records)):
+                buckets.setdefault(band_values[idx].tobytes(), []).append(idx)
+
+            for members in buckets.values():
+                if len(members) < 2:
+                    continue
+                anchor = members[0]
+                scores = (signatures[members[1:]] == signatures[anchor]).mean(axis=1)
+                for member, score in zip(members[1:], scores):
+                    if score >= threshold:
+                        root_anchor, root_member = find(anchor), find(member)
+                        if root_anchor != root_member:
+                            parent[root_member] = root_anchor
+                        # Best match of each entry within its cluster, for the anchor as well as the member
+                        for idx in (anchor, member):
+                            similarity[idx] = max(similarity.get(idx, 0.0), float(score))
+
+        clusters: dict[int, list[int]] = {}
+        for idx in range(len(records)):
+            clusters.setdefault(find(idx), []).append(idx)
+
+        report = []
+        for members in clusters.values():
+            if len(members) < 2:
+                continue
+            report.append([
+                {
+                    "file": records[idx][0],
+                    "index": records[idx][1],
+                    "question": records[idx][2],
+                    "similarity": round(similarity[idx], 3),
+                }
+                for idx in members
+            ])
+
+        return sorted(report, key=len, reverse=True)
+
+
+def print_report(console: Console, clusters: list[list[dict]], limit: Optional[int]) -> None:
+    if not clusters:
+        return console.print("No near-duplicate questions found", style="green")
+
+    console.print(f"Found {len(clusters)} clusters of near-duplicate questions", style="yellow")
+
+    for cluster_num, cluster in enumerate(clusters[:limit], 1):
+        table = Table(title=f"Cluster {cluster_num}", show_header=True, header_style="bold magenta")
+        table.add_column("File", justify="left")
+        table.add_column("Index", justify="right")
+        table.add_column("Best match", justify="right")
+        table.add_column("Question", justify="left")
+        for member in cluster:
+            table.add_row(member["file"], str(member["index"]), f"{member['similarity']:.2f}", member["question"])
+        console.print(table)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="*", help="Dataset JSON files or directories to add to the index")
+    parser.add_argument("--index_dir", type=str, required=True, help="Directory where the MinHash index is stored")
+    parser.add_argument("--threshold", type=float, default=0.8, help="Minimum estimated Jaccard similarity of near duplicates")
+    parser.add_argument("--num_perm", type=int, default=128, help="Number of MinHash permutations")
+    parser.add_argument("--shingle_size", type=int, default=5, help="Character shingle length")
+    parser.add_argument("--report_file", type=str, default=None, help="Write the clusters to this JSON file")
+    parser.add_argument("--show", type=int, default=20, help="Number of clusters to print")
+    args = parser.parse_args()
+
+    index = NearDuplicateIndex(args.index_dir, args.num_perm, args.shingle_size)
+    index.add_files(args.paths)
+    clusters = index.find_clusters(args.threshold)
+
+    if args.report_file:
+        with open(args.report_file, "w", encoding="utf-8") as file:
+            json.dump(clusters, file, ensure_ascii=False, indent=2)
+
+    print_report(index.console, clusters, args.show)